@@ -1,10 +1,13 @@
 from textwrap import dedent
 
+import httpx
 import pytest
 from httpx import Response
 
 from wacli.plugin_manager import PluginManager
 
+from .utils import MockArasServer, mets_document
+
 aras_rest_base_url = "http://dnb-test-aras/"
 aras_repository = "example_warc"
 
@@ -98,3 +101,135 @@ def test_retrieve_stream(respx_mock, tmp_path):
         name, stream, metadata = next(container)
         with stream() as bytes_io:
             bytes_io.read() == example_content_1.encode("utf-8")
+
+
+class BrokenStream(httpx.SyncByteStream):
+    """A response body, that breaks after the first chunk."""
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+
+    def __iter__(self):
+        yield self.chunk
+        raise httpx.ReadError("connection reset")
+
+
+@pytest.mark.respx(base_url=aras_rest_base_url)
+def test_retrieve_stream_resumes_broken_transfer(respx_mock, tmp_path):
+    idn = "1234567890"
+    content = b"A WARC content, that is transferred in two parts"
+
+    respx_mock.get(
+        f"/access/repositories/{aras_repository}/artifacts/{idn}/objects"
+    ).mock(return_value=Response(200, text=mets_document({"example.warc": content})))
+
+    requested_ranges = []
+
+    def object_response(request):
+        requested_ranges.append(request.headers.get("Range"))
+        if "Range" in request.headers:
+            return Response(206, content=content[10:])
+        return Response(200, stream=BrokenStream(content[:10]))
+
+    respx_mock.get(
+        f"/access/repositories/{aras_repository}/artifacts/{idn}/objects/0"
+    ).mock(side_effect=object_response)
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+
+    test_storage = plugin_manager.get("test_storage")
+    _, container, _ = next(test_storage.retrieve_stream([idn]))
+    name, stream, metadata = next(container)
+
+    assert name == "example.warc"
+    assert metadata["size"] == len(content)
+    with stream() as bytes_io:
+        assert bytes_io.read() == content
+    assert requested_ranges == [None, "bytes=10-"]
+
+
+def test_retrieve_stream_reuses_connections(tmp_path):
+    artifacts = {
+        f"10000000{i}": {
+            f"example_{j}.warc": f"content {i} {j}".encode() for j in range(3)
+        }
+        for i in range(2)
+    }
+
+    with MockArasServer(aras_repository, artifacts) as server:
+        plugin_manager = PluginManager()
+        plugin_config = get_plugin_config(tmp_path)
+        plugin_config["test_storage"][0]["rest_base"] = server.rest_base
+        plugin_config["test_storage"][0]["pool_size"] = 2
+        plugin_manager.register_plugins(plugin_config)
+
+        test_storage = plugin_manager.get("test_storage")
+        for idn, container, _ in test_storage.retrieve_stream(list(artifacts)):
+            for name, stream, _ in container:
+                with stream() as bytes_io:
+                    assert bytes_io.read() == artifacts[idn][name]
+
+    assert len(server.requests) == 8
+    assert server.connections == 1
+
+
+@pytest.mark.respx(base_url=aras_rest_base_url)
+def test_objects_listing_cache(respx_mock, tmp_path):
+    idn = "1234567890"
+    mets = mets_document({"example.warc": b"content"})
+
+    def listing_response(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return Response(304)
+        return Response(200, text=mets, headers={"ETag": '"v1"'})
+
+    listing_route = respx_mock.get(
+        f"/access/repositories/{aras_repository}/artifacts/{idn}/objects"
+    ).mock(side_effect=listing_response)
+
+    def list_files(cache_ttl):
+        plugin_manager = PluginManager()
+        plugin_config = get_plugin_config(tmp_path)
+        plugin_config["test_storage"][0]["cache_dir"] = tmp_path / "cache"
+        plugin_config["test_storage"][0]["cache_ttl"] = cache_ttl
+        plugin_manager.register_plugins(plugin_config)
+        test_storage = plugin_manager.get("test_storage")
+        _, container, _ = next(test_storage.retrieve_stream([idn]))
+        return [name for name, _, _ in container]
+
+    assert list_files(cache_ttl=3600) == ["example.warc"]
+    assert list_files(cache_ttl=3600) == ["example.warc"]
+    assert listing_route.call_count == 1
+
+    # an expired listing is revalidated
+    assert list_files(cache_ttl=0) == ["example.warc"]
+    assert listing_route.call_count == 2
+    assert listing_route.calls.last.response.status_code == 304
+
+
+@pytest.mark.respx(base_url=aras_rest_base_url)
+def test_retrieve_stream_backs_off_when_overloaded(respx_mock, tmp_path):
+    idn = "1234567890"
+
+    listing_route = respx_mock.get(
+        f"/access/repositories/{aras_repository}/artifacts/{idn}/objects"
+    ).mock(
+        side_effect=[
+            Response(503, headers={"Retry-After": "0"}),
+            Response(200, text=mets_document({"example.warc": b"content"})),
+        ]
+    )
+
+    plugin_manager = PluginManager()
+    plugin_config = get_plugin_config(tmp_path)
+    plugin_config["test_storage"][0]["max_concurrency"] = 4
+    plugin_config["test_storage"][0]["max_requests_per_second"] = 100
+    plugin_manager.register_plugins(plugin_config)
+
+    test_storage = plugin_manager.get("test_storage")
+    _, container, _ = next(test_storage.retrieve_stream([idn]))
+
+    assert [name for name, _, _ in container] == ["example.warc"]
+    assert listing_route.call_count == 2
+    assert test_storage.limiter.limit < 4
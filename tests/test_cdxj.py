@@ -0,0 +1,48 @@
+import json
+
+from wacli.cdxj import cdxj_line, cdxj_lines, record_fields, surt
+
+
+def test_surt():
+    assert surt("http://www.Example.org/") == "org,example)/"
+    assert surt("https://example.org") == "org,example)/"
+    assert surt("http://example.org:8080/a?b=2&a=1") == "org,example:8080)/a?a=1&b=2"
+    assert surt("https://example.org:443/") == "org,example)/"
+    assert surt("dns:example.org") == "dns:example.org"
+
+
+def test_record_fields():
+    head = (
+        b"WARC/1.0\r\n"
+        b"WARC-Type: response\r\n"
+        b"WARC-Target-URI: http://example.com/\r\n"
+        b"WARC-Date: 2017-03-06T04:02:06Z\r\n"
+        b"WARC-Payload-Digest: sha1:G7HRM7BGOKSKMSXZAHMUQTTV53QOFSMK\r\n"
+        b"Content-Type: application/http; msgtype=response\r\n"
+        b"Content-Length: 100\r\n\r\n"
+        b"HTTP/1.1 200 OK\r\n"
+        b"Content-Type: text/html; charset=utf-8\r\n\r\n"
+        b"<html>"
+    )
+    fields = record_fields(head)
+
+    assert fields == {
+        "urlkey": "com,example)/",
+        "timestamp": "20170306040206",
+        "url": "http://example.com/",
+        "mime": "text/html",
+        "status": "200",
+        "digest": "G7HRM7BGOKSKMSXZAHMUQTTV53QOFSMK",
+    }
+    assert record_fields(head.replace(b"response\r\n", b"request\r\n", 1)) is None
+
+    line = cdxj_line(fields, 784, 1228, "example.warc.gz")
+    urlkey, timestamp, values = line.split(" ", 2)
+    assert (urlkey, timestamp) == ("com,example)/", "20170306040206")
+    assert json.loads(values)["offset"] == "784"
+    assert json.loads(values)["filename"] == "example.warc.gz"
+
+    lines = cdxj_lines(
+        [(fields, 2, 1), (None, 1, 1), ({**fields, "timestamp": "2016"}, 3, 1)], "a"
+    )
+    assert [line.split(" ")[1] for line in lines] == ["2016", "20170306040206"]
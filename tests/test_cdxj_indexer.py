@@ -0,0 +1,137 @@
+import gzip
+import os
+from pathlib import Path
+from shutil import copyfile
+
+from wacli.compression import ZSTD_MAGIC
+from wacli.plugin_manager import PluginManager
+
+ASSETS = Path(os.path.dirname(__file__)) / "assets"
+
+
+def get_plugin_config(
+    index_path, warc_path, jobs=1, clean_warc_path=None, archive_path=None
+):
+    return {
+        "test_indexer": [
+            {
+                "module": "wacli_plugins.indexer.cdxj",
+                "path": str(index_path),
+                "warc_path": str(warc_path),
+                "clean_warc_path": clean_warc_path and str(clean_warc_path),
+                "archive_path": archive_path and str(archive_path),
+                "jobs": jobs,
+            }
+        ],
+    }
+
+
+def test_index_warcs(tmp_path):
+    warc_path = tmp_path / "warcs"
+    index_path = tmp_path / "indexes"
+    (warc_path / "1111").mkdir(parents=True)
+    warcs = []
+    for name in ["warcio_example.warc.gz", "https_example_org.warc.gz"]:
+        copyfile(ASSETS / name, warc_path / "1111" / name)
+        warcs.append(warc_path / "1111" / name)
+    with gzip.open(ASSETS / "warcio_example.warc.gz") as records:
+        (warc_path / "1111" / "example.warc").write_bytes(records.read())
+    warcs.append(warc_path / "1111" / "example.warc")
+    # whole file gzip can not be indexed, it is skipped
+    copyfile(
+        ASSETS / "warcio_example-bad-non-chunked.warc.gz", warc_path / "bad.warc.gz"
+    )
+    warcs.append(warc_path / "bad.warc.gz")
+    # a corrupt zstd frame is skipped, too
+    (warc_path / "bad.warc.zst").write_bytes(ZSTD_MAGIC + b"not zstd" * 10)
+    warcs.append(warc_path / "bad.warc.zst")
+
+    for jobs in [1, 2]:
+        plugin_manager = PluginManager()
+        plugin_manager.register_plugins(get_plugin_config(index_path, warc_path, jobs))
+        test_indexer = plugin_manager.get("test_indexer")
+
+        assert test_indexer.index(warcs) == warcs[:3]
+
+        lines = (index_path / "1111%2Fwarcio_example.warc.gz.cdxj").read_text()
+        assert lines.splitlines()[0].startswith("com,example)/ 20170306040206 {")
+        assert '"offset": "784"' in lines
+        assert '"filename": "1111/warcio_example.warc.gz"' in lines
+        assert lines == "".join(sorted(lines.splitlines(True)))
+        # the offsets of the uncompressed file are different, the records are not
+        uncompressed = (index_path / "1111%2Fexample.warc.cdxj").read_text()
+        assert len(uncompressed.splitlines()) == len(lines.splitlines())
+        assert not (index_path / "bad.warc.gz.cdxj").exists()
+
+
+def test_index_uses_sidecar(tmp_path):
+    warc_path = tmp_path / "warcs"
+    index_path = tmp_path / "indexes"
+    warc_path.mkdir()
+    warc = warc_path / "example.warc.gz"
+    copyfile(ASSETS / "https_example_org.warc.gz", warc)
+    (warc_path / "example.warc.gz.cdxj").write_text(
+        'org,example)/ 2024 {"offset": "0", "filename": "example.warc.gz"}\n'
+    )
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(index_path, tmp_path))
+    test_indexer = plugin_manager.get("test_indexer")
+    test_indexer.index([warc])
+
+    assert (index_path / "warcs%2Fexample.warc.gz.cdxj").read_text() == (
+        'org,example)/ 2024 {"offset": "0", "filename": "warcs/example.warc.gz"}\n'
+    )
+
+
+def test_index_recompressed_warcs(tmp_path):
+    """The filename of a recompressed file is relative to the clean_warc_path."""
+    warc_path = tmp_path / "warcs"
+    clean_warc_path = tmp_path / "clean"
+    index_path = tmp_path / "indexes"
+    (clean_warc_path / "1111").mkdir(parents=True)
+    warc = clean_warc_path / "1111" / "example.warc.gz"
+    copyfile(ASSETS / "https_example_org.warc.gz", warc)
+    # the recompression writes the sidecar with the name of the file
+    (clean_warc_path / "1111" / "example.warc.gz.cdxj").write_text(
+        'org,example)/ 2024 {"offset": "0", "filename": "example.warc.gz"}\n'
+    )
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(
+        get_plugin_config(index_path, warc_path, clean_warc_path=clean_warc_path)
+    )
+    test_indexer = plugin_manager.get("test_indexer")
+    test_indexer.index([warc])
+
+    assert (index_path / "1111%2Fexample.warc.gz.cdxj").read_text() == (
+        'org,example)/ 2024 {"offset": "0", "filename": "1111/example.warc.gz"}\n'
+    )
+
+
+def test_index_to_archive(tmp_path):
+    warc_path = tmp_path / "warcs"
+    archive_path = tmp_path / "collection" / "archive"
+    index_path = tmp_path / "collection" / "indexes"
+    warcs = [warc_path / "a" / "b_c.warc.gz", warc_path / "a_b" / "c.warc.gz"]
+    for warc in warcs:
+        warc.parent.mkdir(parents=True)
+        copyfile(ASSETS / "https_example_org.warc.gz", warc)
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(
+        get_plugin_config(index_path, warc_path, archive_path=archive_path)
+    )
+    test_indexer = plugin_manager.get("test_indexer")
+    assert test_indexer.index(warcs) == warcs
+    # indexing again keeps the links
+    assert test_indexer.index(warcs) == warcs
+
+    # the files of different directories have their own index
+    assert sorted(p.name for p in index_path.iterdir()) == [
+        "a%2Fb_c.warc.gz.cdxj",
+        "a_b%2Fc.warc.gz.cdxj",
+    ]
+    # pywb finds the files by their filename in the archive of the collection
+    for name in ["a/b_c.warc.gz", "a_b/c.warc.gz"]:
+        assert (archive_path / name).stat().st_ino == (warc_path / name).stat().st_ino
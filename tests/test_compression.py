@@ -0,0 +1,97 @@
+import gzip
+import os
+import zlib
+from importlib.util import find_spec
+from pathlib import Path
+from shutil import copyfile
+
+import pytest
+from click.testing import CliRunner
+
+from wacli.compression import (
+    available_backends,
+    benchmark,
+    check_format,
+    check_level,
+    compress_member,
+    get_backend,
+)
+from wacli.plugin_manager import ConfigurationError
+from wacli.run import cli
+
+ASSETS = Path(os.path.dirname(__file__)) / "assets"
+
+
+def test_get_backend():
+    assert get_backend() is zlib
+    assert get_backend("zlib") is zlib
+    assert "zlib" in available_backends()
+    assert get_backend("auto") is get_backend(available_backends()[0])
+
+    with pytest.raises(ConfigurationError):
+        get_backend("lzma")
+    if not find_spec("isal"):
+        with pytest.raises(ConfigurationError):
+            get_backend("isal")
+
+
+def test_check_level():
+    assert check_level(None) == 6
+    assert check_level(None, "isal") == 2
+    assert check_level(9, "zlib-ng") == 9
+    assert check_level(None, zlib) == 6
+    assert check_level(3, "isal") == 3
+
+    with pytest.raises(ConfigurationError):
+        check_level(6, "isal")
+    with pytest.raises(ConfigurationError):
+        check_level(10, "zlib")
+
+
+def test_compress_member():
+    data = b"WARC/1.0\r\n" * 1000
+    member = compress_member(data, level=9)
+
+    assert gzip.decompress(member) == data
+    # no time in the header, so the members are reproducible
+    assert member[4:8] == b"\0\0\0\0"
+    assert len(compress_member(data, level=0)) > len(member)
+
+
+def test_benchmark():
+    result = benchmark([b"WARC/1.0\r\n" * 1000] * 10, "zlib", 6)
+
+    assert result["bytes"] == 100000
+    assert result["ratio"] < 0.1
+    assert result["mb_per_second"] > 0
+
+
+def test_check_format():
+    check_format("gzip")
+    with pytest.raises(ConfigurationError):
+        check_format("lzma")
+
+
+def test_benchmark_compression_command(tmp_path):
+    warc_path = tmp_path / "warcs"
+    (warc_path / "1111").mkdir(parents=True)
+    copyfile(ASSETS / "warcio_example.warc.gz", warc_path / "1111" / "a.warc.gz")
+    # the CDXJ sidecar of a recompressed file is no sample
+    (warc_path / "1111" / "a.warc.gz.cdxj").write_text("org,example)/ 2024 {}\n")
+    args = ["--warc-dir", str(warc_path), "benchmark-compression"]
+
+    result = CliRunner().invoke(cli, [*args, "-b", "zlib", "-l", "1"])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("zlib     level 1:")
+
+    # ISA-L has no level 9, if it is installed at all
+    result = CliRunner().invoke(cli, [*args, "-b", "isal", "-l", "9"])
+    assert result.exit_code == 2
+    assert "Invalid value for '--backend' / '--level'" in result.output
+
+    bad = tmp_path / "bad.warc.gz"
+    with gzip.open(bad, "wb") as bad_io:
+        bad_io.write(b"no WARC")
+    result = CliRunner().invoke(cli, ["benchmark-compression", str(bad)])
+    assert result.exit_code == 1
+    assert f"Could not read the records of {bad}" in result.output
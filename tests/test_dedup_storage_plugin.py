@@ -0,0 +1,91 @@
+import os
+from io import BytesIO
+
+from wacli.plugin_manager import PluginManager
+
+
+def get_plugin_config(path):
+    return {
+        "test_storage": [
+            {
+                "module": "wacli_plugins.storage.dedup",
+                "path": path,
+            }
+        ]
+    }
+
+
+def test_store_stream_deduplicates(tmp_path):
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+
+    test_storage = plugin_manager.get("test_storage")
+    same = b"the same WARC content" * 100
+    other = b"other WARC content"
+
+    test_storage.store_stream(
+        [
+            ("1111", [("a.warc.gz", lambda: BytesIO(same), {})], {}),
+            ("2222", [("b.warc.gz", lambda: BytesIO(same), {})], {}),
+            ("3333", [("c.warc.gz", lambda: BytesIO(other), {})], {}),
+        ]
+    )
+
+    a = tmp_path / "1111" / "a.warc.gz"
+    b = tmp_path / "2222" / "b.warc.gz"
+    assert a.read_bytes() == b.read_bytes() == same
+    assert a.stat().st_ino == b.stat().st_ino
+    assert (tmp_path / "3333" / "c.warc.gz").read_bytes() == other
+    assert sorted(test_storage.list()) == ["1111", "2222", "3333"]
+    assert len(list(test_storage.list_files())) == 3
+
+    stats = test_storage.stats()
+    assert stats["files"] == 3
+    assert stats["unique_files"] == 2
+    assert stats["bytes"] == 2 * len(same) + len(other)
+    assert stats["unique_bytes"] == len(same) + len(other)
+    assert stats["saved_bytes"] == len(same)
+    assert stats["dedup_ratio"] > 1
+
+
+def test_overwrite_does_not_change_other_files(tmp_path):
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+
+    test_storage = plugin_manager.get("test_storage")
+    same = b"the same WARC content"
+    test_storage.store("1111/a.warc.gz", lambda: BytesIO(same))
+    test_storage.store("2222/b.warc.gz", lambda: BytesIO(same))
+
+    # the manifest skips complete files, unless the source announces other content
+    test_storage.store("1111/a.warc.gz", lambda: BytesIO(b"changed"), {"size": 7})
+    with test_storage.retrieve("2222/c.warc.gz", "wb")[0]() as target_io:
+        target_io.write(b"written")
+
+    assert (tmp_path / "1111" / "a.warc.gz").read_bytes() == b"changed"
+    assert (tmp_path / "2222" / "b.warc.gz").read_bytes() == same
+
+    test_storage.store("2222/b.warc.gz", lambda: BytesIO(b"changed"), {"size": 7})
+    assert test_storage.collect_garbage() == 1
+    assert test_storage.stats()["unique_files"] == 1
+
+
+def test_store_same_content_again(tmp_path):
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+
+    test_storage = plugin_manager.get("test_storage")
+    same = b"the same WARC content"
+    test_storage.store("1111/a.warc.gz", lambda: BytesIO(same))
+    a = tmp_path / "1111" / "a.warc.gz"
+    # a changed modification time stores the file again
+    stat = a.stat()
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    test_storage.store("1111/a.warc.gz", lambda: BytesIO(same))
+
+    assert [p.name for p in (tmp_path / "1111").iterdir()] == ["a.warc.gz"]
+    assert a.read_bytes() == same
+    assert a.stat().st_nlink == 2
+
+    a.unlink()
+    assert test_storage.collect_garbage() == 1
@@ -1,7 +1,14 @@
+import hashlib
+import time
+from base64 import b32encode
+from contextlib import contextmanager
 from io import BytesIO, StringIO, TextIOWrapper
+from threading import Lock
 
+import pytest
 from loguru import logger
 
+import wacli.transfer
 from wacli.plugin_manager import PluginManager
 
 
@@ -145,3 +152,450 @@ def test_store_stream(tmp_path):
     pb = tmp_path / example_binary_file
     assert pb.read_text() == binary_content
     assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_store_stream_concurrent(tmp_path):
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+
+    test_storage = plugin_manager.get("test_storage")
+
+    active = []
+    peak = []
+    lock = Lock()
+
+    @contextmanager
+    def slow_source(content):
+        with lock:
+            active.append(content)
+            peak.append(len(active))
+        time.sleep(0.05)
+        yield BytesIO(content)
+        with lock:
+            active.remove(content)
+
+    def source(content):
+        return lambda: slow_source(content)
+
+    storage_stream = [
+        (
+            f"idn_{i}",
+            iter(
+                [(f"file_{j}.warc", source(f"{i}-{j}".encode()), {}) for j in range(3)]
+            ),
+            {},
+        )
+        for i in range(4)
+    ]
+
+    test_storage.store_stream(storage_stream, jobs=4)
+
+    for i in range(4):
+        for j in range(3):
+            assert (tmp_path / f"idn_{i}" / f"file_{j}.warc").read_text() == f"{i}-{j}"
+    assert max(peak) > 1
+
+
+def test_store_with_manifest_skips_complete_files(tmp_path):
+    plugin_manager = PluginManager()
+    config = get_plugin_config(tmp_path)
+    config["test_storage"][0]["manifest"] = ".wacli/manifest.sqlite"
+    plugin_manager.register_plugins(config)
+
+    test_storage = plugin_manager.get("test_storage")
+    content = b"some WARC content"
+    opened = []
+
+    def source():
+        opened.append(True)
+        return BytesIO(content)
+
+    metadata = {"size": len(content)}
+    test_storage.store_stream([("1234567890", [("a.warc.gz", source, metadata)], {})])
+    test_storage.store_stream([("1234567890", [("a.warc.gz", source, metadata)], {})])
+
+    p = tmp_path / "1234567890" / "a.warc.gz"
+    assert p.read_bytes() == content
+    assert len(opened) == 1
+    assert test_storage.manifest.get("1234567890/a.warc.gz")["idn"] == "1234567890"
+    assert list(test_storage.list_files()) == [p]
+    assert test_storage.list() == ["1234567890"]
+
+    # a partially written file is fetched again
+    p.write_bytes(content[:5])
+    test_storage.store_stream([("1234567890", [("a.warc.gz", source, metadata)], {})])
+    assert p.read_bytes() == content
+    assert len(opened) == 2
+
+
+def test_store_records_and_verifies_digests(tmp_path):
+    plugin_manager = PluginManager()
+    config = get_plugin_config(tmp_path)
+    config["test_storage"][0]["manifest"] = ".wacli/manifest.sqlite"
+    plugin_manager.register_plugins(config)
+
+    test_storage = plugin_manager.get("test_storage")
+    content = b"some WARC content"
+    md5 = hashlib.md5(content).hexdigest()
+
+    test_storage.store(
+        "good.warc", lambda: BytesIO(content), {"checksum": f"md5:{md5}"}
+    )
+    test_storage.store("bad.warc", lambda: BytesIO(content), {"checksum": "md5:0000"})
+
+    good = test_storage.manifest.get("good.warc")
+    assert good["complete"]
+    assert good["sha256"] == hashlib.sha256(content).hexdigest()
+    assert good["sha1"] == "sha1:" + b32encode(hashlib.sha1(content).digest()).decode()
+    assert not test_storage.manifest.get("bad.warc")["complete"]
+
+
+def test_store_commits_complete_partial_file(tmp_path):
+    plugin_manager = PluginManager()
+    config = get_plugin_config(tmp_path)
+    config["test_storage"][0]["manifest"] = ".wacli/manifest.sqlite"
+    plugin_manager.register_plugins(config)
+
+    test_storage = plugin_manager.get("test_storage")
+    content = b"some WARC content"
+    metadata = {
+        "size": len(content),
+        "checksum": f"md5:{hashlib.md5(content).hexdigest()}",
+    }
+    opened = []
+
+    def source():
+        opened.append(True)
+        return BytesIO(content)
+
+    # the process stopped after the file was written, but before it was renamed
+    (tmp_path / ".good.warc.part").write_bytes(content)
+    test_storage.store("good.warc", source, metadata)
+
+    assert opened == []
+    assert (tmp_path / "good.warc").read_bytes() == content
+    assert not (tmp_path / ".good.warc.part").exists()
+    good = test_storage.manifest.get("good.warc")
+    assert good["complete"]
+    assert good["sha256"] == hashlib.sha256(content).hexdigest()
+
+    # a file of the full size, that does not match the checksum, is written again
+    (tmp_path / ".other.warc.part").write_bytes(bytes(len(content)))
+    test_storage.store("other.warc", source, metadata)
+
+    assert opened == [True]
+    assert (tmp_path / "other.warc").read_bytes() == content
+
+
+def test_list_from_index(tmp_path):
+    plugin_manager = PluginManager()
+    config = get_plugin_config(tmp_path)
+    config["test_storage"][0]["index"] = True
+    plugin_manager.register_plugins(config)
+
+    test_storage = plugin_manager.get("test_storage")
+    # a file, that exists before the index is built
+    (tmp_path / "1111").mkdir()
+    (tmp_path / "1111" / "old.warc.gz").write_bytes(b"old")
+
+    assert test_storage.list() == ["1111"]
+
+    test_storage.store_stream(
+        [
+            (
+                "2222",
+                [
+                    ("a.warc.gz", lambda: BytesIO(b"a" * 10), {"size": 10}),
+                    ("b.cdxj", lambda: BytesIO(b"b" * 20), {"size": 20}),
+                ],
+                {},
+            )
+        ]
+    )
+    # written without the storage, so it is only listed after a reindex
+    (tmp_path / "3333").mkdir()
+    (tmp_path / "3333" / "c.warc.gz").write_bytes(b"c")
+
+    assert test_storage.list() == ["1111", "2222"]
+    assert list(test_storage.list_files(pattern="*.warc.gz")) == [
+        tmp_path / "1111" / "old.warc.gz",
+        tmp_path / "2222" / "a.warc.gz",
+    ]
+    assert list(test_storage.list_files(lambda name: name.startswith("b"))) == [
+        tmp_path / "2222" / "b.cdxj"
+    ]
+    assert list(test_storage.manifest.paths(min_size=15)) == ["2222/b.cdxj"]
+    sha256 = test_storage.manifest.get("2222/a.warc.gz")["sha256"]
+
+    (tmp_path / "1111" / "old.warc.gz").unlink()
+    assert test_storage.reindex() == 3
+    assert test_storage.list() == ["2222", "3333"]
+    assert list(test_storage.list_files(pattern="*.warc.gz")) == [
+        tmp_path / "2222" / "a.warc.gz",
+        tmp_path / "3333" / "c.warc.gz",
+    ]
+    # the digests of unchanged files are kept
+    assert test_storage.manifest.get("2222/a.warc.gz")["sha256"] == sha256
+
+
+def test_list_files_pattern_without_index(tmp_path):
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+    test_storage = plugin_manager.get("test_storage")
+
+    test_storage.store("a/x.warc.gz", lambda: BytesIO(b"x"))
+    test_storage.store("a/x.cdxj", lambda: BytesIO(b"x"))
+
+    assert list(test_storage.list_files(pattern="*.warc.gz")) == [
+        tmp_path / "a" / "x.warc.gz"
+    ]
+
+
+def test_sharded_layout(tmp_path):
+    plugin_manager = PluginManager()
+    config = get_plugin_config(tmp_path)
+    config["test_storage"][0]["shard_depth"] = 2
+    config["test_storage"][0]["manifest"] = ".wacli/manifest.sqlite"
+    plugin_manager.register_plugins(config)
+
+    test_storage = plugin_manager.get("test_storage")
+    test_storage.store_stream(
+        [
+            ("1111", [("a.warc.gz", lambda: BytesIO(b"a"), {})], {}),
+            ("2222", [("b.warc.gz", lambda: BytesIO(b"b"), {})], {}),
+        ]
+    )
+
+    a = tmp_path.joinpath(*test_storage._shard("1111"), "1111", "a.warc.gz")
+    assert a.read_bytes() == b"a"
+    assert len(a.parent.parent.parent.name) == 2
+    assert sorted(test_storage.list()) == ["1111", "2222"]
+    assert sorted(p.name for p in test_storage.list_files()) == [
+        "a.warc.gz",
+        "b.warc.gz",
+    ]
+    assert test_storage.manifest.get("1111/a.warc.gz")["complete"]
+
+    for id, stream, _ in test_storage.retrieve_stream(["1111"], mode="rb"):
+        assert id == "1111"
+        for name, data, _ in stream:
+            with data() as f:
+                assert (name, f.read()) == ("a.warc.gz", b"a")
+
+
+def test_relayout(tmp_path):
+    for idn in ["1111", "2222"]:
+        (tmp_path / idn).mkdir()
+        (tmp_path / idn / "a.warc.gz").write_bytes(idn.encode())
+    plugin_manager = PluginManager()
+    config = get_plugin_config(tmp_path)
+    config["test_storage"][0]["shard_depth"] = 2
+    plugin_manager.register_plugins(config)
+    test_storage = plugin_manager.get("test_storage")
+
+    assert test_storage.relayout(shard_depth=0) == 2
+    # an interrupted relayout can be continued
+    assert test_storage.relayout(shard_depth=0) == 0
+
+    assert sorted(test_storage.list()) == ["1111", "2222"]
+    with test_storage.retrieve("2222/a.warc.gz", "rb")[0]() as f:
+        assert f.read() == b"2222"
+
+    # and back to the flat layout
+    test_storage.shard_depth = 0
+    assert test_storage.relayout(shard_depth=2) == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["1111", "2222"]
+
+
+def test_store_hardlinks_local_files(tmp_path):
+    plugin_manager = PluginManager()
+    config = get_plugin_config(tmp_path / "target")
+    config["test_storage"][0]["hardlink"] = True
+    plugin_manager.register_plugins(config)
+    test_storage = plugin_manager.get("test_storage")
+
+    source = tmp_path / "source.warc.gz"
+    source.write_bytes(b"canonical WARC")
+    metadata = {"path": str(source), "size": source.stat().st_size}
+    test_storage.store_stream(
+        [("1111", [("a.warc.gz", lambda: open(source, "rb"), metadata)], {})]
+    )
+
+    target = tmp_path / "target" / "1111" / "a.warc.gz"
+    assert target.stat().st_ino == source.stat().st_ino
+
+    # storing other data replaces the link, the source is not changed
+    test_storage.store("1111/a.warc.gz", lambda: BytesIO(b"other"))
+    assert target.read_bytes() == b"other"
+    assert source.read_bytes() == b"canonical WARC"
+
+
+def test_store_stream_hardlinks_without_size(tmp_path):
+    source_path = tmp_path / "source"
+    target_path = tmp_path / "target"
+    plugin_manager = PluginManager()
+    target_config = get_plugin_config(target_path)["test_storage"]
+    target_config[0]["hardlink"] = True
+    plugin_manager.register_plugins(
+        {
+            "source_storage": get_plugin_config(source_path)["test_storage"],
+            "target_storage": target_config,
+        }
+    )
+    source_storage = plugin_manager.get("source_storage")
+    target_storage = plugin_manager.get("target_storage")
+
+    (source_path / "1111").mkdir(parents=True)
+    source = source_path / "1111" / "a.warc.gz"
+    source.write_bytes(b"canonical WARC")
+    advanced = []
+
+    def callback(advance, total, name):
+        advanced.append((advance, total))
+
+    # the metadata of the directory storage holds the path, but not the size
+    target_storage.store_stream(
+        source_storage.retrieve_stream(["1111"], mode="rb"), callback=callback
+    )
+
+    target = target_path / "1111" / "a.warc.gz"
+    assert target.stat().st_ino == source.stat().st_ino
+    assert not (target_path / "1111" / ".a.warc.gz.part").exists()
+    assert advanced == [(len(b"canonical WARC"), len(b"canonical WARC"))]
+
+
+def test_store_stream_hardlinks_twice(tmp_path):
+    source_path = tmp_path / "source"
+    target_path = tmp_path / "target"
+    plugin_manager = PluginManager()
+    target_config = get_plugin_config(target_path)["test_storage"]
+    target_config[0]["hardlink"] = True
+    plugin_manager.register_plugins(
+        {
+            "source_storage": get_plugin_config(source_path)["test_storage"],
+            "target_storage": target_config,
+        }
+    )
+    source_storage = plugin_manager.get("source_storage")
+    target_storage = plugin_manager.get("target_storage")
+
+    (source_path / "1111").mkdir(parents=True)
+    source = source_path / "1111" / "a.warc.gz"
+    source.write_bytes(b"canonical WARC")
+
+    for _ in range(2):
+        target_storage.store_stream(source_storage.retrieve_stream(["1111"], mode="rb"))
+
+    # no link is left behind, that the rename of a link onto itself would keep
+    assert [p.name for p in (target_path / "1111").iterdir()] == ["a.warc.gz"]
+    assert source.stat().st_nlink == 2
+
+    target = target_path / "1111" / "a.warc.gz"
+    temporary = target_path / "1111" / ".a.warc.gz.part"
+    temporary.hardlink_to(source)
+    target_storage._place(temporary, target)
+    assert not temporary.exists()
+    assert source.stat().st_nlink == 2
+
+
+def test_store_stream_local_files_zero_copy(tmp_path, monkeypatch):
+    source_path = tmp_path / "source"
+    target_path = tmp_path / "target"
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(
+        {
+            "source_storage": get_plugin_config(source_path)["test_storage"],
+            "target_storage": get_plugin_config(target_path)["test_storage"],
+        }
+    )
+    source_storage = plugin_manager.get("source_storage")
+    target_storage = plugin_manager.get("target_storage")
+
+    content = bytes(range(256)) * 1024
+    (source_path / "1234567890").mkdir(parents=True)
+    (source_path / "1234567890" / "a.warc.gz").write_bytes(content)
+
+    advanced = []
+
+    def callback(advance, total, name):
+        advanced.append(advance)
+
+    target_storage.store_stream(
+        source_storage.retrieve_stream(["1234567890"], mode="rb"), callback=callback
+    )
+    assert (target_path / "1234567890" / "a.warc.gz").read_bytes() == content
+    assert sum(advanced) == len(content)
+
+    # without support of the kernel the data is copied in chunks
+    def unsupported(*args):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(wacli.transfer, "_reflink", lambda *args: False)
+    monkeypatch.setattr(wacli.transfer, "_copy_file_range", unsupported)
+    monkeypatch.setattr(wacli.transfer, "_sendfile", unsupported)
+    (target_path / "1234567890" / "a.warc.gz").unlink()
+
+    target_storage.store_stream(
+        source_storage.retrieve_stream(["1234567890"], mode="rb")
+    )
+    assert (target_path / "1234567890" / "a.warc.gz").read_bytes() == content
+
+
+def test_store_is_atomic(tmp_path):
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+    test_storage = plugin_manager.get("test_storage")
+
+    class BrokenSource(BytesIO):
+        def read(self, size=-1):
+            if self.tell():
+                raise ConnectionError("connection lost")
+            return super().read(100)
+
+    with pytest.raises(ConnectionError):
+        test_storage.store(
+            "a.warc.gz", lambda: BrokenSource(bytes(1000)), {"size": 1000}
+        )
+
+    assert not (tmp_path / "a.warc.gz").exists()
+    assert (tmp_path / ".a.warc.gz.part").stat().st_size == 100
+    assert list(test_storage.list_files()) == []
+
+    test_storage.store("a.warc.gz", lambda: BytesIO(bytes(1000)), {"size": 1000})
+
+    assert (tmp_path / "a.warc.gz").stat().st_size == 1000
+    assert not (tmp_path / ".a.warc.gz.part").exists()
+
+
+def test_retrieve_stream_skips_partial_files(tmp_path):
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+    test_storage = plugin_manager.get("test_storage")
+
+    (tmp_path / "1111").mkdir()
+    (tmp_path / "1111" / "a.warc.gz").write_bytes(b"complete")
+    (tmp_path / "1111" / ".b.warc.gz.part").write_bytes(b"partial")
+    (tmp_path / "1111" / ".wacli").mkdir()
+
+    ((id, entries, _),) = test_storage.retrieve_stream(["1111"], mode="rb")
+    assert id == "1111"
+    assert [name for name, _, _ in entries] == ["a.warc.gz"]
+
+
+def test_store_reports_exact_progress(tmp_path):
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+    test_storage = plugin_manager.get("test_storage")
+
+    content = bytes(300 * 1024 + 7)
+    advanced = []
+
+    def callback(advance, total, name):
+        advanced.append(advance)
+
+    test_storage.store(
+        "a.warc.gz", lambda: BytesIO(content), {"size": len(content)}, callback
+    )
+
+    assert sum(advanced) == len(content)
+    assert len(advanced) == 1
@@ -1,10 +1,14 @@
+import time
 from textwrap import dedent
 
 import pytest
 from httpx import Response
+from loguru import logger
 
 from wacli.plugin_manager import PluginManager
 
+from .utils import MockArasServer, mets_document
+
 aras_rest_base_url = "http://dnb-test-aras/"
 aras_repository = "example_warc"
 
@@ -99,3 +103,66 @@ def test_store_text_io(tmp_path, respx_mock):
     local_repository = plugin_manager.get("target_storage")
 
     local_repository.store_stream(source_repository.retrieve_stream([idn]))
+
+
+def test_store_stream_concurrently_from_mock_aras(tmp_path):
+    artifacts = {
+        f"10000000{i}": {
+            f"example_{j}.warc.gz": f"WARC content {i} {j}".encode() for j in range(3)
+        }
+        for i in range(4)
+    }
+
+    durations = {}
+    with MockArasServer(aras_repository, artifacts, latency=0.05) as server:
+        for jobs in [1, 8]:
+            target = tmp_path / f"jobs_{jobs}"
+            plugin_manager = PluginManager()
+            plugin_config = get_plugin_config(target)
+            plugin_config["source_storage"][0]["rest_base"] = server.rest_base
+            plugin_manager.register_plugins(plugin_config)
+
+            source_repository = plugin_manager.get("source_storage")
+            local_repository = plugin_manager.get("target_storage")
+
+            start = time.perf_counter()
+            local_repository.store_stream(
+                source_repository.retrieve_stream(list(artifacts)), jobs=jobs
+            )
+            durations[jobs] = time.perf_counter() - start
+
+            for idn, files in artifacts.items():
+                for name, content in files.items():
+                    assert (target / idn / name).read_bytes() == content
+
+    logger.info(f"load durations by number of jobs: {durations}")
+    assert durations[8] < durations[1]
+
+
+@pytest.mark.respx(base_url=aras_rest_base_url)
+def test_store_resumes_partial_file(tmp_path, respx_mock):
+    idn = "1234567890"
+    content = b"A WARC content, that was partially stored before"
+
+    respx_mock.get(
+        f"/access/repositories/{aras_repository}/artifacts/{idn}/objects"
+    ).mock(return_value=Response(200, text=mets_document({"example.warc": content})))
+    object_route = respx_mock.get(
+        f"/access/repositories/{aras_repository}/artifacts/{idn}/objects/0"
+    ).mock(return_value=Response(206, content=content[20:]))
+
+    partial_file = tmp_path / idn / ".example.warc.part"
+    partial_file.parent.mkdir()
+    partial_file.write_bytes(content[:20])
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(tmp_path))
+
+    source_repository = plugin_manager.get("source_storage")
+    local_repository = plugin_manager.get("target_storage")
+
+    local_repository.store_stream(source_repository.retrieve_stream([idn]))
+
+    assert (tmp_path / idn / "example.warc").read_bytes() == content
+    assert not partial_file.exists()
+    assert object_route.calls.last.request.headers["Range"] == "bytes=20-"
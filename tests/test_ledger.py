@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+from shutil import copyfile
+
+from click.testing import CliRunner
+
+from wacli.ledger import LEDGER_PATH, Ledger
+from wacli.run import cli
+
+ASSETS = Path(os.path.dirname(__file__)) / "assets"
+
+
+def test_changed_files(tmp_path):
+    files = []
+    for name in ["a.warc.gz", "b.warc.gz", "c.warc.gz"]:
+        (tmp_path / "1111").mkdir(exist_ok=True)
+        (tmp_path / "1111" / name).write_bytes(b"WARC")
+        files.append(tmp_path / "1111" / name)
+
+    ledger = Ledger(tmp_path / LEDGER_PATH, tmp_path)
+    stats = ledger.stats(files)
+    assert ledger.changed("pywb", stats) == stats
+
+    ledger.record("pywb", ledger.changed("pywb", stats))
+    assert ledger.changed("pywb", ledger.stats(files)) == {}
+    # each indexer has its own ledger
+    assert len(ledger.changed("outbackcdx", ledger.stats(files))) == 3
+
+    # a changed size or modification time is indexed again, the ledger persists
+    files[0].write_bytes(b"WARC changed")
+    stat = files[1].stat()
+    os.utime(files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    ledger = Ledger(tmp_path / LEDGER_PATH, tmp_path)
+    assert list(ledger.changed("pywb", ledger.stats(files))) == files[:2]
+
+
+def test_purge(tmp_path):
+    files = []
+    for name in ["a.warc.gz", "b.warc.gz"]:
+        (tmp_path / name).write_bytes(b"WARC")
+        files.append(tmp_path / name)
+
+    ledger = Ledger(tmp_path / LEDGER_PATH, tmp_path)
+    ledger.record("pywb", ledger.stats(files))
+    ledger.record("outbackcdx", ledger.stats(files))
+    files[1].unlink()
+
+    assert ledger.stats(files).keys() == {files[0]}
+    assert ledger.purge("pywb", ledger.stats(files)) == 1
+    assert ledger.purge("pywb", ledger.stats(files)) == 0
+    # a file, that is added again, is indexed again
+    files[1].write_bytes(b"WARC")
+    assert list(ledger.changed("pywb", ledger.stats(files))) == [files[1]]
+    # the ledgers of the other indexers are purged on their own
+    assert ledger.purge("outbackcdx", [files[0]]) == 1
+
+
+def test_index_warcs_retries_failed_files(tmp_path):
+    warc_path = tmp_path / "warcs"
+    index_path = tmp_path / "pywb" / "collections" / "dnb" / "indexes"
+    (warc_path / "1111").mkdir(parents=True)
+    good = warc_path / "1111" / "good.warc.gz"
+    bad = warc_path / "1111" / "bad.warc.gz"
+    copyfile(ASSETS / "warcio_example.warc.gz", good)
+    # whole file gzip can not be indexed
+    copyfile(ASSETS / "warcio_example-bad-non-chunked.warc.gz", bad)
+    args = ["--warc-dir", str(warc_path), "--pywb-dir", str(tmp_path / "pywb")]
+    ledger_key = f"wacli_plugins.indexer.cdxj:{index_path}"
+
+    result = CliRunner().invoke(cli, [*args, "--pywb-native", "index-warcs"])
+    assert result.exit_code == 0, result.output
+    # only the indexed file is recorded
+    ledger = Ledger(warc_path / LEDGER_PATH, warc_path)
+    assert list(ledger.changed(ledger_key, ledger.stats([good, bad]))) == [bad]
+    assert not (index_path / "1111%2Fbad.warc.gz.cdxj").exists()
+
+    # the failed file is indexed by the next run, once it can be read
+    copyfile(ASSETS / "warcio_example.warc.gz", bad)
+    result = CliRunner().invoke(cli, [*args, "--pywb-native", "index-warcs"])
+    assert result.exit_code == 0, result.output
+    assert (index_path / "1111%2Fbad.warc.gz.cdxj").exists()
+    assert ledger.changed(ledger_key, ledger.stats([good, bad])) == {}
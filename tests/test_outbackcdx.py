@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+
+from wacli.compression import ZSTD_MAGIC
+from wacli.plugin_manager import PluginManager
+
+from .utils import MockOutbackCDXServer
+
+ASSETS = Path(os.path.dirname(__file__)) / "assets"
+outbackcdx_url = "http://dnb-test-outbackcdx/dnb"
+
+
+def get_plugin_config(warc_path, url=outbackcdx_url):
+    return {
+        "test_indexer": [
+            {
+                "module": "wacli_plugins.indexer.outbackcdx",
+                "url": url,
+                "warc_path": str(warc_path),
+                "batch_size": 1,
+                "backoff": 0,
+            }
+        ],
+    }
+
+
+@pytest.mark.respx()
+def test_index_warcs(respx_mock):
+    posted = []
+
+    def add(request):
+        posted.append(request.content.decode("utf-8"))
+        return httpx.Response(200, text="Added 1 records")
+
+    respx_mock.post(outbackcdx_url).mock(
+        side_effect=[httpx.Response(503), httpx.ConnectError("refused")] + [add] * 10
+    )
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(ASSETS.parent))
+    test_indexer = plugin_manager.get("test_indexer")
+
+    warcs = [ASSETS / "warcio_example.warc.gz", ASSETS / "https_example_org.warc.gz"]
+    assert test_indexer.index(warcs, jobs=1) == warcs
+
+    # the failed batch is retried
+    assert respx_mock.calls.call_count == 6
+    assert posted[0] == (
+        "com,example)/ 20170306040206 http://example.com/ text/html 200 "
+        "G7HRM7BGOKSKMSXZAHMUQTTV53QOFSMK - - 1228 784 assets/warcio_example.warc.gz\n"
+    )
+
+
+@pytest.mark.respx()
+def test_index_warcs_gives_up(respx_mock):
+    respx_mock.post(outbackcdx_url).mock(return_value=httpx.Response(500))
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(ASSETS.parent))
+    test_indexer = plugin_manager.get("test_indexer")
+
+    assert test_indexer.index([ASSETS / "warcio_example.warc.gz"]) == []
+    assert respx_mock.calls.call_count == 4
+
+
+@pytest.mark.respx()
+def test_index_warcs_skips_corrupt_files(respx_mock, tmp_path):
+    respx_mock.post(outbackcdx_url).mock(return_value=httpx.Response(200))
+    corrupt = tmp_path / "corrupt.warc.zst"
+    corrupt.write_bytes(ZSTD_MAGIC + b"not zstd" * 10)
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(ASSETS.parent))
+    test_indexer = plugin_manager.get("test_indexer")
+
+    warc = ASSETS / "warcio_example.warc.gz"
+    assert test_indexer.index([corrupt, warc]) == [warc]
+
+
+def test_index_warcs_to_server(tmp_path):
+    warcs = []
+    for number in range(8):
+        warc = tmp_path / f"{number}.warc.gz"
+        warc.write_bytes((ASSETS / "warcio_example.warc.gz").read_bytes())
+        warcs.append(warc)
+
+    with MockOutbackCDXServer(failures=1) as server:
+        config = get_plugin_config(tmp_path, server.url("dnb"))
+        config["test_indexer"][0].update({"batch_size": 1000, "jobs": 2})
+        plugin_manager = PluginManager()
+        plugin_manager.register_plugins(config)
+        test_indexer = plugin_manager.get("test_indexer")
+
+        assert test_indexer.index(warcs) == warcs
+
+    assert len(server.lines["dnb"]) == 16
+    assert {line.split(" ")[-1] for line in server.lines["dnb"]} == {
+        f"{number}.warc.gz" for number in range(8)
+    }
+    # one batch per file, and the connections are reused
+    assert server.requests == 9
+    assert server.connections <= 3
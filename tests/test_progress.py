@@ -0,0 +1,56 @@
+from wacli.progress import ProgressBatch, TransferProgress
+
+
+def test_progress_batch():
+    calls = []
+
+    def callback(advance, total, name):
+        calls.append((advance, total, name))
+
+    batch = ProgressBatch([callback], "a.warc.gz", 1000, min_bytes=400, min_interval=60)
+    for _ in range(10):
+        batch.advance(100)
+    batch.flush()
+
+    assert calls == [
+        (400, 1000, "a.warc.gz"),
+        (400, 1000, "a.warc.gz"),
+        (200, 1000, "a.warc.gz"),
+    ]
+
+
+def test_transfer_progress():
+    with TransferProgress("Testing", top=2, interval=0) as progress:
+        progress.callback(advance=50, total=100, name="a")
+        progress.callback(advance=10, total=None, name="b")
+        progress.callback(advance=50, total=100, name="a")
+        progress.callback(advance=30, total=300, name="c")
+
+        overall = progress.progress.tasks[0]
+        assert overall.completed == 140
+        assert overall.total == 400
+        assert "1/3 files" in overall.description
+        assert [task.description for task in progress.progress.tasks[1:]] == [
+            "[bright_black]c",
+            "[bright_black]b",
+        ]
+
+
+def test_transfer_progress_without_size():
+    with TransferProgress("Testing", top=2, interval=0) as progress:
+        batch = ProgressBatch([progress.callback], "a", min_bytes=1)
+        batch.advance(100)
+        batch.advance(50)
+        progress.callback(advance=30, total=300, name="b")
+        assert "a" in progress._active
+
+        # the size is known, when the transfer is complete
+        batch.complete()
+
+        assert list(progress._active) == ["b"]
+        progress._render()
+        overall = progress.progress.tasks[0]
+        assert overall.completed == 180
+        assert overall.total == 450
+        assert "1/2 files" in overall.description
+        assert [task.visible for task in progress.progress.tasks[1:]] == [True, False]
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from types import SimpleNamespace
 
 from loguru import logger
 
@@ -58,3 +59,84 @@ def test_pywb_rebase():
     new_path = test_indexer.rebase(p, Path("/tmp/bla"), Path("/srv/blub"))
 
     assert str(new_path) == "/srv/blub/example.warc.gz"
+
+
+def test_index_warcs_with_sidecar(tmp_path):
+    warc_path = tmp_path / "warcs"
+    pywb_path = tmp_path / "pywb"
+    indexes = pywb_path / "collections" / "example_test" / "indexes"
+    (warc_path / "1111").mkdir(parents=True)
+    indexes.mkdir(parents=True)
+
+    warc_file = warc_path / "1111" / "example.warc.gz"
+    warc_file.write_bytes(b"WARC")
+    (warc_path / "1111" / "example.warc.gz.cdxj").write_text("org,example)/ 2024 {}\n")
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(str(warc_path), str(pywb_path)))
+    test_indexer = plugin_manager.get("test_indexer")
+
+    # no container is needed, if the WARC file has an index
+    assert test_indexer.index([str(warc_file)]) == [str(warc_file)]
+
+    archive = pywb_path / "collections" / "example_test" / "archive"
+    assert (archive / "example.warc.gz").read_bytes() == b"WARC"
+    assert (indexes / "example.warc.gz.cdxj").read_text().startswith("org,example)/")
+
+
+def test_index_warcs_in_batches(tmp_path, monkeypatch):
+    runs = []
+    events = []
+
+    class Container:
+        def __init__(self, command):
+            self.command = command
+
+        def wait(self):
+            events.append(("wait", len(self.command) - 3))
+            # the second container fails
+            return {"StatusCode": int("/source/2.warc.gz" in self.command)}
+
+        def logs(self):
+            return b""
+
+        def remove(self):
+            events.append(("remove", len(self.command) - 3))
+
+    def run(command, **kwargs):
+        runs.append(command)
+        events.append(("run", len(command) - 3))
+        return Container(command)
+
+    monkeypatch.setattr(
+        "wacli_plugins.indexer.pywb.docker_from_env",
+        lambda: SimpleNamespace(containers=SimpleNamespace(run=run)),
+    )
+    warc_path = tmp_path / "warcs"
+    config = get_plugin_config(str(warc_path), str(tmp_path / "pywb"))
+    config["test_indexer"][0].update({"batch_size": 2, "max_containers": 2})
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(config)
+    test_indexer = plugin_manager.get("test_indexer")
+
+    warcs = [str(warc_path / f"{i}.warc.gz") for i in range(5)]
+    # only the files of the containers, that exited with 0, are indexed
+    assert test_indexer.index(warcs, block=True) == [warcs[0], warcs[1], warcs[4]]
+
+    assert [command[3:] for command in runs] == [
+        ["/source/0.warc.gz", "/source/1.warc.gz"],
+        ["/source/2.warc.gz", "/source/3.warc.gz"],
+        ["/source/4.warc.gz"],
+    ]
+    # the third container is started, when the first one is finished
+    assert events == [
+        ("run", 2),
+        ("run", 2),
+        ("wait", 2),
+        ("remove", 2),
+        ("run", 1),
+        ("wait", 2),
+        ("remove", 2),
+        ("wait", 1),
+        ("remove", 1),
+    ]
@@ -1,11 +1,17 @@
+import gzip
+import json
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from shutil import copyfile
 from uuid import uuid4
 
 from loguru import logger
 
+import wacli.warc
 from wacli.plugin_manager import PluginManager
+from wacli.warc import is_canonical, is_zstd, serialized_records
+from wacli_plugins.operations.recompress import recompress_file, recompress_indexed
 
 
 def get_plugin_config(input_path, output_path):
@@ -75,6 +81,258 @@ def test_recompress_warcs(tmp_path):
         assert os.path.getsize(output_path / file) > 0
 
 
+def test_recompress_warcs_parallel(tmp_path):
+    """Recompressing in worker processes gives the same files as in serial."""
+    input_path = tmp_path / "input"
+    test_directory = Path(os.path.dirname(__file__))
+
+    warc_list = []
+    for number in range(4):
+        id = str(uuid4())
+        (input_path / id).mkdir(parents=True)
+        copyfile(
+            test_directory / "assets" / "warcio_example.warc.gz",
+            input_path / id / f"{number}.warc.gz",
+        )
+        warc_list.append(id)
+
+    outputs = []
+    for jobs in [1, 2]:
+        output_path = tmp_path / f"output-{jobs}"
+        plugin_manager = PluginManager()
+        plugin_manager.register_plugins(get_plugin_config(input_path, output_path))
+        test_recompressor = plugin_manager.get("test_recompressor")
+        input_storage = plugin_manager.get("input_storage")
+        output_storage = plugin_manager.get("output_storage")
+
+        output_storage.store_stream(
+            test_recompressor.run(
+                input_storage.retrieve_stream(warc_list, mode="rb"), jobs=jobs
+            )
+        )
+        outputs.append(
+            {
+                p.relative_to(output_path): p.read_bytes()
+                for p in output_path.rglob("*.warc.gz")
+            }
+        )
+
+    assert len(outputs[0]) == 4
+    assert outputs[0] == outputs[1]
+
+
+def test_recompress_skips_canonical_warcs(tmp_path):
+    input_path = tmp_path / "input"
+    output_path = tmp_path / "output"
+    test_directory = Path(os.path.dirname(__file__))
+    (input_path / "1111").mkdir(parents=True)
+    canonical = input_path / "1111" / "canonical.warc.gz"
+    copyfile(test_directory / "assets" / "warcio_example.warc.gz", canonical)
+    with gzip.open(canonical) as records:
+        (input_path / "1111" / "uncompressed.warc").write_bytes(records.read())
+
+    config = get_plugin_config(input_path, output_path)
+    config["output_storage"][0]["hardlink"] = True
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(config)
+    test_recompressor = plugin_manager.get("test_recompressor")
+    input_storage = plugin_manager.get("input_storage")
+    output_storage = plugin_manager.get("output_storage")
+
+    output_storage.store_stream(
+        test_recompressor.run(input_storage.retrieve_stream(["1111"], mode="rb"))
+    )
+
+    target = output_path / "1111" / "canonical.warc.gz"
+    assert target.stat().st_ino == canonical.stat().st_ino
+    with gzip.open(output_path / "1111" / "uncompressed.warc.gz") as records:
+        assert records.read(5) == b"WARC/"
+
+
+def test_recompress_file_like_warcio(tmp_path):
+    """Large files are split into records, the output is the same as warcio's."""
+    test_directory = Path(os.path.dirname(__file__))
+    source = tmp_path / "example.warc"
+    source.write_bytes(
+        b"".join(
+            gzip.open(test_directory / "assets" / name).read()
+            for name in ["warcio_example.warc.gz", "https_example_org.warc.gz"] * 5
+        )
+    )
+
+    outputs = []
+    for split_size, record_jobs in [(None, 1), (0, 1), (0, 4)]:
+        target = tmp_path / f"example-{split_size}-{record_jobs}.warc.gz"
+        size = recompress_file(str(source), str(target), 1024, split_size, record_jobs)
+        assert size == target.stat().st_size
+        outputs.append(target.read_bytes())
+
+    assert is_canonical(tmp_path / "example-None-1.warc.gz")
+    assert outputs[0] == outputs[1] == outputs[2]
+
+
+def test_record_jobs_share_the_cores(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 32)
+    config = get_plugin_config(tmp_path / "input", tmp_path / "output")
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(config)
+    test_recompressor = plugin_manager.get("test_recompressor")
+
+    # the worker processes do not start a thread per core each
+    assert test_recompressor._record_jobs(32) == 1
+    assert test_recompressor._record_jobs(64) == 1
+    assert test_recompressor._record_jobs(4) == 8
+
+    test_recompressor.record_jobs = 2
+    assert test_recompressor._record_jobs(32) == 2
+
+
+def test_recompress_with_level(tmp_path):
+    input_path = tmp_path / "input"
+    output_path = tmp_path / "output"
+    test_directory = Path(os.path.dirname(__file__))
+    (input_path / "1111").mkdir(parents=True)
+    with gzip.open(test_directory / "assets" / "warcio_example.warc.gz") as records:
+        (input_path / "1111" / "example.warc").write_bytes(records.read())
+
+    config = get_plugin_config(input_path, output_path)
+    config["test_recompressor"][0].update({"level": 1, "backend": "zlib"})
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(config)
+    test_recompressor = plugin_manager.get("test_recompressor")
+    input_storage = plugin_manager.get("input_storage")
+    output_storage = plugin_manager.get("output_storage")
+
+    for jobs in [1, 2]:
+        output_storage.store_stream(
+            test_recompressor.run(
+                input_storage.retrieve_stream(["1111"], mode="rb"), jobs=jobs
+            )
+        )
+        assert is_canonical(output_path / "1111" / "example.warc.gz")
+
+
+def test_recompress_with_backend_default_level(tmp_path):
+    """The backends are used with their default level, ISA-L only knows 0 to 3."""
+    input_path = tmp_path / "input"
+    test_directory = Path(os.path.dirname(__file__))
+    (input_path / "1111").mkdir(parents=True)
+    with gzip.open(test_directory / "assets" / "warcio_example.warc.gz") as records:
+        (input_path / "1111" / "example.warc").write_bytes(records.read())
+
+    for backend in ["auto", "isal"] if find_spec("isal") else ["auto"]:
+        output_path = tmp_path / backend
+        config = get_plugin_config(input_path, output_path)
+        config["test_recompressor"][0]["backend"] = backend
+        plugin_manager = PluginManager()
+        plugin_manager.register_plugins(config)
+        test_recompressor = plugin_manager.get("test_recompressor")
+        input_storage = plugin_manager.get("input_storage")
+        output_storage = plugin_manager.get("output_storage")
+
+        for jobs in [1, 2]:
+            output_storage.store_stream(
+                test_recompressor.run(
+                    input_storage.retrieve_stream(["1111"], mode="rb"), jobs=jobs
+                )
+            )
+            assert is_canonical(output_path / "1111" / "example.warc.gz")
+            (output_path / "1111" / "example.warc.gz").unlink()
+
+
+def test_recompress_to_zstd(tmp_path):
+    input_path = tmp_path / "input"
+    output_path = tmp_path / "output"
+    test_directory = Path(os.path.dirname(__file__))
+    (input_path / "1111").mkdir(parents=True)
+    copyfile(
+        test_directory / "assets" / "warcio_example.warc.gz",
+        input_path / "1111" / "example.warc.gz",
+    )
+
+    config = get_plugin_config(input_path, output_path)
+    config["output_storage"][0]["compression"] = "zstd"
+    config["test_recompressor"][0]["target_repository"] = "output_storage"
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(config)
+    test_recompressor = plugin_manager.get("test_recompressor")
+    input_storage = plugin_manager.get("input_storage")
+    output_storage = plugin_manager.get("output_storage")
+
+    with open(input_path / "1111" / "example.warc.gz", "rb") as source_io:
+        records = list(serialized_records(source_io))
+    for jobs in [1, 2]:
+        output_storage.store_stream(
+            test_recompressor.run(
+                input_storage.retrieve_stream(["1111"], mode="rb"), jobs=jobs
+            )
+        )
+        target = output_path / "1111" / "example.warc.zst"
+        assert is_zstd(target)
+        with open(target, "rb") as target_io:
+            assert list(serialized_records(target_io)) == records
+
+
+def test_recompress_writes_cdxj(tmp_path):
+    input_path = tmp_path / "input"
+    output_path = tmp_path / "output"
+    test_directory = Path(os.path.dirname(__file__))
+    (input_path / "1111").mkdir(parents=True)
+    copyfile(
+        test_directory / "assets" / "warcio_example.warc.gz",
+        input_path / "1111" / "canonical.warc.gz",
+    )
+    with gzip.open(test_directory / "assets" / "https_example_org.warc.gz") as records:
+        (input_path / "1111" / "example.warc").write_bytes(records.read())
+
+    config = get_plugin_config(input_path, output_path)
+    config["test_recompressor"][0]["cdxj"] = True
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(config)
+    test_recompressor = plugin_manager.get("test_recompressor")
+    input_storage = plugin_manager.get("input_storage")
+    output_storage = plugin_manager.get("output_storage")
+
+    for jobs in [1, 2]:
+        output_storage.store_stream(
+            test_recompressor.run(
+                input_storage.retrieve_stream(["1111"], mode="rb"), jobs=jobs
+            )
+        )
+        for name, count in [("canonical.warc.gz", 2), ("example.warc.gz", 2)]:
+            warc = (output_path / "1111" / name).read_bytes()
+            lines = (output_path / "1111" / f"{name}.cdxj").read_text().splitlines()
+            assert len(lines) == count
+            for line in lines:
+                values = json.loads(line.split(" ", 2)[2])
+                assert values["filename"] == name
+                offset, length = int(values["offset"]), int(values["length"])
+                record = gzip.decompress(warc[offset : offset + length])
+                assert record.startswith(b"WARC/1.0\r\n")
+
+
+def test_recompress_indexes_canonical_warcs_in_one_pass(tmp_path, monkeypatch):
+    walks = []
+    gzip_members = wacli.warc._gzip_members
+
+    def counted(*args, **kwargs):
+        walks.append(args)
+        return gzip_members(*args, **kwargs)
+
+    monkeypatch.setattr(wacli.warc, "_gzip_members", counted)
+    source = Path(os.path.dirname(__file__)) / "assets" / "warcio_example.warc.gz"
+
+    size, lines = recompress_indexed(
+        str(source), str(tmp_path / "target"), "example.warc.gz", 1024 * 1024
+    )
+
+    # the members are inflated once, to check the file and to index it
+    assert size is None
+    assert len(walks) == 1
+    assert len(lines) == 2
+    assert '"length": "1228", "offset": "784"' in lines[0]
+
+
 from io import BufferedReader, BytesIO, RawIOBase
 
 
@@ -0,0 +1,99 @@
+import json
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+
+from wacli.compression import ZSTD_MAGIC
+from wacli.plugin_manager import PluginManager
+
+ASSETS = Path(os.path.dirname(__file__)) / "assets"
+solr_url = "http://dnb-test-solr/solr/netarchivebuilder"
+
+
+def get_plugin_config(jobs=1):
+    return {
+        "test_indexer": [
+            {
+                "module": "wacli_plugins.indexer.solrwayback",
+                "url": solr_url,
+                "warc_path": str(ASSETS.parent),
+                "batch_size": 3,
+                "commit_within": 10000,
+                "jobs": jobs,
+                "backoff": 0,
+            }
+        ],
+    }
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+@pytest.mark.respx()
+def test_index_warcs(respx_mock, jobs):
+    batches = []
+
+    def update(request):
+        assert request.url.params["commitWithin"] == "10000"
+        batches.append(json.loads(request.content))
+        return httpx.Response(200, json={"responseHeader": {"status": 0}})
+
+    respx_mock.post(f"{solr_url}/update").mock(
+        side_effect=[httpx.Response(503)] + [update] * 10
+    )
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(jobs))
+    test_indexer = plugin_manager.get("test_indexer")
+
+    warcs = [ASSETS / "warcio_example.warc.gz", ASSETS / "https_example_org.warc.gz"]
+    assert test_indexer.index(warcs) == warcs
+
+    # the documents of both files are sent in batches, the failed one is retried
+    assert [len(batch) for batch in batches] == [3, 1]
+    response, revisit, org, favicon = [d for batch in batches for d in batch]
+    assert response["url"] == "http://example.com/"
+    assert response["url_norm"] == "http://example.com/"
+    assert response["host"] == "example.com"
+    assert response["crawl_date"] == "2017-03-06T04:02:06Z"
+    assert response["wayback_date"] == 20170306040206
+    assert response["status_code"] == 200
+    assert response["content_type_norm"] == "html"
+    assert response["source_file_path"] == "assets/warcio_example.warc.gz"
+    assert response["source_file_offset"] == 784
+    assert response["content"].startswith("Example Domain")
+    assert revisit["record_type"] == "revisit"
+    assert "content" not in revisit
+    assert org["host"] == "example.org"
+    assert favicon["status_code"] == 404
+
+
+@pytest.mark.respx()
+def test_index_warcs_stops(respx_mock):
+    respx_mock.post(f"{solr_url}/update").mock(
+        side_effect=[httpx.Response(200)] + [httpx.Response(500)] * 4
+    )
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config())
+    test_indexer = plugin_manager.get("test_indexer")
+
+    warcs = [ASSETS / "warcio_example.warc.gz", ASSETS / "https_example_org.warc.gz"]
+    # the first batch holds all documents of the first file, the second one fails
+    assert test_indexer.index(warcs) == warcs[:1]
+    assert respx_mock.calls.call_count == 5
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+@pytest.mark.respx()
+def test_index_warcs_skips_corrupt_files(respx_mock, tmp_path, jobs):
+    respx_mock.post(f"{solr_url}/update").mock(return_value=httpx.Response(200))
+    corrupt = tmp_path / "corrupt.warc.zst"
+    corrupt.write_bytes(ZSTD_MAGIC + b"not zstd" * 10)
+
+    plugin_manager = PluginManager()
+    plugin_manager.register_plugins(get_plugin_config(jobs))
+    test_indexer = plugin_manager.get("test_indexer")
+
+    warc = ASSETS / "warcio_example.warc.gz"
+    assert test_indexer.index([corrupt, warc]) == [warc]
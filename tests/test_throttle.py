@@ -0,0 +1,28 @@
+import time
+
+from wacli.throttle import AimdLimiter, TokenBucket
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=1000, capacity=100)
+
+    start = time.perf_counter()
+    for _ in range(3):
+        bucket.consume(100)
+
+    assert time.perf_counter() - start >= 0.18
+
+
+def test_aimd_limiter():
+    limiter = AimdLimiter(maximum=8)
+
+    limiter.overload()
+    assert limiter.limit == 4
+    limiter.success(latency=0.1)
+    assert 4 < limiter.limit < 5
+    limiter.success(latency=1.0)
+    assert limiter.limit < 4
+
+    with limiter.slot():
+        assert limiter.active == 1
+    assert limiter.active == 0
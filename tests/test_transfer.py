@@ -0,0 +1,108 @@
+import gzip
+import os
+import time
+from io import BytesIO, StringIO
+
+import pytest
+from loguru import logger
+
+from wacli.transfer import copy_stream, is_regular_file
+
+
+def test_copy_stream_binary():
+    data = bytes(range(256)) * 1000
+    target = BytesIO()
+    chunks = []
+
+    copied = copy_stream(BytesIO(data), target, 4096, lambda c: chunks.append(len(c)))
+
+    assert copied == len(data)
+    assert target.getvalue() == data
+    assert sum(chunks) == len(data)
+    assert max(chunks) <= 4096
+
+
+def test_copy_stream_read_only_source():
+    class ReadOnly:
+        def __init__(self, data):
+            self.data = BytesIO(data)
+
+        def read(self, size=-1):
+            return self.data.read(size)
+
+    target = BytesIO()
+    copy_stream(ReadOnly(b"x" * 10000), target, 1000)
+
+    assert target.getvalue() == b"x" * 10000
+
+
+def test_copy_stream_text():
+    """Multi-byte characters are encoded correctly across chunk borders."""
+    text = "äöü€" * 5000
+    target = BytesIO()
+
+    copied = copy_stream(StringIO(text), target, 3)
+
+    assert target.getvalue() == text.encode("utf-8")
+    assert copied == len(text.encode("utf-8"))
+
+
+def test_copy_stream_files(tmp_path):
+    """Files are copied through the reused buffer, the last chunk is short."""
+    source = tmp_path / "source"
+    data = bytes(range(256)) * 4099
+    source.write_bytes(data)
+    chunks = []
+
+    with open(source, "rb") as source_io, open(tmp_path / "copy", "wb") as target_io:
+        copied = copy_stream(
+            source_io, target_io, 128 * 1024, lambda c: chunks.append(len(c))
+        )
+
+    assert copied == len(data)
+    assert (tmp_path / "copy").read_bytes() == data
+    assert chunks == [128 * 1024] * 8 + [len(data) - 8 * 128 * 1024]
+
+
+@pytest.mark.benchmark
+def test_copy_stream_throughput(tmp_path):
+    """Compare a loop, that reads a new chunk per read(), with the reused buffer of
+    copy_stream, run with: pytest -m benchmark"""
+    source = tmp_path / "source"
+    source.write_bytes(os.urandom(256 * 1024 * 1024))
+    buffer_size = 128 * 1024
+
+    def read_loop(source_io, target_io):
+        while chunk := source_io.read(buffer_size):
+            target_io.write(chunk)
+
+    def readinto_loop(source_io, target_io):
+        copy_stream(source_io, target_io, buffer_size)
+
+    seconds = {}
+    for copy in [read_loop, readinto_loop] * 3:
+        with open(source, "rb") as source_io, open(tmp_path / "copy", "wb") as target:
+            start = time.perf_counter()
+            copy(source_io, target)
+            elapsed = time.perf_counter() - start
+        seconds[copy.__name__] = min(elapsed, seconds.get(copy.__name__, elapsed))
+    for name, elapsed in seconds.items():
+        logger.info(f"{name}: {256 / elapsed:.0f} MiB/s")
+
+    assert (tmp_path / "copy").read_bytes() == source.read_bytes()
+    # the reused buffer saves an allocation per chunk, it must not be slower
+    assert seconds["readinto_loop"] <= seconds["read_loop"] * 1.1
+
+
+def test_is_regular_file(tmp_path):
+    path = tmp_path / "a.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(b"data")
+
+    with open(path, "rb") as f:
+        assert is_regular_file(f)
+        # decoded data can not be copied from the file
+        assert not is_regular_file(gzip.open(f))
+    with open(path, "rb", buffering=0) as f:
+        assert is_regular_file(f)
+    assert not is_regular_file(BytesIO(b"data"))
@@ -0,0 +1,174 @@
+import gzip
+import os
+from pathlib import Path
+
+from wacli.compression import ZSTD_DICTIONARY_MAGIC
+from wacli.warc import (
+    index_records,
+    is_canonical,
+    is_gzip,
+    is_warc_name,
+    is_zstd,
+    recompress_records,
+    serialized_records,
+)
+
+ASSETS = Path(os.path.dirname(__file__)) / "assets"
+
+
+def test_is_canonical():
+    assert is_canonical(ASSETS / "warcio_example.warc.gz")
+    assert is_canonical(ASSETS / "https_example_org.warc.gz")
+
+
+def test_is_canonical_indexes_records():
+    source = ASSETS / "warcio_example.warc.gz"
+    entries = []
+
+    # the chunks are smaller than the members
+    assert is_canonical(source, 100, lambda *entry: entries.append(entry))
+
+    with open(source, "rb") as source_io:
+        assert entries == list(index_records(source_io))
+    assert [(offset, length) for _, offset, length in entries][2] == (784, 1228)
+
+
+def test_is_not_canonical(tmp_path):
+    records = gzip.open(ASSETS / "warcio_example.warc.gz").read()
+
+    uncompressed = tmp_path / "example.warc"
+    uncompressed.write_bytes(records)
+    assert not is_gzip(uncompressed)
+    assert not is_canonical(uncompressed)
+
+    # all records in a single gzip member
+    whole = tmp_path / "whole.warc.gz"
+    whole.write_bytes(gzip.compress(records))
+    assert is_gzip(whole)
+    assert not is_canonical(whole)
+
+    truncated = tmp_path / "truncated.warc.gz"
+    truncated.write_bytes((ASSETS / "warcio_example.warc.gz").read_bytes()[:-10])
+    assert not is_canonical(truncated)
+
+    not_warc = tmp_path / "not.warc.gz"
+    not_warc.write_bytes(gzip.compress(b"some text\r\n\r\n"))
+    assert not is_canonical(not_warc)
+
+
+def test_recompress_records(tmp_path):
+    source = tmp_path / "whole.warc.gz"
+    records = b"".join(
+        gzip.open(ASSETS / name).read()
+        for name in ["warcio_example.warc.gz", "https_example_org.warc.gz"] * 20
+    )
+    source.write_bytes(gzip.compress(records))
+
+    outputs = []
+    for jobs in [1, 4]:
+        target = tmp_path / f"records-{jobs}.warc.gz"
+        with open(source, "rb") as source_io, open(target, "wb") as target_io:
+            written = recompress_records(source_io, target_io, jobs, batch_size=1024)
+        assert written == target.stat().st_size
+        assert is_canonical(target)
+        outputs.append(target.read_bytes())
+
+    assert outputs[0] == outputs[1]
+    assert gzip.decompress(outputs[0]).count(b"WARC/1.0\r\n") == records.count(
+        b"WARC/1.0\r\n"
+    )
+
+
+def test_recompress_records_streams_large_records(tmp_path):
+    """Records of batch_size bytes or more are compressed in chunks, while they are
+    read, the output and the index are the same."""
+    source = ASSETS / "warcio_example.warc.gz"
+    outputs = []
+    for batch_size in [16 * 1024 * 1024, 1]:
+        target = tmp_path / f"example-{batch_size}.warc.gz"
+        entries = []
+        with open(source, "rb") as source_io, open(target, "wb") as target_io:
+            recompress_records(
+                source_io,
+                target_io,
+                2,
+                batch_size=batch_size,
+                index=lambda *entry: entries.append(entry),
+            )
+        outputs.append((target.read_bytes(), entries))
+
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0][1]) == 6
+
+    # the dictionary is trained on the records before the first large record
+    target = tmp_path / "example.warc.zst"
+    with open(source, "rb") as source_io, open(target, "wb") as target_io:
+        recompress_records(
+            source_io, target_io, format="zstd", batch_size=1, dictionary_size=1024
+        )
+    with open(source, "rb") as source_io, open(target, "rb") as target_io:
+        assert list(serialized_records(target_io)) == list(
+            serialized_records(source_io)
+        )
+
+
+def test_recompress_records_zstd(tmp_path):
+    source = ASSETS / "warcio_example.warc.gz"
+    with open(source, "rb") as source_io:
+        records = list(serialized_records(source_io))
+
+    for dictionary_size in [0, 1024]:
+        target = tmp_path / f"example-{dictionary_size}.warc.zst"
+        with open(source, "rb") as source_io, open(target, "wb") as target_io:
+            recompress_records(
+                source_io, target_io, format="zstd", dictionary_size=dictionary_size
+            )
+        assert is_zstd(target)
+        assert not is_canonical(target)
+        with open(target, "rb") as target_io:
+            assert list(serialized_records(target_io)) == records
+
+    # a dictionary, that was trained before, is written to the start of the file
+    target = tmp_path / "dictionary.warc.zst"
+    with open(source, "rb") as source_io, open(target, "wb") as target_io:
+        recompress_records(
+            source_io, target_io, format="zstd", dictionary=records[0][:512] * 4
+        )
+    assert target.read_bytes().startswith(ZSTD_DICTIONARY_MAGIC)
+    with open(target, "rb") as target_io:
+        assert list(serialized_records(target_io)) == records
+
+
+def test_index_records(tmp_path):
+    source = ASSETS / "warcio_example.warc.gz"
+    with open(source, "rb") as source_io:
+        entries = list(index_records(source_io))
+
+    assert [offset for _, offset, _ in entries][:3] == [0, 353, 784]
+    assert sum(length for _, _, length in entries) == source.stat().st_size
+    assert [fields["mime"] for fields, _, _ in entries if fields] == [
+        "text/html",
+        "warc/revisit",
+    ]
+
+    # the offsets of the written members are the offsets of the records
+    for format in ["gzip", "zstd"]:
+        target = tmp_path / f"example.{format}"
+        written = []
+        with open(source, "rb") as source_io, open(target, "wb") as target_io:
+            recompress_records(
+                source_io,
+                target_io,
+                format=format,
+                dictionary_size=1024 if format == "zstd" else 0,
+                index=lambda *entry: written.append(entry),
+            )
+        with open(target, "rb") as target_io:
+            assert list(index_records(target_io)) == written
+
+
+def test_is_warc_name():
+    assert is_warc_name("a.warc.gz")
+    assert is_warc_name("a.warc.zst")
+    assert is_warc_name("a.arc")
+    assert not is_warc_name("a.warc.gz.cdxj")
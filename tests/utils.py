@@ -1,3 +1,8 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
 def copy_file(src, target):
     target.parent.mkdir(parents=True, exist_ok=True)
     with (
@@ -5,3 +10,155 @@ def copy_file(src, target):
         open(target, "w") as output,
     ):
         output.write(input.read())
+
+
+mets_template = """<?xml version='1.0' encoding='UTF-8'?>
+<mets xmlns="http://www.loc.gov/METS/"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:xlink="http://www.w3.org/1999/xlink"
+    xsi:schemaLocation="http://www.loc.gov/METS/ http://www.loc.gov/standards/mets/mets.xsd">
+    <fileSec>
+        <fileGrp>
+            {files}
+        </fileGrp>
+    </fileSec>
+    <structMap>
+        <div/>
+    </structMap>
+</mets>"""
+
+mets_file_template = """
+    <file ID="{id}" MIMETYPE="{mime_type}" CREATED="2018-10-01T07:15:08" SIZE="{size}">
+        <FLocat LOCTYPE="URL" xlink:href="{href}"/>
+    </file>
+"""
+
+
+def mets_document(files: dict) -> str:
+    """Create a METS object listing for a dict of {href: content}."""
+    return mets_template.format(
+        files="".join(
+            mets_file_template.format(
+                id=id, mime_type="application/warc", size=len(content), href=href
+            )
+            for id, (href, content) in enumerate(files.items())
+        )
+    )
+
+
+class MockArasServer:
+    """A local HTTP server mimicking the ARAS access API.
+
+    artifacts is a dict of {idn: {href: bytes}}, latency is the delay in seconds added
+    to every response to simulate a remote repository."""
+
+    def __init__(self, repository: str, artifacts: dict, latency: float = 0):
+        server = self
+        self.repository = repository
+        self.artifacts = artifacts
+        self.latency = latency
+        self.requests = []
+        self.connections = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                server.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(self.path)
+                status, body = server.respond(self.path)
+                time.sleep(server.latency)
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def rest_base(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+
+    def respond(self, path):
+        prefix = f"/access/repositories/{self.repository}/artifacts/"
+        if not path.startswith(prefix):
+            return 404, b""
+        idn, _, rest = path[len(prefix) :].partition("/")
+        if idn not in self.artifacts:
+            return 404, b""
+        files = self.artifacts[idn]
+        if rest == "objects":
+            return 200, mets_document(files).encode("utf-8")
+        object_id = rest.removeprefix("objects/")
+        contents = list(files.values())
+        if object_id.isdigit() and int(object_id) < len(contents):
+            return 200, contents[int(object_id)]
+        return 404, b""
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MockOutbackCDXServer:
+    """A local HTTP server mimicking the OutbackCDX API to add CDX lines.
+
+    The first POST requests (as many as failures) are answered with 503."""
+
+    def __init__(self, failures: int = 0):
+        server = self
+        self.failures = failures
+        self.lines = {}
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                with server.lock:
+                    server.requests += 1
+                    failed = server.requests <= server.failures
+                    if not failed:
+                        lines = body.decode("utf-8").splitlines()
+                        server.lines.setdefault(self.path.strip("/"), []).extend(lines)
+                response = b"" if failed else f"Added {len(lines)} records".encode()
+                self.send_response(503 if failed else 200)
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+
+    def url(self, collection: str):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{collection}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
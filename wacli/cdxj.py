@@ -0,0 +1,113 @@
+"""Build CDXJ index lines for the records of WARC files, as pywb reads them."""
+
+import json
+from urllib.parse import urlsplit
+
+"""The record types, that are looked up in a replay."""
+INDEXED_TYPES = ["response", "revisit", "resource", "metadata"]
+DEFAULT_PORTS = {"http": 80, "https": 443}
+"""The extension of the CDXJ file, that is written next to a WARC file."""
+SIDECAR_EXTENSION = ".cdxj"
+
+
+def surt(url: str) -> str:
+    """Get the sort friendly URI reordering transform (SURT) of an URL.
+
+    http://www.Example.org:8080/a?b=2&a=1 is org,example:8080)/a?a=1&b=2"""
+    parts = urlsplit(url.strip())
+    if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+        return url.strip().lower()
+    host = parts.hostname.lower().removeprefix("www.")
+    key = ",".join(reversed(host.split(".")))
+    if parts.port and parts.port != DEFAULT_PORTS[parts.scheme]:
+        key += f":{parts.port}"
+    key += ")" + (parts.path or "/")
+    if parts.query:
+        key += "?" + "&".join(sorted(parts.query.split("&")))
+    return key.lower()
+
+
+def _headers(block: bytes) -> tuple[str, dict]:
+    """Split a header block into the first line and the headers by lower case name."""
+    first, *lines = block.decode("utf-8", "replace").split("\r\n")
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        headers.setdefault(name.strip().lower(), value.strip())
+    return first, headers
+
+
+def record_fields(head: bytes) -> dict | None:
+    """Get the fields of an index line from the start of an uncompressed record.
+
+    The head needs to hold the WARC headers and the HTTP headers of the record.
+    Returns None, if the record is not indexed."""
+    warc_block, _, block = head.partition(b"\r\n\r\n")
+    _, warc_headers = _headers(warc_block)
+    if warc_headers.get("warc-type") not in INDEXED_TYPES:
+        return None
+    url = warc_headers.get("warc-target-uri", "").strip("<>")
+    fields = {
+        "urlkey": surt(url),
+        "timestamp": "".join(
+            c for c in warc_headers.get("warc-date", "") if c.isdigit()
+        )[:14],
+        "url": url,
+        "mime": warc_headers.get("content-type", "").split(";")[0].strip(),
+    }
+    if warc_headers.get("warc-type") == "revisit":
+        fields["mime"] = "warc/revisit"
+    if fields["mime"] == "application/http" or block.startswith(b"HTTP/"):
+        status_line, http_headers = _headers(block.partition(b"\r\n\r\n")[0])
+        status = status_line.split(" ")
+        if len(status) > 1 and status[1].isdigit():
+            fields["status"] = status[1]
+        if warc_headers.get("warc-type") == "response":
+            fields["mime"] = (
+                http_headers.get("content-type", "unk").split(";")[0].strip()
+            )
+    if digest := warc_headers.get("warc-payload-digest"):
+        fields["digest"] = digest.split(":", 1)[-1]
+    return fields
+
+
+def cdxj_line(fields: dict, offset: int, length: int, filename: str) -> str:
+    """Write the index line of a record at offset with the compressed length."""
+    urlkey, timestamp = fields["urlkey"], fields["timestamp"]
+    values = {k: v for k, v in fields.items() if k not in ["urlkey", "timestamp"]}
+    values.update(length=str(length), offset=str(offset), filename=filename)
+    return f"{urlkey} {timestamp} {json.dumps(values)}\n"
+
+
+def cdx_line(fields: dict, offset: int, length: int, filename: str) -> str:
+    """Write the CDX11 line of a record, as OutbackCDX reads it.
+
+    The fields are: urlkey timestamp url mime status digest redirect meta length
+    offset filename, unknown fields are -."""
+    values = [
+        fields["urlkey"],
+        fields["timestamp"],
+        fields["url"],
+        fields.get("mime"),
+        fields.get("status"),
+        fields.get("digest"),
+        None,
+        None,
+        str(length),
+        str(offset),
+        filename,
+    ]
+    return " ".join((v or "-").replace(" ", "%20") for v in values) + "\n"
+
+
+def cdxj_lines(entries, filename: str) -> list[str]:
+    """Get the sorted index lines of (fields, offset, length) entries of a file."""
+    return sorted(
+        cdxj_line(fields, offset, length, filename)
+        for fields, offset, length in entries
+        if fields is not None
+    )
+
+
+def sidecar_name(warc: str) -> str:
+    return f"{warc}{SIDECAR_EXTENSION}"
@@ -0,0 +1,226 @@
+"""Select the compression of WARC records and compare the compressions."""
+
+import struct
+import time
+import zlib
+from collections.abc import Callable
+from importlib import import_module
+from importlib.util import find_spec
+from threading import local
+
+from loguru import logger
+
+from wacli.plugin_manager import ConfigurationError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""The zlib compatible modules by backend name, the fastest first."""
+BACKENDS = {
+    "isal": ("isal", "isal.isal_zlib"),
+    "zlib-ng": ("zlib_ng", "zlib_ng.zlib_ng"),
+    "zlib": ("zlib", "zlib"),
+}
+"""The levels to compare by default, ISA-L only knows the levels 0 to 3."""
+BENCHMARK_LEVELS = {
+    "isal": [0, 1, 2, 3],
+    "zlib-ng": [1, 6, 9],
+    "zlib": [1, 6, 9],
+    "zstd": [1, 3, 9, 19],
+}
+"""The default and the highest deflate level of the backends."""
+LEVELS = {
+    "isal": (2, 3),
+    "zlib-ng": (6, 9),
+    "zlib": (6, 9),
+}
+DEFAULT_LEVEL = LEVELS["zlib"][0]
+"""The level, that warcio compresses the records with."""
+WARCIO_LEVEL = 9
+"""The file name extension, media type and default level of the output formats."""
+FORMATS = {
+    "gzip": (".gz", "application/gzip", DEFAULT_LEVEL),
+    "zstd": (".zst", "application/zstd", 3),
+}
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+"""The errors of a corrupt gzip member or zstd frame."""
+DECOMPRESSION_ERRORS = (zlib.error, zstandard.ZstdError) if zstandard else (zlib.error,)
+"""The skippable frame, that holds the dictionary at the start of a .warc.zst file."""
+ZSTD_DICTIONARY_MAGIC = b"\x5d\x2a\x4d\x18"
+
+
+def available_backends() -> list[str]:
+    return [name for name, (package, _) in BACKENDS.items() if find_spec(package)]
+
+
+def backend_name(backend=None) -> str:
+    """Get the name of a backend from its name or module, "auto" is the fastest
+    installed backend."""
+    if backend is None:
+        return "zlib"
+    if backend == "auto":
+        return available_backends()[0]
+    if isinstance(backend, str):
+        return backend
+    for name, (_, module) in BACKENDS.items():
+        if backend.__name__ == module:
+            return name
+    return "zlib"
+
+
+def get_backend(name: str = None):
+    """Get the module of a backend, "auto" selects the fastest installed backend."""
+    if (name := backend_name(name)) == "zlib":
+        return zlib
+    if name not in BACKENDS:
+        raise ConfigurationError(
+            f"Unknown compression backend {name}, use one of {', '.join(BACKENDS)}."
+        )
+    package, module = BACKENDS[name]
+    if not find_spec(package):
+        raise ConfigurationError(f"The compression backend {name} is not installed.")
+    return import_module(module)
+
+
+def check_level(level: int = None, backend=None) -> int:
+    """Get the deflate level of a backend (its name or module), the default level of
+    the backend, if level is None."""
+    name = backend_name(backend)
+    default, maximum = LEVELS.get(name, LEVELS["zlib"])
+    if level is None:
+        return default
+    if not 0 <= level <= maximum:
+        raise ConfigurationError(
+            f"The {name} compression level {level} is not in 0 to {maximum}."
+        )
+    return level
+
+
+def check_format(format: str):
+    if format not in FORMATS:
+        raise ConfigurationError(
+            f"Unknown WARC compression {format}, use one of {', '.join(FORMATS)}."
+        )
+    if format == "zstd" and zstandard is None:
+        raise ConfigurationError("The zstd compression needs zstandard installed.")
+
+
+def record_compressor(
+    format: str = "gzip", level: int = None, backend=zlib, dictionary: bytes = None
+) -> Callable[[bytes], bytes]:
+    """Get a function, that compresses a record to a gzip member or a zstd frame.
+
+    The function can be called from several threads at once."""
+    if format != "zstd":
+        level = check_level(level, backend)
+        return lambda data: compress_member(data, level, backend)
+    level = FORMATS[format][2] if level is None else level
+    dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+    compressors = local()
+
+    def compress(data: bytes) -> bytes:
+        if (compressor := getattr(compressors, "compressor", None)) is None:
+            compressor = compressors.compressor = zstandard.ZstdCompressor(
+                level=level, dict_data=dict_data
+            )
+        return compressor.compress(data)
+
+    return compress
+
+
+def stream_compressor(
+    format: str = "gzip", level: int = None, backend=zlib, dictionary: bytes = None
+):
+    """Get a compressor, that compresses a record in chunks to a gzip member or a
+    zstd frame, like record_compressor does at once.
+
+    The chunks are passed to compress, flush finishes the member."""
+    if format != "zstd":
+        return backend.compressobj(check_level(level, backend), backend.DEFLATED, 31)
+    level = FORMATS[format][2] if level is None else level
+    dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+    return zstandard.ZstdCompressor(level=level, dict_data=dict_data).compressobj()
+
+
+def train_zstd_dictionary(samples: list[bytes], size: int) -> bytes | None:
+    """Train a zstd dictionary on sample records, None if there are too few."""
+    try:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    except zstandard.ZstdError as e:
+        logger.debug(f"Could not train a zstd dictionary: {e}")
+        return None
+
+
+def zstd_dictionary_frame(dictionary: bytes) -> bytes:
+    return ZSTD_DICTIONARY_MAGIC + struct.pack("<I", len(dictionary)) + dictionary
+
+
+def zstd_reader(source_io):
+    """Open the decompressed stream of a .warc.zst file.
+
+    A dictionary in the skippable frame at the start is used for all frames. The
+    source needs to support peek."""
+    dictionary = read_zstd_dictionary(source_io)
+    dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+    return zstandard.ZstdDecompressor(dict_data=dict_data).stream_reader(
+        source_io, read_across_frames=True
+    )
+
+
+def read_zstd_dictionary(source_io) -> bytes | None:
+    """Read the dictionary from the skippable frame at the start of a .warc.zst file.
+
+    Nothing is read, if the file has no dictionary. The source needs to support
+    peek."""
+    header = source_io.peek(8)[:8]
+    if header[:4] != ZSTD_DICTIONARY_MAGIC:
+        return None
+    source_io.read(8)
+    dictionary = source_io.read(struct.unpack("<I", header[4:])[0])
+    if dictionary[:4] == ZSTD_MAGIC:
+        # the dictionary may be compressed itself
+        dictionary = zstandard.ZstdDecompressor().decompressobj().decompress(dictionary)
+    return dictionary
+
+
+def zstd_record_decompressor(dictionary: bytes = None) -> Callable:
+    """Get a factory of decompressors, that stop at the end of a zstd frame."""
+    dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+    return zstandard.ZstdDecompressor(dict_data=dict_data).decompressobj
+
+
+def compress_member(data: bytes, level: int = None, backend=zlib) -> bytes:
+    """Compress the data to a single gzip member without a time in the header."""
+    level = check_level(level, backend)
+    compressor = backend.compressobj(level, backend.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def benchmark_backends() -> list[str]:
+    """The deflate backends and zstd, if they are installed."""
+    return available_backends() + (["zstd"] if zstandard else [])
+
+
+def benchmark(chunks: list[bytes], backend: str, level: int) -> dict:
+    """Compress the chunks to gzip members (or zstd frames, if the backend is zstd)
+    and measure the throughput and ratio."""
+    if backend == "zstd":
+        check_format("zstd")
+        compress = record_compressor("zstd", level)
+    else:
+        compress = record_compressor("gzip", level, get_backend(backend))
+    size = sum(len(chunk) for chunk in chunks)
+    start = time.perf_counter()
+    compressed = sum(len(compress(chunk)) for chunk in chunks)
+    seconds = time.perf_counter() - start
+    return {
+        "backend": backend,
+        "level": level,
+        "bytes": size,
+        "compressed_bytes": compressed,
+        "seconds": seconds,
+        "mb_per_second": size / 1_000_000 / seconds if seconds else float("inf"),
+        "ratio": compressed / size if size else 1.0,
+    }
@@ -0,0 +1,58 @@
+"""Compute and check the fixity of files while they are copied."""
+
+import hashlib
+from base64 import b32encode
+from pathlib import Path
+
+
+class ChecksumMismatchError(Exception):
+    pass
+
+
+class Digests:
+    """Hash the chunks of a file with SHA-256, SHA-1 and the algorithm of the checksum
+    offered by the source.
+
+    The checksum is expected as "<hashlib name>:<hex digest>", e.g. "md5:d41d8c…"."""
+
+    def __init__(self, checksum: str = None):
+        self.sha256 = hashlib.sha256()
+        self.sha1 = hashlib.sha1()
+        self.checksum = checksum
+        self.expected = None
+        self.source_hash = None
+        if checksum:
+            algorithm, _, self.expected = checksum.partition(":")
+            self.expected = self.expected.lower()
+            self.source_hash = {"sha256": self.sha256, "sha1": self.sha1}.get(
+                algorithm
+            ) or hashlib.new(algorithm)
+
+    def update(self, chunk: bytes):
+        self.sha256.update(chunk)
+        self.sha1.update(chunk)
+        if self.source_hash not in (None, self.sha256, self.sha1):
+            self.source_hash.update(chunk)
+
+    def update_from_file(self, path: Path, length: int, buffer_size: int = 1 << 20):
+        """Hash the first length bytes of an existing file, e.g. before resuming."""
+        with open(path, "rb") as file:
+            while length > 0 and (chunk := file.read(min(buffer_size, length))):
+                self.update(chunk)
+                length -= len(chunk)
+
+    @property
+    def sha256_hex(self) -> str:
+        return self.sha256.hexdigest()
+
+    @property
+    def warc_sha1(self) -> str:
+        """The SHA-1 digest in the base32 notation used in WARC-Payload-Digest."""
+        return "sha1:" + b32encode(self.sha1.digest()).decode("ascii")
+
+    def verify(self):
+        """Raise ChecksumMismatchError, if the data does not match the checksum."""
+        if self.expected and self.source_hash.hexdigest() != self.expected:
+            raise ChecksumMismatchError(
+                f"expected {self.checksum}, got {self.source_hash.hexdigest()}"
+            )
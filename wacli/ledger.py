@@ -0,0 +1,110 @@
+"""Persistent record of the WARC files, that the indexers have indexed."""
+
+import sqlite3
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from threading import Lock
+
+"""The ledger of a storage, relative to the storage path."""
+LEDGER_PATH = ".wacli/ledger.sqlite"
+
+
+class Ledger:
+    """SQLite backed ledger of the indexed files.
+
+    An entry is keyed by the indexer (see IndexerPlugin.ledger_key) and the path of
+    the file relative to the base and records the size and modification time, that
+    the file had, when it was indexed. A file is indexed again, if it changed."""
+
+    def __init__(self, path: Path, base: Path = None):
+        self.path = Path(path)
+        self.base = Path(base) if base else None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            self._connection.execute("pragma journal_mode=wal")
+            self._connection.execute(
+                """create table if not exists indexed (
+                    indexer text not null,
+                    path text not null,
+                    size integer,
+                    mtime_ns integer,
+                    indexed_at real,
+                    primary key (indexer, path)
+                )"""
+            )
+
+    def stats(self, files: Iterable[Path]) -> dict[Path, tuple[int, int]]:
+        """Get the size and modification time of the files, that still exist."""
+        stats = {}
+        for file in map(Path, files):
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            stats[file] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def changed(
+        self, indexer: str, stats: dict[Path, tuple[int, int]]
+    ) -> dict[Path, tuple[int, int]]:
+        """Select the files, that the indexer has not indexed in their current
+        state (see stats)."""
+        indexed = self._entries(indexer)
+        return {
+            file: stat
+            for file, stat in stats.items()
+            if indexed.get(self._key(file)) != stat
+        }
+
+    def record(self, indexer: str, stats: dict[Path, tuple[int, int]]):
+        """Record, that the indexer has indexed the files in the state of stats."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute("begin")
+            self._connection.executemany(
+                """insert into indexed (indexer, path, size, mtime_ns, indexed_at)
+                values (?, ?, ?, ?, ?)
+                on conflict (indexer, path) do update set
+                    size = excluded.size,
+                    mtime_ns = excluded.mtime_ns,
+                    indexed_at = excluded.indexed_at""",
+                [
+                    (indexer, self._key(file), size, mtime_ns, now)
+                    for file, (size, mtime_ns) in stats.items()
+                ],
+            )
+            self._connection.execute("commit")
+
+    def purge(self, indexer: str, files: Iterable[Path]) -> int:
+        """Remove the entries of the indexer, that are not in the files (e.g. the
+        files of the storage). Returns the number of removed entries."""
+        keep = {self._key(file) for file in files}
+        removed = [
+            (indexer, path) for path in self._entries(indexer) if path not in keep
+        ]
+        with self._lock:
+            self._connection.execute("begin")
+            self._connection.executemany(
+                "delete from indexed where indexer = ? and path = ?", removed
+            )
+            self._connection.execute("commit")
+        return len(removed)
+
+    def _entries(self, indexer: str) -> dict[str, tuple[int, int]]:
+        with self._lock:
+            rows = self._connection.execute(
+                "select path, size, mtime_ns from indexed where indexer = ?",
+                (indexer,),
+            ).fetchall()
+        return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def _key(self, file: Path) -> str:
+        file = Path(file)
+        if self.base and file.is_relative_to(self.base):
+            return file.relative_to(self.base).as_posix()
+        return file.as_posix()
@@ -0,0 +1,251 @@
+"""Persistent record of the files stored in a directory storage."""
+
+import sqlite3
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from threading import Lock
+
+"""SQL condition for an entry, that still describes the file found on the disk."""
+UNCHANGED = """(files.complete = 1
+    and files.stored_size = excluded.stored_size
+    and files.mtime_ns = excluded.mtime_ns)"""
+
+
+class Manifest:
+    """SQLite backed manifest of the stored files.
+
+    An entry is keyed by the path relative to the storage and records the IDN, the
+    file name, the size and checksum announced by the source (e.g. the METS) and the
+    size, modification time and digests of the local copy once it is complete.
+
+    The complete entries also serve as an index of the storage, that can be listed
+    without walking the directory tree."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.row_factory = sqlite3.Row
+        with self._lock:
+            self._connection.execute("pragma journal_mode=wal")
+            self._connection.execute(
+                """create table if not exists files (
+                    path text primary key,
+                    idn text,
+                    name text,
+                    size integer,
+                    checksum text,
+                    complete integer not null default 0,
+                    stored_size integer,
+                    mtime_ns integer,
+                    sha256 text,
+                    sha1 text
+                )"""
+            )
+            self._connection.execute(
+                "create index if not exists files_idn on files (idn)"
+            )
+            self._connection.execute(
+                "create table if not exists meta (key text primary key, value text)"
+            )
+            columns = {
+                row["name"]
+                for row in self._connection.execute("pragma table_info(files)")
+            }
+            for column in ["sha256", "sha1"]:
+                if column not in columns:
+                    self._connection.execute(
+                        f"alter table files add column {column} text"
+                    )
+
+    def get(self, path: str) -> dict | None:
+        with self._lock:
+            row = self._connection.execute(
+                "select * from files where path = ?", (path,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def begin(self, path: str, size: int = None, checksum: str = None):
+        """Record that the file is about to be (re)written."""
+        idn, _, name = path.partition("/")
+        with self._lock:
+            self._connection.execute(
+                """insert into files (path, idn, name, size, checksum, complete)
+                values (?, ?, ?, ?, ?, 0)
+                on conflict (path) do update set
+                    size = excluded.size,
+                    checksum = excluded.checksum,
+                    complete = 0,
+                    stored_size = null,
+                    mtime_ns = null,
+                    sha256 = null,
+                    sha1 = null""",
+                (path, idn if name else None, name or idn, size, checksum),
+            )
+
+    def complete(
+        self,
+        path: str,
+        stored_size: int,
+        mtime_ns: int,
+        sha256: str = None,
+        sha1: str = None,
+    ):
+        """Mark the file as completely written."""
+        with self._lock:
+            self._connection.execute(
+                """update files set
+                    complete = 1, stored_size = ?, mtime_ns = ?, sha256 = ?, sha1 = ?
+                where path = ?""",
+                (stored_size, mtime_ns, sha256, sha1, path),
+            )
+
+    def is_complete(
+        self, path: str, file: Path, size: int = None, checksum: str = None
+    ) -> bool:
+        """Check if the file was completely written and was not changed since.
+
+        The local copy needs to match the recorded size and modification time and the
+        recorded entry needs to match the size and checksum announced by the source."""
+        entry = self.get(path)
+        if not entry or not entry["complete"]:
+            return False
+        if size is not None and entry["stored_size"] != size:
+            return False
+        if checksum is not None and entry["checksum"] != checksum:
+            return False
+        try:
+            stat = file.stat()
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (
+            entry["stored_size"],
+            entry["mtime_ns"],
+        )
+
+    @property
+    def indexed(self) -> bool:
+        """True, if the entries were built from the files on the disk at least once."""
+        with self._lock:
+            row = self._connection.execute(
+                "select value from meta where key = 'indexed'"
+            ).fetchone()
+        return row is not None
+
+    def paths(
+        self,
+        pattern: str = None,
+        idn: str = None,
+        min_size: int = None,
+        max_size: int = None,
+    ) -> Iterator[str]:
+        """List the paths of the complete files in order.
+
+        pattern is a glob on the path (e.g. "*.warc.gz"), the size limits are
+        compared to the size of the local copy."""
+        conditions, parameters = ["complete = 1"], []
+        for condition, value in [
+            ("path glob ?", pattern),
+            ("idn = ?", idn),
+            ("stored_size >= ?", min_size),
+            ("stored_size <= ?", max_size),
+        ]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        query = f"select path from files where {' and '.join(conditions)} order by path"
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        return (row["path"] for row in rows)
+
+    def idns(self) -> list[str]:
+        """List the IDNs, that have at least one complete file."""
+        with self._lock:
+            rows = self._connection.execute(
+                """select distinct idn from files
+                where complete = 1 and idn is not null order by idn"""
+            ).fetchall()
+        return [row["idn"] for row in rows]
+
+    def reindex(self, files: Iterable[tuple[str, int, int]]) -> int:
+        """Replace the complete entries with the given (path, size, mtime_ns) files.
+
+        Entries of unchanged files keep their checksum and digests, entries of files
+        that are gone are removed. Returns the number of indexed files."""
+        count = 0
+        with self._lock:
+            connection = self._connection
+            connection.execute("begin")
+            try:
+                connection.execute(
+                    "create temp table if not exists seen (path text primary key)"
+                )
+                connection.execute("delete from seen")
+                for path, stored_size, mtime_ns in files:
+                    idn, _, name = path.partition("/")
+                    connection.execute("insert into seen values (?)", (path,))
+                    connection.execute(
+                        f"""insert into files (path, idn, name, size, complete,
+                            stored_size, mtime_ns)
+                        values (?, ?, ?, ?, 1, ?, ?)
+                        on conflict (path) do update set
+                            size = iif({UNCHANGED}, files.size, excluded.size),
+                            checksum = iif({UNCHANGED}, files.checksum, null),
+                            sha256 = iif({UNCHANGED}, files.sha256, null),
+                            sha1 = iif({UNCHANGED}, files.sha1, null),
+                            complete = 1,
+                            stored_size = excluded.stored_size,
+                            mtime_ns = excluded.mtime_ns""",
+                        (
+                            path,
+                            idn if name else None,
+                            name or idn,
+                            stored_size,
+                            stored_size,
+                            mtime_ns,
+                        ),
+                    )
+                    count += 1
+                connection.execute(
+                    """delete from files
+                    where complete = 1 and path not in (select path from seen)"""
+                )
+                connection.execute(
+                    "insert or replace into meta values ('indexed', ?)",
+                    (str(time.time()),),
+                )
+                connection.execute("commit")
+            except BaseException:
+                connection.execute("rollback")
+                raise
+        return count
+
+    def summary(self) -> dict:
+        """Count the complete files and their bytes, in total and per SHA-256 digest.
+
+        Files without a digest are counted as distinct content."""
+        with self._lock:
+            files, size = self._connection.execute(
+                """select count(*), coalesce(sum(stored_size), 0)
+                from files where complete = 1"""
+            ).fetchone()
+            digests, digest_size = self._connection.execute(
+                """select count(*), coalesce(sum(stored_size), 0) from (
+                    select max(stored_size) as stored_size from files
+                    where complete = 1 and sha256 is not null group by sha256
+                )"""
+            ).fetchone()
+            undigested, undigested_size = self._connection.execute(
+                """select count(*), coalesce(sum(stored_size), 0)
+                from files where complete = 1 and sha256 is null"""
+            ).fetchone()
+        return {
+            "files": files,
+            "bytes": size,
+            "unique_files": digests + undigested,
+            "unique_bytes": digest_size + undigested_size,
+        }
@@ -61,9 +61,11 @@ class StoragePlugin(Plugin):
         self,
         stream: StorageStream,
         callback: Callable = None,
+        jobs: int = 1,
     ):
         """Store the data at the given id in the storage.
         If data is None, a writable IO-like object is returned.
+        jobs is the number of entries that may be stored concurrently.
         """
         pass
 
@@ -84,10 +86,20 @@ class IndexerPlugin(Plugin):
     """Implement to trigger the indexing of the WARC files for a replay engine."""
 
     @abstractmethod
-    def index(self, warcs: list):
-        """Takes a list of paths to WARC files."""
+    def index(self, warcs: list) -> list:
+        """Takes a list of paths to WARC files.
+
+        Returns the paths, that were indexed successfully, only these are recorded
+        in the ledger, the others are indexed again by the next run."""
         pass
 
+    @property
+    def ledger_key(self) -> str:
+        """Identify the index in the ledger of the indexed files (see wacli.ledger).
+
+        Indexers, that write to a configurable target, include it in the key."""
+        return type(self).__module__
+
 
 class OperationPlugin(Plugin):
     """Implement to trigger some operation on the WARC files."""
@@ -0,0 +1,137 @@
+"""Report the progress of many concurrent transfers with little overhead."""
+
+import heapq
+import time
+from collections.abc import Callable
+from threading import Lock
+
+from rich.progress import Progress
+
+
+class ProgressBatch:
+    """Collect the advances of a single transfer and pass them on in batches.
+
+    The callbacks are called, when min_bytes are collected or min_interval seconds
+    passed since the last call, and on flush. A transfer, that started without a
+    total, reports the transferred bytes as total, when it is complete."""
+
+    def __init__(
+        self,
+        callbacks: list[Callable],
+        name,
+        total: int = None,
+        min_bytes: int = 8 * 1024 * 1024,
+        min_interval: float = 0.5,
+    ):
+        self.callbacks = callbacks
+        self.name = name
+        self.total = total
+        self.min_bytes = min_bytes
+        self.min_interval = min_interval
+        self.pending = 0
+        self.transferred = 0
+        self.reported = time.monotonic()
+
+    def advance(self, count: int):
+        self.pending += count
+        self.transferred += count
+        if self.pending >= self.min_bytes or (
+            time.monotonic() - self.reported >= self.min_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.pending and self.callbacks:
+            for callback in self.callbacks:
+                callback(advance=self.pending, total=self.total, name=self.name)
+        self.pending = 0
+        self.reported = time.monotonic()
+
+    def complete(self):
+        """Flush the advances and report the total of a transfer, whose size was
+        not known, when it started."""
+        self.flush()
+        if self.total is None:
+            self.total = self.transferred
+            for callback in self.callbacks:
+                callback(advance=0, total=self.total, name=self.name)
+
+
+class TransferProgress:
+    """Display one aggregated progress bar and the most recently active transfers.
+
+    callback has the signature of the storage callbacks (advance, total, name), it
+    only counts the bytes, the display is updated at most every interval seconds. A
+    transfer is done, when it reached its total, the total of a transfer without a
+    known size is reported, when it is complete (see ProgressBatch.complete)."""
+
+    def __init__(
+        self, description: str = "Transferring", top: int = 5, interval: float = 0.2
+    ):
+        self.description = description
+        self.top = top
+        self.interval = interval
+        self.progress = Progress()
+        self._lock = Lock()
+        self._active = {}
+        self._completed = 0
+        self._total = 0
+        self._files = 0
+        self._files_done = 0
+        self._rendered = 0
+
+    def __enter__(self):
+        self.progress.start()
+        self._overall_task = self.progress.add_task(self.description, total=None)
+        self._file_tasks = [
+            self.progress.add_task("", total=None, visible=False)
+            for _ in range(self.top)
+        ]
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self._render()
+        self.progress.stop()
+
+    def callback(self, advance: int, total: int, name):
+        now = time.monotonic()
+        with self._lock:
+            if (transfer := self._active.get(name)) is None:
+                transfer = self._active[name] = [0, None, now]
+                self._files += 1
+            if transfer[1] is None and total is not None:
+                transfer[1] = total
+                self._total += total
+            transfer[0] += advance
+            transfer[2] = now
+            self._completed += advance
+            if transfer[1] is not None and transfer[0] >= transfer[1]:
+                del self._active[name]
+                self._files_done += 1
+            if now - self._rendered >= self.interval:
+                self._render()
+
+    def _render(self):
+        self._rendered = time.monotonic()
+        self.progress.update(
+            self._overall_task,
+            description=(
+                f"[blue]{self.description} {self._files_done}/{self._files} files"
+            ),
+            completed=self._completed,
+            total=self._total or None,
+        )
+        recent = heapq.nlargest(
+            self.top, self._active.items(), key=lambda item: item[1][2]
+        )
+        for task, (name, (completed, total, _)) in zip(
+            self._file_tasks, recent + [(None, (0, None, 0))] * self.top
+        ):
+            self.progress.update(
+                task,
+                description=f"[bright_black]{name}" if name else "",
+                completed=completed,
+                total=total,
+                visible=name is not None,
+            )
@@ -1,10 +1,21 @@
-from itertools import tee
+from pathlib import Path
 
 import click
 from loguru import logger
-from rich.progress import Progress
-
-from .plugin_manager import PluginManager
+from warcio.exceptions import ArchiveLoadFailed
+
+from .compression import (
+    BACKENDS,
+    BENCHMARK_LEVELS,
+    DECOMPRESSION_ERRORS,
+    FORMATS,
+    benchmark,
+    benchmark_backends,
+)
+from .ledger import LEDGER_PATH, Ledger
+from .plugin_manager import ConfigurationError, PluginManager
+from .progress import TransferProgress
+from .warc import is_warc_name, serialized_records
 
 
 @click.group()
@@ -15,14 +26,96 @@ from .plugin_manager import PluginManager
 @click.option("--query-collection-dir", envvar="QUERY_COLLECTION_DIR", default=None)
 @click.option("--aras-rest-base", envvar="ARAS_REST_BASE", default=None)
 @click.option("--aras-repo", envvar="ARAS_REPO", default=None)
+@click.option("--aras-pool-size", envvar="ARAS_POOL_SIZE", type=int, default=None)
+@click.option("--aras-http2/--no-aras-http2", envvar="ARAS_HTTP2", default=True)
+@click.option("--aras-cache-dir", envvar="ARAS_CACHE_DIR", default=None)
+@click.option("--aras-cache-ttl", envvar="ARAS_CACHE_TTL", type=float, default=None)
+@click.option(
+    "--aras-max-bytes-per-second",
+    envvar="ARAS_MAX_BYTES_PER_SECOND",
+    type=float,
+    default=None,
+)
+@click.option(
+    "--aras-max-requests-per-second",
+    envvar="ARAS_MAX_REQUESTS_PER_SECOND",
+    type=float,
+    default=None,
+)
+@click.option(
+    "--aras-max-concurrency", envvar="ARAS_MAX_CONCURRENCY", type=int, default=None
+)
 @click.option("--warc-dir", "--warc-directory", envvar="WARC_DIRECTORY", default=None)
+@click.option(
+    "--warc-dir-dedup/--no-warc-dir-dedup",
+    "--warc-directory-dedup/--no-warc-directory-dedup",
+    envvar="WARC_DIRECTORY_DEDUP",
+    default=False,
+)
+@click.option(
+    "--warc-dir-shard-depth",
+    "--warc-directory-shard-depth",
+    envvar="WARC_DIRECTORY_SHARD_DEPTH",
+    type=click.IntRange(min=0),
+    default=0,
+)
 @click.option(
     "--warc-dir-clean",
     "--warc-directory-clean",
     envvar="WARC_DIRECTORY_CLEAN",
     default=None,
 )
+@click.option(
+    "--warc-dir-clean-compression",
+    "--warc-directory-clean-compression",
+    envvar="WARC_DIRECTORY_CLEAN_COMPRESSION",
+    type=click.Choice(list(FORMATS)),
+    default="gzip",
+)
+@click.option(
+    "--warc-dir-clean-zstd-dictionary-size",
+    "--warc-directory-clean-zstd-dictionary-size",
+    envvar="WARC_DIRECTORY_CLEAN_ZSTD_DICTIONARY_SIZE",
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "--recompress-level",
+    envvar="RECOMPRESS_LEVEL",
+    type=click.IntRange(min=0, max=22),
+    default=None,
+)
+@click.option(
+    "--recompress-backend",
+    envvar="RECOMPRESS_BACKEND",
+    type=click.Choice(["auto", *BACKENDS]),
+    default=None,
+)
+@click.option(
+    "--recompress-record-jobs",
+    envvar="RECOMPRESS_RECORD_JOBS",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The threads, that compress the records of a large file in each worker "
+    "process, by default the cores divided by the jobs of recompress-warcs.",
+)
+@click.option(
+    "--recompress-cdxj/--no-recompress-cdxj",
+    envvar="RECOMPRESS_CDXJ",
+    default=False,
+)
 @click.option("--pywb-dir", "--pywb-directory", envvar="PYWB_DIRECTORY", default=None)
+@click.option(
+    "--pywb-native/--no-pywb-native",
+    envvar="PYWB_NATIVE",
+    default=False,
+    help="Write the CDXJ index of the pywb collection in-process, without Docker.",
+)
+@click.option("--outbackcdx-url", envvar="OUTBACKCDX_URL", default=None)
+@click.option("--solrwayback-url", envvar="SOLRWAYBACK_URL", default=None)
+@click.option(
+    "--index-jobs", envvar="INDEX_JOBS", type=click.IntRange(min=1), default=1
+)
 def cli(
     ctx,
     endpoint,
@@ -31,9 +124,28 @@ def cli(
     query_collection_dir,
     aras_rest_base,
     aras_repo,
+    aras_pool_size,
+    aras_http2,
+    aras_cache_dir,
+    aras_cache_ttl,
+    aras_max_bytes_per_second,
+    aras_max_requests_per_second,
+    aras_max_concurrency,
     warc_dir,
+    warc_dir_dedup,
+    warc_dir_shard_depth,
     warc_dir_clean,
+    warc_dir_clean_compression,
+    warc_dir_clean_zstd_dictionary_size,
+    recompress_level,
+    recompress_backend,
+    recompress_record_jobs,
+    recompress_cdxj,
     pywb_dir,
+    pywb_native,
+    outbackcdx_url,
+    solrwayback_url,
+    index_jobs,
 ):
     ctx.ensure_object(dict)
     ctx.obj["plugin_manager"] = PluginManager()
@@ -58,12 +170,23 @@ def cli(
                 "module": "wacli_plugins.storage.aras",
                 "rest_base": aras_rest_base,
                 "repo": aras_repo,
+                "pool_size": aras_pool_size,
+                "http2": aras_http2,
+                "cache_dir": aras_cache_dir,
+                "cache_ttl": aras_cache_ttl,
+                "max_bytes_per_second": aras_max_bytes_per_second,
+                "max_requests_per_second": aras_max_requests_per_second,
+                "max_concurrency": aras_max_concurrency,
             }
         ],
         "local_repository": [
             {
-                "module": "wacli_plugins.storage.directory",
+                "module": "wacli_plugins.storage."
+                + ("dedup" if warc_dir_dedup else "directory"),
                 "path": warc_dir,
+                "manifest": ".wacli/manifest.sqlite",
+                "index": True,
+                "shard_depth": warc_dir_shard_depth,
             }
         ],
         "catalog_query_collection_backend": [
@@ -76,24 +199,63 @@ def cli(
             {
                 "module": "wacli_plugins.storage.directory",
                 "path": warc_dir_clean,
+                "hardlink": True,
+                "compression": warc_dir_clean_compression,
+                "zstd_dictionary_size": warc_dir_clean_zstd_dictionary_size,
             }
         ],
         "indexers": [
             {
+                "module": "wacli_plugins.indexer.cdxj",
+                "path": str(Path(pywb_dir or ".", "collections", "dnb", "indexes")),
+                "archive_path": str(
+                    Path(pywb_dir or ".", "collections", "dnb", "archive")
+                ),
+                "warc_path": warc_dir,
+                "clean_warc_path": warc_dir_clean,
+                "jobs": index_jobs,
+            }
+            if pywb_native
+            else {
                 "module": "wacli_plugins.indexer.pywb",
                 "collection": "dnb",
                 "pywb_path": pywb_dir,
                 "warc_path": warc_dir,
+                "clean_warc_path": warc_dir_clean,
             },
-            {"module": "wacli_plugins.indexer.solrwayback"},
         ],
         "recompressor": [
             {
                 "module": "wacli_plugins.operations.recompress",
                 "verbose": True,
+                "target_repository": "local_recompressed_repository",
+                "level": recompress_level,
+                "backend": recompress_backend,
+                "record_jobs": recompress_record_jobs,
+                "cdxj": recompress_cdxj,
             },
         ],
     }
+    if outbackcdx_url:
+        plugin_configuration["indexers"].append(
+            {
+                "module": "wacli_plugins.indexer.outbackcdx",
+                "url": outbackcdx_url,
+                "warc_path": warc_dir,
+                "clean_warc_path": warc_dir_clean,
+                "jobs": index_jobs,
+            }
+        )
+    if solrwayback_url:
+        plugin_configuration["indexers"].append(
+            {
+                "module": "wacli_plugins.indexer.solrwayback",
+                "url": solrwayback_url,
+                "warc_path": warc_dir,
+                "clean_warc_path": warc_dir_clean,
+                "jobs": index_jobs,
+            }
+        )
     ctx.obj["plugin_manager"].register_plugins(plugin_configuration)
 
 
@@ -128,7 +290,10 @@ def list_cmd(ctx):
 
 @cli.command()
 @click.pass_context
-def load_warcs(ctx):
+@click.option(
+    "--jobs", "-j", envvar="WACLI_JOBS", type=click.IntRange(min=1), default=1
+)
+def load_warcs(ctx, jobs):
     catalog = ctx.obj["plugin_manager"].get("catalog")
     source_repository = ctx.obj["plugin_manager"].get("source_repository")
     local_repository = ctx.obj["plugin_manager"].get("local_repository")
@@ -137,56 +302,109 @@ def load_warcs(ctx):
     warc_list = catalog.list()
     logger.debug(warc_list)
 
-    with Progress() as progress:
-        tasks = {}
-
-        def get_task(name):
-            if name not in tasks:
-                tasks[name] = progress.add_task(
-                    "[bright_black]Downloading...",
-                    total=None,
-                )
-            return tasks.get(name)
-
-        def callback_factory(description, id_prefix=None):
-            def callback(advance, total, name):
-                progress.update(
-                    get_task(id_prefix + str(name)),
-                    description=f"{description} {name}...",
-                    advance=advance,
-                    total=total,
-                )
-
-            return callback
-
-        target_callback = callback_factory("[blue]Storing", id_prefix="target")
-        source_callback = callback_factory("[blue]Downloading", id_prefix="source")
-
+    with TransferProgress("Downloading") as progress:
         logger.debug("Setup download tasks …")
         local_repository.store_stream(
-            source_repository.retrieve_stream(catalog.list(), callback=source_callback),
-            callback=target_callback,
+            source_repository.retrieve_stream(catalog.list()),
+            callback=progress.callback,
+            jobs=jobs,
         )
     logger.debug("DONE loading WARCs.")
 
 
 @cli.command()
 @click.pass_context
-def index_warcs(ctx):
+def reindex(ctx):
+    """Rebuild the index of the local repository from the files on the disk"""
     local_repository = ctx.obj["plugin_manager"].get("local_repository")
+    count = local_repository.reindex()
+    logger.info(f"Indexed {count} files in {local_repository.path}")
+
+
+@cli.command()
+@click.pass_context
+@click.option(
+    "--from-shard-depth",
+    type=click.IntRange(min=0),
+    default=0,
+    help="The shard depth of the existing tree, 0 is a flat tree.",
+)
+def migrate_layout(ctx, from_shard_depth):
+    """Move the local repository from a layout to the configured layout"""
+    local_repository = ctx.obj["plugin_manager"].get("local_repository")
+    moved = local_repository.relayout(from_shard_depth, local_repository.shard_width)
+    logger.info(f"Moved {moved} entries in {local_repository.path}")
+
+
+@cli.command()
+@click.pass_context
+def dedup_stats(ctx):
+    """Show how much space the deduplication of the local repository saves"""
+    local_repository = ctx.obj["plugin_manager"].get("local_repository")
+    if not hasattr(local_repository, "stats"):
+        raise click.UsageError("The local repository is not deduplicated.")
+    stats = local_repository.stats()
+    click.echo(
+        f"{stats['files']} files with {stats['bytes']} bytes are stored as "
+        f"{stats['unique_files']} unique files with {stats['unique_bytes']} bytes "
+        f"(ratio {stats['dedup_ratio']:.2f}, saved {stats['saved_bytes']} bytes)"
+    )
+
+
+@cli.command()
+@click.pass_context
+@click.option(
+    "--recompressed/--no-recompressed",
+    default=False,
+    help="Index the recompressed WARC files (and use their CDXJ sidecars).",
+)
+@click.option(
+    "--full/--incremental",
+    default=False,
+    help="Index all files, not only the files, that are new or changed since the "
+    "last run.",
+)
+@click.option(
+    "--purge/--no-purge",
+    default=False,
+    help="Remove the files, that are not in the repository anymore, from the ledger.",
+)
+def index_warcs(ctx, recompressed, full, purge):
+    """Index the new and changed warc files with each indexer"""
+    repository = ctx.obj["plugin_manager"].get(
+        "local_recompressed_repository" if recompressed else "local_repository"
+    )
     indexers = list(ctx.obj["plugin_manager"].get_all("indexers"))
     logger.debug(indexers)
 
-    warc_list = local_repository.list_files()
+    warc_list = list(repository.list_files(filter_fn=is_warc_name))
     logger.debug(warc_list)
-    warc_lists = iter(tee(warc_list, len(indexers)))
+    ledger = Ledger(Path(repository.path) / LEDGER_PATH, repository.path)
+    stats = ledger.stats(warc_list)
     for indexer in indexers:
-        indexer.index(next(warc_lists))
+        if purge:
+            removed = ledger.purge(indexer.ledger_key, stats)
+            logger.info(
+                f"Removed {removed} files from the ledger of {indexer.ledger_key}"
+            )
+        changed = stats if full else ledger.changed(indexer.ledger_key, stats)
+        logger.info(
+            f"{indexer.ledger_key}: {len(changed)} of {len(stats)} files to index"
+        )
+        if changed:
+            indexed = indexer.index(list(changed))
+            # the files are recorded in the state, they had before they were indexed
+            ledger.record(
+                indexer.ledger_key, {file: changed[file] for file in map(Path, indexed)}
+            )
 
 
 @cli.command()
 @click.pass_context
-def recompress_warcs(ctx):
+@click.option(
+    "--jobs", "-j", envvar="WACLI_JOBS", type=click.IntRange(min=1), default=1
+)
+def recompress_warcs(ctx, jobs):
     """Recompress warc files"""
     local_repository = ctx.obj["plugin_manager"].get("local_repository")
     local_recompressed_repository = ctx.obj["plugin_manager"].get(
@@ -196,10 +414,53 @@ def recompress_warcs(ctx):
 
     warc_list = local_repository.list()
     local_recompressed_repository.store_stream(
-        recompressor.run(local_repository.retrieve_stream(warc_list, mode="rb"))
+        recompressor.run(
+            local_repository.retrieve_stream(warc_list, mode="rb"), jobs=jobs
+        )
     )
 
 
+@cli.command()
+@click.pass_context
+@click.argument("files", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--backend", "-b", "backends", multiple=True, type=click.Choice([*BACKENDS, "zstd"])
+)
+@click.option("--level", "-l", "levels", multiple=True, type=click.IntRange(0, 22))
+@click.option("--sample-size", type=int, default=64 * 1024 * 1024)
+def benchmark_compression(ctx, files, backends, levels, sample_size):
+    """Compare the throughput and ratio of the compression backends and levels"""
+    if not files:
+        local_repository = ctx.obj["plugin_manager"].get("local_repository")
+        files = local_repository.list_files(filter_fn=is_warc_name)
+    records = []
+    for file in files:
+        try:
+            with open(file, "rb") as source_io:
+                for record in serialized_records(source_io):
+                    records.append(record)
+                    sample_size -= len(record)
+                    if sample_size <= 0:
+                        break
+        except (ArchiveLoadFailed, *DECOMPRESSION_ERRORS) as e:
+            raise click.ClickException(f"Could not read the records of {file}: {e}")
+        if sample_size <= 0:
+            break
+    if not records:
+        raise click.UsageError("No WARC records found to compress.")
+
+    for backend in backends or benchmark_backends():
+        for level in levels or BENCHMARK_LEVELS[backend]:
+            try:
+                result = benchmark(records, backend, level)
+            except ConfigurationError as e:
+                raise click.BadParameter(str(e), param_hint="'--backend' / '--level'")
+            click.echo(
+                f"{backend:8} level {level}: {result['mb_per_second']:8.1f} MB/s, "
+                f"ratio {result['ratio']:.3f}"
+            )
+
+
 @cli.command()
 @click.pass_context
 def check_warcs(ctx):
@@ -0,0 +1,88 @@
+"""Limit the rate and the concurrency of requests to a shared backend."""
+
+import time
+from contextlib import contextmanager
+from threading import Condition, Lock
+
+
+class TokenBucket:
+    """A thread-safe token bucket.
+
+    Tokens are refilled at rate per second up to capacity. Consuming more tokens than
+    available blocks the caller until the debt is paid off, so the long-term rate never
+    exceeds the configured rate, while bursts up to capacity are allowed."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = Lock()
+
+    def consume(self, amount: float = 1):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AimdLimiter:
+    """Limit the number of concurrent requests with additive increase/multiplicative
+    decrease.
+
+    Each successful request raises the limit by 1/limit (i.e. by one per round of
+    requests), an overloaded backend (429, 5xx or a latency spike) halves it."""
+
+    def __init__(
+        self,
+        maximum: int,
+        minimum: int = 1,
+        decrease: float = 0.5,
+        latency_spike: float = 3.0,
+    ):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease = decrease
+        self.latency_spike = latency_spike
+        self.limit = float(maximum)
+        self.active = 0
+        self.latency = None
+        self._condition = Condition()
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the concurrent slots while the block is executed."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._condition.notify_all()
+
+    def success(self, latency: float):
+        with self._condition:
+            if self.latency is not None and latency > self.latency_spike * self.latency:
+                self._decrease()
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            # exponentially weighted moving average of the latency
+            self.latency = (
+                latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            )
+            self._condition.notify_all()
+
+    def overload(self):
+        with self._condition:
+            self._decrease()
+
+    def _decrease(self):
+        self.limit = max(self.minimum, self.limit * self.decrease)
@@ -0,0 +1,159 @@
+"""Copy data between file objects."""
+
+import codecs
+import os
+import stat
+from collections.abc import Callable
+from io import FileIO, RawIOBase, TextIOBase, UnsupportedOperation
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+"""ioctl request to share the extents of a file (reflink) on btrfs, xfs, etc."""
+FICLONE = 0x40049409
+ZERO_COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def copy_stream(
+    source_io,
+    target_io,
+    buffer_size: int,
+    on_chunk: Callable[[memoryview | bytes], None] = None,
+    encoding: str = "utf-8",
+) -> int:
+    """Copy the source to the binary target and return the number of copied bytes.
+
+    Binary sources are read into a single reused buffer. Text sources are encoded
+    with one incremental encoder. on_chunk is called with every written chunk, the
+    chunk is only valid during the call."""
+    copied = 0
+    if isinstance(source_io, TextIOBase):
+        chunks = _encode_chunks(source_io.read, buffer_size, encoding)
+    elif _implements_readinto(type(source_io)):
+        chunks = _readinto_chunks(source_io, buffer_size)
+    else:
+        chunks = _read_chunks(source_io, buffer_size, encoding)
+    for chunk in chunks:
+        target_io.write(chunk)
+        copied += len(chunk)
+        if on_chunk:
+            on_chunk(chunk)
+    return copied
+
+
+def _implements_readinto(source_type: type) -> bool:
+    """Check if readinto is implemented by the class itself and not only by a base
+    class, whose read is overridden by a subclass (e.g. a BytesIO wrapper)."""
+    for cls in source_type.__mro__:
+        if "readinto" in vars(cls):
+            return vars(cls)["readinto"] is not RawIOBase.readinto
+        if "read" in vars(cls):
+            return False
+    return False
+
+
+def _readinto_chunks(source_io, buffer_size: int):
+    buffer = memoryview(bytearray(buffer_size))
+    while length := source_io.readinto(buffer):
+        yield buffer[:length]
+
+
+def _read_chunks(source_io, buffer_size: int, encoding: str):
+    """Read chunks from a file-like object, that only implements read."""
+    first_chunk = source_io.read(buffer_size)
+    if isinstance(first_chunk, str):
+        yield from _encode_chunks(
+            source_io.read, buffer_size, encoding, first=first_chunk
+        )
+        return
+    chunk = first_chunk
+    while chunk:
+        yield chunk
+        chunk = source_io.read(buffer_size)
+
+
+def _encode_chunks(read: Callable, buffer_size: int, encoding: str, first=None):
+    encoder = codecs.getincrementalencoder(encoding)()
+    chunk = first if first is not None else read(buffer_size)
+    while chunk:
+        if encoded := encoder.encode(chunk):
+            yield encoded
+        chunk = read(buffer_size)
+    if encoded := encoder.encode("", final=True):
+        yield encoded
+
+
+def is_regular_file(file_io) -> bool:
+    """Check if the IO object is a regular file on a local file system.
+
+    Wrappers, that decode the data of a file (e.g. GzipFile), also return the file
+    descriptor of the file, they are not accepted."""
+    if not isinstance(getattr(file_io, "raw", file_io), FileIO):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(file_io.fileno()).st_mode)
+    except (AttributeError, OSError, UnsupportedOperation):
+        return False
+
+
+def copy_file_zero(source_io, target_io, progress: Callable[[int], None]) -> bool:
+    """Copy the rest of the source file to the target file within the kernel.
+
+    A reflink is tried first, then copy_file_range and sendfile. The number of copied
+    bytes is reported to progress. Returns False if the data could not be copied
+    completely, in that case both file positions are set to where a regular copy has
+    to continue."""
+    target_io.flush()
+    source_fd, target_fd = source_io.fileno(), target_io.fileno()
+    source_offset, target_offset = source_io.tell(), target_io.tell()
+    size = os.fstat(source_fd).st_size
+
+    if source_offset == 0 and target_offset == 0 and _reflink(source_fd, target_fd):
+        progress(size)
+        source_offset = target_offset = size
+    for copy in [_copy_file_range, _sendfile]:
+        try:
+            while source_offset < size:
+                count = copy(
+                    source_fd,
+                    target_fd,
+                    source_offset,
+                    target_offset,
+                    min(ZERO_COPY_CHUNK_SIZE, size - source_offset),
+                )
+                if count == 0:
+                    break
+                source_offset += count
+                target_offset += count
+                progress(count)
+            break
+        except OSError as e:
+            logger.debug(f"{copy.__name__} is not possible: {e}")
+    source_io.seek(source_offset)
+    target_io.seek(target_offset)
+    return source_offset >= size
+
+
+def _reflink(source_fd: int, target_fd: int) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(target_fd, FICLONE, source_fd)
+        return True
+    except OSError:
+        return False
+
+
+def _copy_file_range(source_fd, target_fd, source_offset, target_offset, count):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError("copy_file_range is not available")
+    return os.copy_file_range(source_fd, target_fd, count, source_offset, target_offset)
+
+
+def _sendfile(source_fd, target_fd, source_offset, target_offset, count):
+    os.lseek(target_fd, target_offset, os.SEEK_SET)
+    return os.sendfile(target_fd, source_fd, source_offset, count)
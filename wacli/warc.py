@@ -0,0 +1,413 @@
+"""Inspect and write the compression of WARC files."""
+
+import gzip
+import struct
+import zlib
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import chain
+from pathlib import Path
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.warcwriter import WARCWriter
+
+from wacli.cdxj import record_fields
+from wacli.compression import (
+    ZSTD_DICTIONARY_MAGIC,
+    ZSTD_MAGIC,
+    read_zstd_dictionary,
+    record_compressor,
+    stream_compressor,
+    train_zstd_dictionary,
+    zstd_dictionary_frame,
+    zstd_reader,
+    zstd_record_decompressor,
+)
+
+GZIP_MAGIC = b"\x1f\x8b"
+"""The largest WARC header, that is accepted in a canonical file."""
+MAX_HEADER_SIZE = 1024 * 1024
+"""The number of records, a zstd dictionary is trained on."""
+DICTIONARY_SAMPLES = 1000
+WARC_EXTENSIONS = (".warc", ".warc.gz", ".warc.zst", ".arc", ".arc.gz", ".arc.zst")
+"""The start of a record, that holds the headers to index it."""
+HEAD_SIZE = 64 * 1024
+
+
+def is_gzip(source) -> bool:
+    """Check the magic bytes of a file or of a readable IO object with peek."""
+    if isinstance(source, str | Path):
+        with open(source, "rb") as source_io:
+            return source_io.read(2) == GZIP_MAGIC
+    return source.peek(2)[:2] == GZIP_MAGIC
+
+
+def is_zstd(source) -> bool:
+    """Check, if a file or a readable IO object with peek starts with a zstd frame
+    or the skippable frame of a dictionary."""
+    if isinstance(source, str | Path):
+        with open(source, "rb") as source_io:
+            magic = source_io.read(4)
+    else:
+        magic = source.peek(4)[:4]
+    return magic in [ZSTD_MAGIC, ZSTD_DICTIONARY_MAGIC]
+
+
+def is_warc_name(name: str) -> bool:
+    """Check, if a file name has the extension of a (compressed) WARC or ARC file."""
+    return name.endswith(WARC_EXTENSIONS)
+
+
+def is_canonical(
+    path,
+    buffer_size: int = 1024 * 1024,
+    index: Callable[[dict, int, int], None] = None,
+) -> bool:
+    """Check if a WARC file is compressed per record.
+
+    A file is canonical, if every gzip member holds exactly one complete WARC record.
+    The members are inflated to find their boundaries, but nothing is compressed, so
+    this is much cheaper than a recompression. index is called with the index
+    fields (see wacli.cdxj.record_fields), the offset and the compressed length of
+    each record, while the members are inflated, its calls are only complete, if
+    the file is canonical."""
+    with open(path, "rb") as source_io:
+        if source_io.peek(2)[:2] != GZIP_MAGIC:
+            return False
+        records = 0
+        check = _CanonicalCheck()
+        try:
+            for offset, length, head in _gzip_members(
+                source_io, buffer_size, HEAD_SIZE if index else 0, check.feed
+            ):
+                records += 1
+                if index is not None:
+                    index(record_fields(head), offset, length)
+        except (zlib.error, EOFError):
+            return False
+        return check.canonical and records > 0
+
+
+def _gzip_members(
+    source_io,
+    buffer_size: int,
+    head_size: int = HEAD_SIZE,
+    feed: Callable[[bytes | None], bool] = None,
+):
+    """Yield the offset, the compressed length and the head of each gzip member.
+
+    The members are inflated in chunks of up to buffer_size bytes. feed is called
+    with each chunk and with None at the end of each member, the walk stops, when it
+    returns False."""
+    offset, length, head = 0, 0, b""
+    decompressor = None
+    while chunk := source_io.read(buffer_size):
+        while chunk:
+            if decompressor is None:
+                decompressor = zlib.decompressobj(wbits=31)
+                length, head = 0, b""
+            data = decompressor.decompress(chunk, buffer_size)
+            if len(head) < head_size:
+                head += data[: head_size - len(head)]
+            if feed is not None and not feed(data):
+                return
+            if decompressor.eof:
+                unused = decompressor.unused_data
+                length += len(chunk) - len(unused)
+                if feed is not None and not feed(None):
+                    return
+                yield offset, length, head
+                offset += length
+                chunk = unused
+                decompressor = None
+            else:
+                length += len(chunk) - len(decompressor.unconsumed_tail)
+                chunk = decompressor.unconsumed_tail
+    if decompressor is not None:
+        raise EOFError("The last gzip member is truncated")
+
+
+def record_members(source_io, buffer_size: int = 1024 * 1024, head_size=HEAD_SIZE):
+    """Yield the offset, the compressed length and the head of each record of a WARC
+    file, that is compressed per record with gzip or zstd.
+
+    The head is the start of the uncompressed record with up to head_size bytes.
+    Only the head is kept, but each member is decompressed to its end, as the end of
+    a deflate stream (or zstd frame) is only known by decompressing it. This is
+    cheaper than a recompression, but not than a read of the file. The source needs
+    to support peek."""
+    if is_gzip(source_io):
+        yield from _gzip_members(source_io, buffer_size, head_size)
+        return
+    offset = 0
+    if (header := source_io.peek(8)[:8])[:4] == ZSTD_DICTIONARY_MAGIC:
+        offset = 8 + struct.unpack("<I", header[4:])[0]
+    decompressor = zstd_record_decompressor(read_zstd_dictionary(source_io))
+
+    current, length, head = None, 0, b""
+    while chunk := source_io.read(buffer_size):
+        while chunk:
+            if current is None:
+                current, length, head = decompressor(), 0, b""
+            if len(head) < head_size:
+                head += current.decompress(chunk)[: head_size - len(head)]
+            else:
+                current.decompress(chunk)
+            unused = current.unused_data if current.eof else b""
+            length += len(chunk) - len(unused)
+            if current.eof:
+                yield offset, length, head
+                offset += length
+                current = None
+            chunk = unused
+    if current is not None:
+        raise EOFError("The last record is truncated")
+
+
+def index_records(source_io, buffer_size: int = 1024 * 1024):
+    """Yield the index fields (see wacli.cdxj.record_fields), the offset and the
+    compressed length of the records of a file, that is compressed per record."""
+    for offset, length, head in record_members(source_io, buffer_size):
+        yield record_fields(head), offset, length
+
+
+def warc_index(source_io):
+    """Yield the index fields, the offset and the length of the records of a WARC
+    (or ARC) file.
+
+    The file is read with warcio, which can not read zstd, so .warc.zst files are
+    indexed by their frames. The source needs to support peek."""
+    if is_zstd(source_io):
+        yield from index_records(source_io)
+        return
+    iterator = ArchiveIterator(source_io, arc2warc=True)
+    for record in iterator:
+        offset = iterator.get_record_offset()
+        head = record.rec_headers.to_bytes()
+        if record.http_headers:
+            head += record.http_headers.to_bytes()
+        iterator.read_to_end(record)
+        yield record_fields(head), offset, iterator.get_record_length()
+
+
+class _RecordBoundary:
+    """Follow the inflated data of a gzip member, that should hold one WARC record.
+
+    The record is the header block, the content block of Content-Length bytes and
+    two CRLF."""
+
+    def __init__(self):
+        self.header = b""
+        self.expected = None
+        self.length = 0
+
+    def feed(self, data: bytes) -> bool:
+        self.length += len(data)
+        if self.expected is None:
+            self.header += data
+            end = self.header.find(b"\r\n\r\n")
+            if end < 0:
+                return len(self.header) <= MAX_HEADER_SIZE
+            if not self.header.startswith(b"WARC/"):
+                return False
+            content_length = None
+            for line in self.header[:end].split(b"\r\n")[1:]:
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    try:
+                        content_length = int(value.strip())
+                    except ValueError:
+                        return False
+            if content_length is None:
+                return False
+            self.expected = end + 4 + content_length + 4
+            self.header = b""
+        return self.length <= self.expected
+
+    def complete(self) -> bool:
+        return self.length == self.expected
+
+
+class _CanonicalCheck:
+    """Follow the inflated chunks of the gzip members of a file (see _gzip_members),
+    canonical is False, once a member does not hold exactly one WARC record."""
+
+    def __init__(self):
+        self.record = _RecordBoundary()
+        self.canonical = True
+
+    def feed(self, data: bytes | None) -> bool:
+        if data is not None:
+            self.canonical = self.record.feed(data)
+        else:
+            self.canonical = self.record.complete()
+            self.record = _RecordBoundary()
+        return self.canonical
+
+
+def warc_records(source_io):
+    """Yield the warcio records of a WARC (or ARC) file.
+
+    The content of a record is read from the source, so it needs to be read (e.g. by
+    write_record), before the next record is read. The source needs to support peek
+    (e.g. a file opened in binary mode)."""
+    if is_zstd(source_io):
+        source_io = zstd_reader(source_io)
+    elif is_gzip(source_io):
+        # the records of a file, that is not compressed per record, can not be read
+        # from the gzip members, they are read from the inflated stream instead
+        source_io = gzip.GzipFile(fileobj=source_io, mode="rb")
+    yield from ArchiveIterator(
+        source_io, no_record_parse=False, arc2warc=True, verify_http=False
+    )
+
+
+def write_record(record, target_io):
+    """Write a record uncompressed, as warcio writes it, the content in chunks."""
+    WARCWriter(target_io, gzip=False).write_record(record)
+
+
+def serialized_records(source_io):
+    """Yield the records of a WARC (or ARC) file, as they are written uncompressed.
+
+    The source needs to support peek (e.g. a file opened in binary mode)."""
+    for record in warc_records(source_io):
+        buffer = BytesIO()
+        write_record(record, buffer)
+        yield buffer.getvalue()
+
+
+def _batch_records(source_io, stream_size: int):
+    """Yield the records, whose content is smaller than stream_size, serialized and
+    the other records as warcio records, that are written in chunks."""
+    for record in warc_records(source_io):
+        if record.length is not None and record.length < stream_size:
+            buffer = BytesIO()
+            write_record(record, buffer)
+            yield buffer.getvalue()
+        else:
+            yield record
+
+
+class _CompressingWriter:
+    """Compress the chunks of a record, that warcio writes, to the target, and keep
+    the head of the record to index it."""
+
+    def __init__(self, target_io, compressor, head_size: int = HEAD_SIZE):
+        self.target_io = target_io
+        self.compressor = compressor
+        self.head_size = head_size
+        self.head = b""
+        self.length = 0
+
+    def write(self, data: bytes):
+        if len(self.head) < self.head_size:
+            self.head += bytes(data[: self.head_size - len(self.head)])
+        self.length += self.target_io.write(self.compressor.compress(data))
+
+    def flush(self):
+        # warcio flushes after each record, the member is finished by close
+        pass
+
+    def close(self) -> int:
+        """Finish the member and return its compressed length."""
+        self.length += self.target_io.write(self.compressor.flush())
+        return self.length
+
+
+def recompress_records(
+    source_io,
+    target_io,
+    jobs: int = 1,
+    level: int = None,
+    batch_size: int = 16 * 1024 * 1024,
+    backend=zlib,
+    format: str = "gzip",
+    dictionary: bytes = None,
+    dictionary_size: int = 0,
+    index: Callable[[dict, int, int], None] = None,
+) -> int:
+    """Write the records of a WARC (or ARC) file as one gzip member (or zstd frame)
+    per record.
+
+    The records are read in order and collected in batches of about batch_size
+    bytes, the batches are compressed by jobs threads (zlib and its alternatives
+    release the GIL) and written in order. The gzip headers hold no time, so the
+    output is the same for any number of jobs. Records with a content of batch_size
+    bytes or more are compressed in chunks, while they are read, so they are not
+    held in memory. backend is a zlib compatible module (see wacli.compression). A
+    zstd dictionary is written to a skippable frame at the start, with a
+    dictionary_size it is trained on the first records of the file. index is called
+    with the index fields (see wacli.cdxj.record_fields), the offset and the
+    compressed length of each record. Returns the number of written bytes."""
+    written = 0
+    records = _batch_records(source_io, batch_size)
+    if format == "zstd" and dictionary is None and dictionary_size:
+        samples = []
+        for record in records:
+            samples.append(record)
+            # a large record needs to be written, before the next record is read
+            if not isinstance(record, bytes) or len(samples) == DICTIONARY_SAMPLES:
+                break
+        dictionary = train_zstd_dictionary(
+            [sample for sample in samples if isinstance(sample, bytes)],
+            dictionary_size,
+        )
+        records = chain(samples, records)
+    if format == "zstd" and dictionary:
+        written += target_io.write(zstd_dictionary_frame(dictionary))
+    compress = record_compressor(format, level, backend, dictionary)
+    with ThreadPoolExecutor(jobs, thread_name_prefix="wacli-deflate") as pool:
+        pending = deque()
+
+        def write(keep: int):
+            nonlocal written
+            while len(pending) > keep:
+                future, fields = pending.popleft()
+                for member, record_fields in zip(future.result(), fields, strict=True):
+                    target_io.write(member)
+                    if index is not None:
+                        index(record_fields, written, len(member))
+                    written += len(member)
+
+        def submit(batch: list[bytes]):
+            fields = [
+                record_fields(record[:HEAD_SIZE]) if index else None for record in batch
+            ]
+            future = pool.submit(lambda: [compress(record) for record in batch])
+            pending.append((future, fields))
+
+        def write_streamed(record):
+            nonlocal written
+            writer = _CompressingWriter(
+                target_io, stream_compressor(format, level, backend, dictionary)
+            )
+            write_record(record, writer)
+            length = writer.close()
+            if index is not None:
+                index(record_fields(writer.head), written, length)
+            written += length
+
+        batch, batch_length = [], 0
+        for record in records:
+            if not isinstance(record, bytes):
+                # the records before a large record are written first
+                if batch:
+                    submit(batch)
+                    batch, batch_length = [], 0
+                write(keep=0)
+                write_streamed(record)
+                continue
+            batch.append(record)
+            batch_length += len(record)
+            if batch_length >= batch_size:
+                submit(batch)
+                batch, batch_length = [], 0
+                # bound the batches in memory
+                write(keep=2 * jobs)
+        if batch:
+            submit(batch)
+        write(keep=0)
+    return written
@@ -0,0 +1,138 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from pathlib import Path
+from shutil import copyfile
+from tempfile import NamedTemporaryFile
+from urllib.parse import quote
+
+from loguru import logger
+from warcio.exceptions import ArchiveLoadFailed
+
+from wacli.cdxj import SIDECAR_EXTENSION, cdxj_lines, sidecar_name
+from wacli.compression import DECOMPRESSION_ERRORS
+from wacli.plugin_types import IndexerPlugin
+from wacli.warc import warc_index
+from wacli_plugins.indexer.common import relative_name
+
+
+def index_file(warc: str, filename: str) -> list[str]:
+    """Get the sorted CDXJ lines of a WARC file, this is run in the worker processes."""
+    with open(warc, "rb") as source_io:
+        return cdxj_lines(warc_index(source_io), filename)
+
+
+class CDXJIndexerPlugin(IndexerPlugin):
+    """Index WARC files to CDXJ files in-process, as pywb reads them.
+
+    One CDXJ file is written per WARC file to the index directory, pywb merges all
+    .cdxj files of a collection's indexes directory. pywb looks the files up by
+    their filename in the archive_paths of its config.yaml, by default in the
+    collection's archive directory. With an archive_path the WARC files are linked
+    into it, otherwise the archive_paths need to hold the warc_path (and the
+    clean_warc_path)."""
+
+    def configure(self, configuration):
+        self.path = Path(configuration.get("path"))
+        # the filename in the index is relative to the warc_path, if it is set, so
+        # the replay can find the files in its archive paths
+        self.warc_path = configuration.get("warc_path")
+        # the recompressed WARC files, their filename is relative to this path
+        self.clean_warc_path = configuration.get("clean_warc_path")
+        # the archive directory of the collection, e.g. collections/<name>/archive
+        self.archive_path = configuration.get("archive_path")
+        self.jobs = int(configuration.get("jobs", 1))
+        # copy the index, that the recompression wrote next to a WARC file
+        self.sidecars = configuration.get("sidecars", True)
+
+    @property
+    def ledger_key(self) -> str:
+        return f"{type(self).__module__}:{self.path}"
+
+    def index(self, warcs: list, jobs: int = None) -> list[Path]:
+        """Index the WARC files with a pool of jobs processes.
+
+        Files, that can not be read, are logged and skipped. Returns the indexed
+        files."""
+        jobs = jobs or self.jobs
+        self.path.mkdir(parents=True, exist_ok=True)
+        pending = []
+        indexed = []
+        for warc in map(Path, warcs):
+            if self.sidecars and Path(sidecar_name(warc)).is_file():
+                if self._write(warc, partial(self._sidecar_lines, warc)):
+                    indexed.append(warc)
+            else:
+                pending.append(warc)
+
+        if jobs > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(jobs, mp_context=get_context("spawn")) as pool:
+                futures = [
+                    (warc, pool.submit(index_file, str(warc), self._filename(warc)))
+                    for warc in pending
+                ]
+                for warc, future in futures:
+                    if self._write(warc, future.result):
+                        indexed.append(warc)
+        else:
+            for warc in pending:
+                if self._write(
+                    warc, partial(index_file, str(warc), self._filename(warc))
+                ):
+                    indexed.append(warc)
+        logger.info(f"Indexed {len(indexed)} of {len(warcs)} files to {self.path}")
+        return indexed
+
+    def _write(self, warc: Path, lines) -> bool:
+        try:
+            lines = lines()
+            # the file is in place, before the replay reads its index
+            if self.archive_path:
+                self._archive(warc)
+        except (ArchiveLoadFailed, OSError, EOFError, *DECOMPRESSION_ERRORS) as e:
+            logger.error(f"Could not index {warc}: {e}")
+            return False
+        # replace the index at once, so the replay never reads half of it
+        with NamedTemporaryFile(
+            "w", dir=self.path, suffix=".tmp", delete=False, encoding="utf-8"
+        ) as index_io:
+            index_io.writelines(lines)
+        os.replace(index_io.name, self._index_path(warc))
+        logger.debug(f"Indexed {warc} ({len(lines)} records)")
+        return True
+
+    def _sidecar_lines(self, warc: Path) -> list[str]:
+        """Read the sidecar of a WARC file, with the filename of this index."""
+        lines = Path(sidecar_name(warc)).read_text(encoding="utf-8").splitlines(True)
+        if (filename := self._filename(warc)) == warc.name:
+            return lines
+        for number, line in enumerate(lines):
+            urlkey, timestamp, values = line.split(" ", 2)
+            values = {**json.loads(values), "filename": filename}
+            lines[number] = f"{urlkey} {timestamp} {json.dumps(values)}\n"
+        return lines
+
+    def _archive(self, warc: Path):
+        """Link the WARC file into the archive directory at its filename."""
+        archive = Path(self.archive_path) / self._filename(warc)
+        if archive.exists() and os.path.samefile(warc, archive):
+            return
+        archive.parent.mkdir(parents=True, exist_ok=True)
+        archive.unlink(missing_ok=True)
+        try:
+            os.link(warc, archive)
+        except OSError:
+            copyfile(warc, archive)
+
+    def _index_path(self, warc: Path) -> Path:
+        # the filename is quoted, so the files of different directories never share
+        # an index, e.g. a/b_c.warc.gz and a_b/c.warc.gz
+        return self.path / f"{quote(self._filename(warc), safe='')}{SIDECAR_EXTENSION}"
+
+    def _filename(self, warc: Path) -> str:
+        return relative_name(warc, self.clean_warc_path, self.warc_path)
+
+
+export = CDXJIndexerPlugin
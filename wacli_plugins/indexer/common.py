@@ -0,0 +1,43 @@
+"""Helpers, that the indexer plugins share."""
+
+import time
+from pathlib import Path
+
+import httpx
+from loguru import logger
+
+
+def relative_name(warc: Path, *bases) -> str:
+    """Get the path of a WARC file relative to the first base, that holds it.
+
+    The replay looks the files up in its archive paths, a file, that is in none of
+    the bases, is looked up by its name."""
+    warc = Path(warc)
+    for base in bases:
+        if base and warc.is_relative_to(base):
+            return warc.relative_to(base).as_posix()
+    return warc.name
+
+
+def post(
+    client: httpx.Client, url: str, retries: int = 3, backoff: float = 1, **kwargs
+) -> httpx.Response:
+    """Post a request with the client, failed requests are retried after a backoff.
+
+    Transport errors and the answers 429 and 5xx are retried, after the last retry
+    they raise an httpx.HTTPError, as do the other error answers."""
+    for attempt in range(retries + 1):
+        try:
+            response = client.post(url, **kwargs)
+            if response.status_code != 429 and response.status_code < 500:
+                return response.raise_for_status()
+            reason = f"answered {response.status_code}"
+        except httpx.TransportError as e:
+            if attempt == retries:
+                raise
+            reason = f"failed with {e!r}"
+        if attempt == retries:
+            return response.raise_for_status()
+        delay = backoff * 2**attempt
+        logger.info(f"{url} {reason}, retry in {delay}s")
+        time.sleep(delay)
@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import batched
+from pathlib import Path
+
+import httpx
+from loguru import logger
+from warcio.exceptions import ArchiveLoadFailed
+
+from wacli.cdxj import cdx_line
+from wacli.compression import DECOMPRESSION_ERRORS
+from wacli.plugin_types import IndexerPlugin
+from wacli.warc import warc_index
+from wacli_plugins.indexer.common import post, relative_name
+
+
+class OutbackCDXPlugin(IndexerPlugin):
+    """Index WARC files to an OutbackCDX collection.
+
+    The CDX lines of the records are posted in batches to the collection url, e.g.
+    http://localhost:8080/dnb."""
+
+    def configure(self, configuration):
+        self.url = configuration.get("url")
+        # the number of CDX lines per POST
+        self.batch_size = int(configuration.get("batch_size", 10000))
+        # the number of files, that are indexed in parallel
+        self.jobs = int(configuration.get("jobs", 4))
+        self.retries = int(configuration.get("retries", 3))
+        self.backoff = float(configuration.get("backoff", 1))
+        # the filename in the index is relative to the warc_path, if it is set
+        self.warc_path = configuration.get("warc_path")
+        # the recompressed WARC files are named relative to this path
+        self.clean_warc_path = configuration.get("clean_warc_path")
+        # one pooled client keeps the connections alive across all batches
+        self.client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.jobs, max_keepalive_connections=self.jobs
+            ),
+            timeout=httpx.Timeout(float(configuration.get("timeout", 60)), pool=None),
+        )
+
+    @property
+    def ledger_key(self) -> str:
+        return f"{type(self).__module__}:{self.url}"
+
+    def index(self, warcs: list, jobs: int = None) -> list[Path]:
+        """Index the WARC files, jobs files are read and posted in parallel.
+
+        Files, that can not be read or posted, are logged and skipped. Returns the
+        indexed files."""
+        warcs = list(map(Path, warcs))
+        with ThreadPoolExecutor(
+            jobs or self.jobs, thread_name_prefix="wacli-outbackcdx"
+        ) as pool:
+            results = list(pool.map(self.index_warc, warcs))
+        indexed = [warc for warc, records in zip(warcs, results) if records is not None]
+        records = sum(records for records in results if records is not None)
+        logger.info(
+            f"Indexed {records} records of {len(indexed)} of {len(warcs)} files to "
+            f"{self.url}"
+        )
+        return indexed
+
+    def index_warc(self, warc: Path) -> int | None:
+        """Index the records of a WARC file.
+
+        Returns the number of indexed records, None if the file could not be read
+        or posted completely."""
+        filename = relative_name(warc, self.clean_warc_path, self.warc_path)
+        records = 0
+        try:
+            with open(warc, "rb") as source_io:
+                lines = (
+                    cdx_line(fields, offset, length, filename)
+                    for fields, offset, length in warc_index(source_io)
+                    if fields is not None
+                )
+                for batch in batched(lines, self.batch_size):
+                    self._post("".join(batch).encode("utf-8"))
+                    records += len(batch)
+        except (
+            ArchiveLoadFailed,
+            OSError,
+            EOFError,
+            httpx.HTTPError,
+            *DECOMPRESSION_ERRORS,
+        ) as e:
+            logger.error(f"Could not index {warc} after {records} records: {e}")
+            return None
+        logger.debug(f"Indexed {warc} ({records} records)")
+        return records
+
+    def _post(self, body: bytes):
+        """Post a batch of CDX lines, failed requests are retried after a backoff."""
+        post(self.client, self.url, self.retries, self.backoff, content=body)
+
+
+export = OutbackCDXPlugin
@@ -1,9 +1,15 @@
+import os
+from collections import deque
+from itertools import batched
 from pathlib import Path
+from shutil import copyfile
 
 from docker.client import from_env as docker_from_env
+from docker.errors import NotFound
 from docker.types import Mount
 from loguru import logger
 
+from wacli.cdxj import sidecar_name
 from wacli.plugin_types import IndexerPlugin
 
 
@@ -16,41 +22,118 @@ class PyWbPlugin(IndexerPlugin):
         self.collection = configuration.get("collection")
         self.pywb_path = configuration.get("pywb_path")
         self.warc_path = configuration.get("warc_path")
+        # the recompressed WARC files, that may have CDXJ sidecars
+        self.clean_warc_path = configuration.get("clean_warc_path")
+        # the number of warc files per container and of concurrent containers, the
+        # containers of a collection merge into the same index, so one is the default
+        self.batch_size = int(configuration.get("batch_size", 100))
+        self.max_containers = int(configuration.get("max_containers", 1))
 
-    def index(self, warcs: list, clean: bool = True, block: bool = False):
+    @property
+    def ledger_key(self) -> str:
+        return f"{type(self).__module__}:{self.pywb_path}:{self.collection}"
+
+    def index(self, warcs: list, clean: bool = True, block: bool = False) -> list:
         """Add the warc files to the pywb index.
         Clean tells, if the containers should be removed, when they are finished.
-        Block tells if the index command will wait for all containers to finish befor
-        returning. It will also output the logs of the containers.
+        Block tells, if the logs of the containers are output.
+        WARC files with a CDXJ sidecar (see the recompress operation) are added to
+        the collection with their index, without a container.
+        The other files are added in batches of batch_size files per container, with
+        at most max_containers containers running at a time.
+        The index command waits for all containers to finish and returns the files,
+        that were added with their sidecar or by a container, that exited with 0.
         """
-        containers = []
+        indexed = []
+        batches = {}
         for warc in warcs:
-            warc = self.rebase(
+            if str(warc).endswith(".zst"):
+                # warcio in the pywb image can not read zstd compressed WARC files
+                logger.warning(f"Skipping {warc}, pywb can not index .warc.zst files")
+                continue
+            if self.add_indexed(Path(warc)):
+                indexed.append(warc)
+                continue
+            base = self.warc_path
+            if self.clean_warc_path and Path(warc).is_relative_to(self.clean_warc_path):
+                base = self.clean_warc_path
+            rebased = self.rebase(
                 Path(warc),
-                base=Path(self.warc_path),
+                base=Path(base),
                 to=Path(self.container_path_source),
             )
-            proc = self.index_warc(warc, clean and not block)
-            containers.append(proc)
+            batches.setdefault(base, []).append((warc, rebased))
+
+        # the containers are removed after their exit code is read, not automatically
+        containers = deque()
+
+        def finish():
+            container, batch = containers.popleft()
+            if self.wait(container, clean, block):
+                indexed.extend(warc for warc, _ in batch)
+
+        for base, base_warcs in batches.items():
+            for batch in batched(base_warcs, self.batch_size):
+                while len(containers) >= self.max_containers:
+                    finish()
+                container = self.index_warc(
+                    [rebased for _, rebased in batch], False, base
+                )
+                containers.append((container, batch))
+        while containers:
+            finish()
+        return indexed
+
+    def wait(self, container, clean: bool = True, block: bool = False) -> bool:
+        """Wait for a container to finish, and output its logs, if block is set.
+
+        Returns, if the container exited with 0."""
+        try:
+            result = container.wait()
+        except NotFound:
+            logger.error(f"{container} was removed, before its exit code was read")
+            return False
+        if result.get("StatusCode"):
+            logger.error(f"{container} failed: {result}")
         if block:
-            for proc in containers:
-                while proc.status in ["created", "running"]:
-                    proc.reload()
-                    logger.debug(proc)
-                    logger.debug(proc.status)
-                    continue
-            for proc in containers:
-                logger.debug(proc)
-                logger.debug(proc.logs())
-                if clean:
-                    proc.remove()
-
-    def index_warc(self, warc, clean: bool = True):
+            logger.debug(container)
+            logger.debug(container.logs())
+        if clean:
+            container.remove()
+        return not result.get("StatusCode")
+
+    def add_indexed(self, warc: Path) -> bool:
+        """Add a WARC file with its CDXJ sidecar to the collection.
+
+        Returns False, if there is no sidecar or the collection does not exist yet,
+        then the WARC file needs to be indexed by pywb."""
+        sidecar = Path(sidecar_name(warc))
+        collection = Path(self.pywb_path) / "collections" / self.collection
+        if not sidecar.is_file() or not (collection / "indexes").is_dir():
+            return False
+        archive = collection / "archive" / warc.name
+        archive.parent.mkdir(exist_ok=True)
+        archive.unlink(missing_ok=True)
+        try:
+            os.link(warc, archive)
+        except OSError:
+            copyfile(warc, archive)
+        # pywb merges all .cdxj files in the indexes directory
+        copyfile(sidecar, collection / "indexes" / sidecar_name(warc.name))
+        logger.debug(f"Added {warc} with the index {sidecar}")
+        return True
+
+    def index_warc(self, warcs, clean: bool = True, warc_path=None):
+        """Start a container, that adds one or more warc files to the collection."""
+        if isinstance(warcs, str | Path):
+            warcs = [warcs]
         env = {"INIT_COLLECTION": self.collection}
-        args = ["wb-manager", "add", self.collection, str(warc)]
+        args = ["wb-manager", "add", self.collection, *map(str, warcs)]
         mounts = [
             Mount(
-                target=self.container_path_source, source=self.warc_path, type="bind"
+                target=self.container_path_source,
+                source=str(warc_path or self.warc_path),
+                type="bind",
             ),
             Mount(
                 target=self.container_path_webarchive,
@@ -0,0 +1,255 @@
+import html
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger
+from warcio.archiveiterator import ArchiveIterator
+from warcio.exceptions import ArchiveLoadFailed
+
+from wacli.cdxj import record_fields
+from wacli.compression import DECOMPRESSION_ERRORS
+from wacli.plugin_types import IndexerPlugin
+from wacli.warc import is_zstd, record_members
+from wacli_plugins.indexer.common import post, relative_name
+
+"""The record types, that are sent to Solr."""
+RECORD_TYPES = ["response", "revisit", "resource"]
+WARC_TYPE = re.compile(rb"^WARC-Type:\s*(\S+)", re.IGNORECASE | re.MULTILINE)
+TAGS = re.compile(r"<(script|style)\b.*?</\1\s*>|<[^>]*>", re.IGNORECASE | re.DOTALL)
+SPACES = re.compile(r"\s+")
+"""The normalized content types by the start of the mime type."""
+CONTENT_TYPES = {
+    "text/html": "html",
+    "application/xhtml": "html",
+    "text/": "text",
+    "image/": "image",
+    "audio/": "audio",
+    "video/": "video",
+    "application/pdf": "pdf",
+}
+
+
+def record_heads(source_io, excerpt_size: int):
+    """Yield the offset and the head of the records of a WARC (or ARC) file.
+
+    The head holds the WARC headers, the HTTP headers and up to excerpt_size bytes
+    of the payload. The payload is decoded by warcio, the payload of a .warc.zst
+    file is not decoded."""
+    if is_zstd(source_io):
+        for offset, _, head in record_members(source_io):
+            yield offset, head
+        return
+    iterator = ArchiveIterator(source_io, arc2warc=True)
+    for record in iterator:
+        head = record.rec_headers.to_bytes()
+        if record.http_headers:
+            head += record.http_headers.to_bytes()
+        if record.rec_type in RECORD_TYPES:
+            head += record.content_stream().read(excerpt_size)
+        # the offset is known, when the record is read to its end
+        yield iterator.get_record_offset(), head
+
+
+def solr_document(head: bytes, offset: int, path: str, excerpt_size: int):
+    """Build the Solr document of a record in the SolrWayback schema from its head.
+
+    Returns None, if the record is not sent to Solr."""
+    if (warc_type := WARC_TYPE.search(head)) is None:
+        return None
+    record_type = warc_type.group(1).decode("ascii", "replace").lower()
+    fields = record_fields(head)
+    if record_type not in RECORD_TYPES or fields is None or not fields["url"]:
+        return None
+    parts = urlsplit(fields["url"])
+    host = (parts.hostname or "").lower()
+    timestamp = fields["timestamp"].ljust(14, "0")
+    crawl_date = (
+        f"{timestamp[:4]}-{timestamp[4:6]}-{timestamp[6:8]}T"
+        f"{timestamp[8:10]}:{timestamp[10:12]}:{timestamp[12:14]}Z"
+    )
+    document = {
+        "id": f"{path}@{offset}",
+        "url": fields["url"],
+        "url_norm": _url_norm(parts),
+        "host": host,
+        "domain": ".".join(host.removeprefix("www.").split(".")[-2:]),
+        "crawl_date": crawl_date,
+        "crawl_year": int(timestamp[:4]),
+        "wayback_date": int(timestamp),
+        "record_type": record_type,
+        "content_type": fields["mime"],
+        "content_type_norm": _content_type_norm(fields["mime"]),
+        "source_file": Path(path).name,
+        "source_file_path": path,
+        "source_file_offset": offset,
+    }
+    if status := fields.get("status"):
+        document["status_code"] = int(status)
+    if digest := fields.get("digest"):
+        document["hash"] = f"sha1:{digest}"
+    if excerpt := _excerpt(head, fields["mime"], excerpt_size):
+        document["content"] = excerpt
+    return document
+
+
+def solr_documents(warc: str, path: str, excerpt_size: int) -> list[dict]:
+    """Get the Solr documents of a WARC file, this is run in the worker processes."""
+    with open(warc, "rb") as source_io:
+        documents = (
+            solr_document(head, offset, path, excerpt_size)
+            for offset, head in record_heads(source_io, excerpt_size)
+        )
+        return [document for document in documents if document is not None]
+
+
+def _url_norm(parts) -> str:
+    """Normalize an URL like the url_norm field, that SolrWayback looks up."""
+    host = (parts.hostname or "").lower().removeprefix("www.")
+    query = "&".join(sorted(parts.query.split("&"))) if parts.query else ""
+    return f"http://{host}{parts.path or '/'}" + (f"?{query}" if query else "")
+
+
+def _content_type_norm(mime: str) -> str:
+    for prefix, content_type in CONTENT_TYPES.items():
+        if mime.startswith(prefix):
+            return content_type
+    return "other"
+
+
+def _excerpt(head: bytes, mime: str, excerpt_size: int) -> str | None:
+    """Get the start of the text of a text or html payload."""
+    if _content_type_norm(mime) not in ["html", "text"]:
+        return None
+    _, _, payload = head.partition(b"\r\n\r\n")
+    if payload.startswith(b"HTTP/"):
+        payload = payload.partition(b"\r\n\r\n")[2]
+    text = payload[:excerpt_size].decode("utf-8", "replace")
+    if _content_type_norm(mime) == "html":
+        text = html.unescape(TAGS.sub(" ", text))
+    return SPACES.sub(" ", text).strip() or None
+
+
+class SolrWaybackPlugin(IndexerPlugin):
+    """Index the records of WARC files to the Solr of SolrWayback.
+
+    The documents are extracted by a pool of processes and posted in JSON batches to
+    the update handler of the Solr collection url, e.g.
+    http://localhost:8983/solr/netarchivebuilder. Solr commits them within
+    commit_within milliseconds, instead of a commit per batch."""
+
+    def configure(self, configuration):
+        self.url = configuration.get("url")
+        # the number of documents per POST
+        self.batch_size = int(configuration.get("batch_size", 1000))
+        self.commit_within = int(configuration.get("commit_within", 60000))
+        # the number of bytes of a text payload, that are indexed
+        self.excerpt_size = int(configuration.get("excerpt_size", 4096))
+        # the number of files, that are read in parallel
+        self.jobs = int(configuration.get("jobs", 1))
+        self.retries = int(configuration.get("retries", 3))
+        self.backoff = float(configuration.get("backoff", 1))
+        # the source_file_path is relative to the warc_path, if it is set
+        self.warc_path = configuration.get("warc_path")
+        # the recompressed WARC files are named relative to this path
+        self.clean_warc_path = configuration.get("clean_warc_path")
+        self.client = httpx.Client(
+            timeout=httpx.Timeout(float(configuration.get("timeout", 60)), pool=None)
+        )
+
+    @property
+    def ledger_key(self) -> str:
+        return f"{type(self).__module__}:{self.url}"
+
+    def index(self, warcs: list, jobs: int = None) -> list[Path]:
+        """Index the records of the WARC files.
+
+        The documents of the files are posted in batches, a file is indexed, when
+        all of its documents are posted. Files, that can not be read, are logged and
+        skipped, if Solr does not accept a batch after the retries, the indexing
+        stops. Returns the indexed files."""
+        jobs = jobs or self.jobs
+        indexed, documents = [], 0
+        # the files, whose last documents are in the batch
+        batch, pending = [], []
+        try:
+            for warc, warc_documents in self._extract(warcs, jobs):
+                if warc_documents is None:
+                    continue
+                for document in warc_documents:
+                    batch.append(document)
+                    if len(batch) == self.batch_size:
+                        self._post(batch)
+                        documents += len(batch)
+                        indexed += pending
+                        batch, pending = [], []
+                (pending if batch else indexed).append(warc)
+            if batch:
+                self._post(batch)
+                documents += len(batch)
+            indexed += pending
+        except httpx.HTTPError as e:
+            logger.error(f"Could not post the documents to {self.url}: {e}")
+        logger.info(
+            f"Indexed {documents} documents of {len(indexed)} of {len(warcs)} files "
+            f"to {self.url}"
+        )
+        return indexed
+
+    def _extract(self, warcs: list, jobs: int):
+        """Yield each file with its documents in the order of the files, None if
+        the file can not be read."""
+        if jobs == 1:
+            for warc in map(Path, warcs):
+                yield self._documents(
+                    warc,
+                    partial(
+                        solr_documents, str(warc), self._path(warc), self.excerpt_size
+                    ),
+                )
+            return
+        with ProcessPoolExecutor(jobs, mp_context=get_context("spawn")) as pool:
+            # bound the extracted documents in memory
+            pending = deque()
+            for warc in map(Path, warcs):
+                future = pool.submit(
+                    solr_documents, str(warc), self._path(warc), self.excerpt_size
+                )
+                pending.append((warc, future))
+                while len(pending) > 2 * jobs:
+                    warc, future = pending.popleft()
+                    yield self._documents(warc, future.result)
+            while pending:
+                warc, future = pending.popleft()
+                yield self._documents(warc, future.result)
+
+    def _documents(self, warc: Path, extract) -> tuple[Path, list[dict] | None]:
+        try:
+            documents = extract()
+        except (ArchiveLoadFailed, OSError, EOFError, *DECOMPRESSION_ERRORS) as e:
+            logger.error(f"Could not index {warc}: {e}")
+            return warc, None
+        logger.debug(f"Extracted {len(documents)} documents from {warc}")
+        return warc, documents
+
+    def _post(self, documents: list[dict]):
+        """Post a batch of documents, failed requests are retried after a backoff."""
+        post(
+            self.client,
+            f"{self.url.rstrip('/')}/update",
+            self.retries,
+            self.backoff,
+            params={"commitWithin": self.commit_within},
+            json=documents,
+        )
+
+    def _path(self, warc: Path) -> str:
+        return relative_name(warc, self.clean_warc_path, self.warc_path)
+
+
+export = SolrWaybackPlugin
@@ -1,11 +1,136 @@
 import gzip
+import os
+from collections import deque
 from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager, nullcontext
+from io import BufferedReader, BytesIO
+from multiprocessing import get_context
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory, TemporaryFile
 
 from loguru import logger
+from warcio.exceptions import ArchiveLoadFailed
 from warcio.recompressor import RecompressorStream
 
+from wacli.cdxj import cdxj_lines, sidecar_name
+from wacli.compression import (
+    FORMATS,
+    WARCIO_LEVEL,
+    check_format,
+    check_level,
+    get_backend,
+)
 from wacli.plugin_types import OperationPlugin, StorageStream
+from wacli.transfer import copy_stream
+from wacli.warc import (
+    index_records,
+    is_canonical,
+    is_gzip,
+    is_zstd,
+    recompress_records,
+)
+
+"""The options of recompress_records, that compress the records like warcio."""
+WARCIO_OPTIONS = {"format": "gzip", "level": WARCIO_LEVEL}
+
+
+@contextmanager
+def recompressed(source_io, compressed: bool = None):
+    """Open a recompressed stream of a WARC file.
+
+    If compressed is not given, it is detected from the magic bytes."""
+    if compressed is None:
+        if not hasattr(source_io, "peek"):
+            source_io = BufferedReader(source_io)
+        compressed = is_gzip(source_io)
+    with (
+        gzip.open(source_io, "rb") if compressed else nullcontext(source_io)
+    ) as source_stream:
+        logger.debug(f"stream is: {source_io}")
+        yield RecompressorStream(source_stream)
+
+
+def is_target_format(
+    source: str, format: str, buffer_size: int, index: Callable = None
+) -> bool:
+    """Check if a local file is already compressed per record in the format.
+
+    zstd WARC files are always compressed per record. index is called for the
+    records of a file in the target format (see recompress_records), a gzip file is
+    indexed in the same pass, that checks it."""
+    entries = []
+    if format == "zstd":
+        if not is_zstd(source):
+            return False
+        if index is not None:
+            with open(source, "rb") as source_io:
+                entries = list(index_records(source_io))
+    elif not is_gzip(source) or not is_canonical(
+        source, buffer_size, (lambda *entry: entries.append(entry)) if index else None
+    ):
+        return False
+    for entry in entries:
+        index(*entry)
+    return True
+
+
+def recompress_file(
+    source: str,
+    target: str,
+    buffer_size: int,
+    split_size: int = None,
+    record_jobs: int = 1,
+    options: dict = None,
+    index: Callable = None,
+):
+    """Recompress a WARC file to a target file, this is run in the worker processes.
+
+    Files of at least split_size bytes are split into batches of records, that are
+    compressed by record_jobs threads. If options for recompress_records are given
+    (see RecompressPlugin.record_options), all files are compressed record by record
+    with them. Returns the size of the target file or None, if the file is already
+    in the target format. index is called for the records of the file, as
+    recompress_records does, also if the file is in the target format."""
+    options = options or {}
+    if is_target_format(source, options.get("format", "gzip"), buffer_size, index):
+        return None
+    large = split_size is not None and os.path.getsize(source) >= split_size
+    with open(source, "rb") as source_io, open(target, "wb") as target_io:
+        if large or options or is_zstd(source_io):
+            # without options the records are compressed like warcio does, so the
+            # output does not depend on the size of the file
+            record_options = options or WARCIO_OPTIONS
+            try:
+                return recompress_records(
+                    source_io,
+                    target_io,
+                    record_jobs if large else 1,
+                    **{
+                        **record_options,
+                        "backend": get_backend(record_options.get("backend")),
+                    },
+                    index=index,
+                )
+            except ArchiveLoadFailed as e:
+                if options:
+                    raise
+                logger.warning(f"Could not split {source} into records: {e}")
+                source_io.seek(0)
+                target_io.seek(0)
+                target_io.truncate()
+        with recompressed(source_io, is_gzip(source_io)) as stream:
+            return copy_stream(stream, target_io, buffer_size)
+
+
+def recompress_indexed(source: str, target: str, filename: str, *args):
+    """Recompress a WARC file like recompress_file and index its records.
+
+    Returns the size of the target file (or None) and the CDXJ lines of the file. A
+    file, that is passed on as it is, is indexed by its own records."""
+    entries = []
+    size = recompress_file(source, target, *args, index=lambda *e: entries.append(e))
+    return size, cdxj_lines(entries, filename)
 
 
 class RecompressPlugin(OperationPlugin):
@@ -13,36 +138,275 @@ class RecompressPlugin(OperationPlugin):
 
     def configure(self, configuration):
         self.verbose = configuration.get("verbose", False)
+        self.jobs = int(configuration.get("jobs", 1))
+        # recompressed files are spooled here, until they are stored
+        self.spool_dir = configuration.get("spool_dir")
+        self.buffer_size = int(configuration.get("buffer_size", 1024 * 1024))
+        # files of this size are split into records, that are compressed by
+        # record_jobs threads, so they do not hold up the other files, by default
+        # the cores are shared by the worker processes (see _record_jobs)
+        self.split_size = int(configuration.get("split_size", 1024 * 1024 * 1024))
+        self.record_jobs = configuration.get("record_jobs")
+        # the deflate level and a zlib compatible backend (zlib, zlib-ng, isal or
+        # auto), if they are not set the files are recompressed by warcio
+        self.level = configuration.get("level")
+        self.backend = configuration.get("backend")
+        if self.backend is not None:
+            get_backend(self.backend)
+        # the output format (gzip or zstd) is configured on the target storage
+        self.format = "gzip"
+        self.dictionary = None
+        self.dictionary_size = 0
+        if target_repository := configuration.get("target_repository"):
+            target = self.plugin_manager.get(target_repository)
+            self.format = getattr(target, "compression", None) or "gzip"
+            if dictionary := getattr(target, "zstd_dictionary", None):
+                self.dictionary = Path(target.path, dictionary).read_bytes()
+            self.dictionary_size = getattr(target, "zstd_dictionary_size", 0)
+        check_format(self.format)
+        # write a CDXJ index next to each WARC file, while its records are compressed
+        self.cdxj = configuration.get("cdxj", False)
+        if self.format == "gzip":
+            # the levels depend on the backend, ISA-L only knows the levels 0 to 3
+            check_level(self.level, self.backend)
+
+    @property
+    def record_options(self) -> dict:
+        """The options of recompress_records, empty if the files are recompressed by
+        warcio."""
+        if (
+            self.format == "gzip"
+            and self.level is None
+            and self.backend is None
+            and not self.cdxj
+        ):
+            return {}
+        level = self.level
+        if self.format == "gzip" and level is None and self.backend is None:
+            # the same level as the files, that are recompressed by warcio
+            level = WARCIO_LEVEL
+        return {
+            "format": self.format,
+            "level": level,
+            "backend": self.backend,
+            "dictionary": self.dictionary,
+            "dictionary_size": self.dictionary_size,
+        }
+
+    def run(self, storage_stream: StorageStream, jobs: int = None) -> StorageStream:
+        """Recompress the WARC files of the stream.
 
-    def run(self, storage_stream: StorageStream) -> StorageStream:
+        Local files, that are already compressed per record, are passed on with
+        their path, so the storage can link or copy them. With jobs > 1 the local
+        files are checked and recompressed by a pool of worker processes. The
+        nested stream is then flattened to ids like <idn>/<file>, and the files are
+        yielded in the order of the stream.
+
+        With cdxj, each WARC file is followed by its index <file>.cdxj."""
+        jobs = jobs or self.jobs
+        if jobs > 1:
+            return self._run_parallel(storage_stream, jobs)
         return self._iterate_stream(storage_stream)
 
     def _iterate_stream(self, storage_stream: StorageStream) -> StorageStream:
         for id, data, metadata in storage_stream:
             if isinstance(data, Callable):
-                yield self._recompress(id, data, metadata)
+                yield from self._recompress(id, data, metadata)
             else:
                 yield id, self._iterate_stream(data), metadata
 
     def _recompress(self, id, data, metadata):
+        if source := metadata.get("path"):
+            entries = []
+            if is_target_format(
+                source,
+                self.format,
+                self.buffer_size,
+                (lambda *entry: entries.append(entry)) if self.cdxj else None,
+            ):
+                return self._canonical(
+                    id, data, metadata, cdxj_lines(entries, self._filename(id))
+                )
+            if self.record_options or is_zstd(source):
+                return self._recompress_spooled(id, data, metadata)
+            return [self._recompress_stream(id, data, metadata, is_gzip(source))]
+        if self.record_options:
+            return self._recompress_spooled(id, data, metadata)
+        return [self._recompress_stream(id, data, metadata)]
+
+    def _recompress_stream(self, id, data, metadata, compressed: bool = None):
         @contextmanager
         def data_callback():
             with data() as source_io:
-                with (
-                    gzip.open(source_io, "rb")
-                    if self._is_compressed(id, metadata)
-                    else nullcontext(source_io) as source_stream
-                ):
-                    logger.debug(f"stream is: {source_io}")
-                    yield RecompressorStream(source_stream)
-
-        return id, data_callback, {**metadata, "compression": "application/gzip"}
-
-    def _is_compressed(self, id, metadata):
-        return True
-        if "compression" in metadata:
-            return True
-        return id[:-3] == ".gz"
+                with recompressed(source_io, compressed) as stream:
+                    yield stream
+
+        return self._target_id(id), data_callback, self._metadata(metadata)
+
+    def _recompress_spooled(self, id, data, metadata):
+        target_id = self._target_id(id)
+
+        def spool(target_io, index=None):
+            with data() as source_io:
+                if not hasattr(source_io, "peek"):
+                    source_io = BufferedReader(source_io)
+                options = self.record_options or WARCIO_OPTIONS
+                recompress_records(
+                    source_io,
+                    target_io,
+                    int(self.record_jobs or 1),
+                    **{**options, "backend": get_backend(options.get("backend"))},
+                    index=index,
+                )
+            target_io.seek(0)
+
+        if self.cdxj:
+            # the index is complete after all records, so the file is spooled, before
+            # it is passed on
+            target_io = TemporaryFile(dir=self.spool_dir)
+            entries = []
+            spool(target_io, lambda *entry: entries.append(entry))
+
+            @contextmanager
+            def spooled_callback():
+                with target_io:
+                    yield target_io
+
+            return [
+                (target_id, spooled_callback, self._metadata(metadata)),
+                self._sidecar(
+                    target_id, cdxj_lines(entries, self._filename(target_id))
+                ),
+            ]
+
+        @contextmanager
+        def data_callback():
+            with TemporaryFile(dir=self.spool_dir) as target_io:
+                spool(target_io)
+                yield target_io
+
+        return [(target_id, data_callback, self._metadata(metadata))]
+
+    def _canonical(self, id, data, metadata, lines: list[str] = None):
+        """Pass on a file, that is already in the target format, as it is, with the
+        CDXJ lines of its records, if cdxj is set."""
+        logger.debug(f"{id} is already canonical")
+        items = [
+            (
+                id,
+                data,
+                {
+                    **metadata,
+                    "compression": FORMATS[self.format][1],
+                    "size": os.path.getsize(metadata["path"]),
+                },
+            )
+        ]
+        if self.cdxj:
+            items.append(self._sidecar(id, lines))
+        return items
+
+    def _sidecar(self, id, lines: list[str]):
+        """The CDXJ index of the WARC file with the id."""
+
+        @contextmanager
+        def data_callback():
+            yield BytesIO("".join(lines).encode("utf-8"))
+
+        return sidecar_name(id), data_callback, {}
+
+    def _filename(self, id) -> str:
+        return PurePosixPath(id).name
+
+    def _target_id(self, id):
+        """Name recompressed WARC files with the extension of the format."""
+        name = str(id)
+        for extension, _, _ in FORMATS.values():
+            if name.endswith(f".warc{extension}"):
+                name = name.removesuffix(extension)
+        if name.endswith(".warc"):
+            return name + FORMATS[self.format][0]
+        return id
+
+    def _metadata(self, metadata: dict, **kwargs) -> dict:
+        # the data is not the file at the path anymore
+        metadata = {k: v for k, v in metadata.items() if k not in ["path", "size"]}
+        return {**metadata, "compression": FORMATS[self.format][1], **kwargs}
+
+    def _run_parallel(self, storage_stream: StorageStream, jobs: int):
+        with (
+            TemporaryDirectory(prefix="wacli-recompress-", dir=self.spool_dir) as spool,
+            ProcessPoolExecutor(jobs, mp_context=get_context("spawn")) as pool,
+        ):
+            # bound the work in flight, so only a few files are spooled at a time
+            pending = deque()
+            for number, (id, data, metadata) in enumerate(
+                self._flatten(storage_stream)
+            ):
+                if source := metadata.get("path"):
+                    target = os.path.join(spool, str(number))
+                    args = (
+                        self.buffer_size,
+                        self.split_size,
+                        self._record_jobs(jobs),
+                        self.record_options,
+                    )
+                    if self.cdxj:
+                        filename = self._filename(self._target_id(id))
+                        future = pool.submit(
+                            recompress_indexed, source, target, filename, *args
+                        )
+                    else:
+                        future = pool.submit(recompress_file, source, target, *args)
+                    pending.append((id, future, data, metadata, target))
+                else:
+                    # not a local file, so it is recompressed while it is stored
+                    pending.append((id, None, data, metadata))
+                while len(pending) > 2 * jobs:
+                    yield from self._result(*pending.popleft())
+            while pending:
+                yield from self._result(*pending.popleft())
+
+    def _result(self, id, future, data, metadata, target=None):
+        if future is None:
+            return self._recompress(id, data, metadata)
+        try:
+            size, lines = future.result() if self.cdxj else (future.result(), None)
+        except Exception as e:
+            logger.error(f"Could not recompress {id}: {e}")
+            return []
+        if size is None:
+            return self._canonical(id, data, metadata, lines)
+        logger.debug(f"Recompressed {id} ({size} bytes)")
+
+        @contextmanager
+        def data_callback():
+            try:
+                with open(target, "rb") as target_io:
+                    yield target_io
+            finally:
+                os.unlink(target)
+
+        target_id = self._target_id(id)
+        items = [(target_id, data_callback, self._metadata(metadata, size=size))]
+        if self.cdxj:
+            items.append(self._sidecar(target_id, lines))
+        return items
+
+    def _record_jobs(self, jobs: int) -> int:
+        """The threads, that compress the records of a large file in each of the
+        jobs worker processes, so that all workers together use about one thread
+        per core."""
+        if self.record_jobs:
+            return int(self.record_jobs)
+        return max(1, (os.cpu_count() or 1) // jobs)
+
+    def _flatten(self, storage_stream: StorageStream, parent=PurePosixPath()):
+        for id, data, metadata in storage_stream:
+            if isinstance(data, Callable):
+                yield str(parent / id), data, metadata
+            else:
+                yield from self._flatten(data, parent / id)
 
 
 export = RecompressPlugin
@@ -1,19 +1,80 @@
+"""This is the ARAS storage module."""
+
+import json
+import os
+import time
 from collections.abc import Callable
+from contextlib import ExitStack, contextmanager, nullcontext
+from importlib.util import find_spec
+from io import RawIOBase
+from pathlib import Path
+from tempfile import mkstemp
+from xml.etree import ElementTree
 
-from aras_py.run import get_stream as aras_get_stream
+import httpx
+from loguru import logger
 
 from wacli.plugin_types import StoragePlugin, StorageStream, StoreItem
+from wacli.throttle import AimdLimiter, TokenBucket
+
+METS = "{http://www.loc.gov/METS/}"
+XLINK = "{http://www.w3.org/1999/xlink}"
+
+"""Map the METS CHECKSUMTYPE values to hashlib names."""
+CHECKSUM_TYPES = {
+    "MD5": "md5",
+    "SHA-1": "sha1",
+    "SHA-256": "sha256",
+    "SHA-384": "sha384",
+    "SHA-512": "sha512",
+}
 
 
 class ArasStorage(StoragePlugin):
+    """Retrieve the WARC files of IDNs from the ARAS repository."""
+
     def configure(self, configuration):
         self.rest_base = configuration.get("rest_base")
         self.repository = configuration.get("repo")
+        self.retries = int(configuration.get("retries", 3))
+        pool_size = int(configuration.get("pool_size") or 10)
+        http2 = configuration.get("http2", True) and find_spec("h2") is not None
+        # a single pooled client keeps the connections alive across all IDNs and
+        # files, waiting for a free connection must not time out while the pool is
+        # busy with long transfers.
+        self.client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=httpx.Timeout(float(configuration.get("timeout", 60)), pool=None),
+            http2=http2,
+        )
+        logger.debug(f"ARAS client with pool_size={pool_size}, http2={http2}")
+        self.cache_dir = None
+        if cache_dir := configuration.get("cache_dir"):
+            self.cache_dir = Path(cache_dir) / self.repository
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        cache_ttl = configuration.get("cache_ttl")
+        self.cache_ttl = 24 * 60 * 60 if cache_ttl is None else float(cache_ttl)
+        # the repository is shared, limit the bandwidth, the request rate and the
+        # concurrent requests, the latter adapts to the load of the repository
+        self.bytes_bucket = None
+        if max_bytes := configuration.get("max_bytes_per_second"):
+            self.bytes_bucket = TokenBucket(float(max_bytes))
+        self.requests_bucket = None
+        if max_requests := configuration.get("max_requests_per_second"):
+            self.requests_bucket = TokenBucket(float(max_requests))
+        self.limiter = None
+        if max_concurrency := configuration.get("max_concurrency"):
+            self.limiter = AimdLimiter(int(max_concurrency))
+        self.backoff = float(configuration.get("backoff", 1))
 
     def store(self, id, data, metadata, callback: Callable = None):
         raise Exception("ArasStorage is read only")
 
-    def store_stream(self, stream: StorageStream, callback: Callable = None):
+    def store_stream(
+        self, stream: StorageStream, callback: Callable = None, jobs: int = 1
+    ):
         raise Exception("ArasStorage is read only")
 
     def retrieve(self, id, mode: str = "rb", callback: Callable = None) -> StoreItem:
@@ -30,7 +91,224 @@ class ArasStorage(StoragePlugin):
         if selector is None:
             raise Exception("ArasStorage needs a list of explicite IDNs")
         for idn in selector:
-            yield idn, aras_get_stream(self.rest_base, self.repository, idn), {}
+            yield idn, self._objects_stream(idn, callback), {}
+
+    def _objects_url(self, idn: str) -> str:
+        rest_base = self.rest_base.rstrip("/")
+        return (
+            f"{rest_base}/access/repositories/{self.repository}/artifacts/{idn}/objects"
+        )
+
+    def _objects_stream(self, idn: str, callback: Callable = None) -> StorageStream:
+        """List the files of an IDN from its METS document."""
+        mets = ElementTree.fromstring(self._get_objects_listing(idn))
+        for file in mets.iter(f"{METS}file"):
+            url = f"{self._objects_url(idn)}/{file.get('ID')}"
+            name = file.find(f"{METS}FLocat").get(f"{XLINK}href").rsplit("/", 1)[-1]
+            size = int(file.get("SIZE")) if file.get("SIZE") else None
+            metadata = {
+                "size": size,
+                "mimetype": file.get("MIMETYPE"),
+                "created": file.get("CREATED"),
+                "resume": self._object_opener(url, size),
+            }
+            if checksum_type := CHECKSUM_TYPES.get(file.get("CHECKSUMTYPE")):
+                metadata["checksum"] = f"{checksum_type}:{file.get('CHECKSUM')}"
+            if callback:
+                metadata["callback"] = callback
+            yield name, self._object_opener(url, size)(), metadata
+
+    def _get_objects_listing(self, idn: str) -> bytes:
+        """Get the METS document of an IDN, from the cache if configured.
+
+        Cached listings are used without a request until they are older than the TTL,
+        then they are revalidated with the ETag and Last-Modified of the response."""
+        if not self.cache_dir:
+            response = self._get(self._objects_url(idn))
+            response.raise_for_status()
+            return response.content
+
+        content_path = self.cache_dir / f"{idn}.xml"
+        info_path = self.cache_dir / f"{idn}.json"
+        info = {}
+        if content_path.exists() and info_path.exists():
+            info = json.loads(info_path.read_text())
+            if time.time() - info["fetched"] < self.cache_ttl:
+                return content_path.read_bytes()
+
+        headers = {}
+        if info.get("etag"):
+            headers["If-None-Match"] = info["etag"]
+        if info.get("last_modified"):
+            headers["If-Modified-Since"] = info["last_modified"]
+        try:
+            response = self._get(self._objects_url(idn), headers=headers)
+        except httpx.TransportError as e:
+            if not info:
+                raise
+            logger.warning(
+                f"Use the outdated listing of {idn}, revalidation failed: {e}"
+            )
+            return content_path.read_bytes()
+        if response.status_code == 304:
+            content = content_path.read_bytes()
+        else:
+            response.raise_for_status()
+            content = response.content
+            self._write_cache_file(content_path, content)
+        info = {
+            "fetched": time.time(),
+            "etag": response.headers.get("ETag", info.get("etag")),
+            "last_modified": response.headers.get(
+                "Last-Modified", info.get("last_modified")
+            ),
+        }
+        self._write_cache_file(info_path, json.dumps(info).encode("utf-8"))
+        return content
+
+    def _get(self, url: str, headers: dict = {}) -> httpx.Response:
+        with self._slot():
+            response = self._send(
+                self.client.build_request("GET", url, headers=headers)
+            )
+            response.read()
+            return response
+
+    def _slot(self):
+        """Hold a slot of the concurrency limit, while a request is active."""
+        return self.limiter.slot() if self.limiter else nullcontext()
+
+    def _send(self, request: httpx.Request) -> httpx.Response:
+        """Send a streaming request within the rate limit.
+
+        If the repository is overloaded (429 or 5xx) the concurrency is decreased and
+        the request is retried after a backoff."""
+        for attempt in range(self.retries + 1):
+            if self.requests_bucket:
+                self.requests_bucket.consume()
+            start = time.perf_counter()
+            response = self.client.send(request, stream=True)
+            if response.status_code != 429 and response.status_code < 500:
+                if self.limiter:
+                    self.limiter.success(time.perf_counter() - start)
+                return response
+            if self.limiter:
+                self.limiter.overload()
+            if attempt == self.retries:
+                return response
+            response.close()
+            delay = self._retry_after(response)
+            if delay is None:
+                delay = self.backoff * 2**attempt
+            logger.info(
+                f"{request.url} answered {response.status_code}, retry in {delay}s"
+            )
+            time.sleep(delay)
+
+    def _retry_after(self, response: httpx.Response) -> float | None:
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def _write_cache_file(self, path: Path, content: bytes):
+        file_descriptor, temporary_path = mkstemp(
+            dir=path.parent, prefix=f".{path.name}"
+        )
+        with open(file_descriptor, "wb") as temporary_file:
+            temporary_file.write(content)
+        os.replace(temporary_path, path)
+
+    def _object_opener(self, url: str, size: int = None) -> Callable:
+        """Create a callable, that opens the object (optionally at an offset)."""
+
+        def opener(offset: int = 0):
+            @contextmanager
+            def open_object():
+                stream = ObjectStream(self, url, offset, size)
+                try:
+                    yield stream
+                finally:
+                    stream.close()
+
+            return open_object
+
+        return opener
+
+
+class ObjectStream(RawIOBase):
+    """Read an ARAS object over HTTP.
+
+    If the connection breaks before all bytes are read, the transfer is resumed with a
+    Range request from the current position."""
+
+    def __init__(
+        self, storage: ArasStorage, url: str, offset: int = 0, size: int = None
+    ):
+        self.url = url
+        self.position = offset
+        self.size = size
+        self._storage = storage
+        self._response = None
+        # the concurrency slot is held for the whole transfer
+        self._exit_stack = ExitStack()
+        self._exit_stack.enter_context(storage._slot())
+        try:
+            self._connect()
+        except BaseException:
+            self._exit_stack.close()
+            raise
+
+    def _connect(self):
+        headers = {"Range": f"bytes={self.position}-"} if self.position else {}
+        request = self._storage.client.build_request("GET", self.url, headers=headers)
+        self._response = self._storage._send(request)
+        self._response.raise_for_status()
+        self._chunks = self._response.iter_bytes()
+        self._buffer = b""
+        if self.position and self._response.status_code != 206:
+            logger.warning(f"{self.url} does not support ranges, skip to the offset")
+            skip = self.position
+            while skip > 0 and (chunk := next(self._chunks, b"")):
+                self._buffer = chunk[skip:]
+                skip -= len(chunk)
+
+    def _reconnect(self, attempt: int, reason):
+        if attempt > self._storage.retries:
+            raise reason
+        logger.info(f"Resume {self.url} at byte {self.position} ({reason!r})")
+        self._response.close()
+        self._connect()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        attempt = 0
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+                if self._storage.bytes_bucket:
+                    self._storage.bytes_bucket.consume(len(self._buffer))
+            except StopIteration:
+                if self.size is None or self.position >= self.size:
+                    return 0
+                attempt += 1
+                self._reconnect(attempt, EOFError(f"{self.url} ended prematurely"))
+            except httpx.TransportError as e:
+                attempt += 1
+                self._reconnect(attempt, e)
+        length = min(len(b), len(self._buffer))
+        b[:length] = self._buffer[:length]
+        self._buffer = self._buffer[length:]
+        self.position += length
+        return length
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+        self._exit_stack.close()
+        super().close()
 
 
 export = ArasStorage
@@ -0,0 +1,86 @@
+"""This is the deduplicating directory storage module."""
+
+import os
+import shutil
+from pathlib import Path
+
+from loguru import logger
+
+from wacli.fixity import Digests
+from wacli.plugin_manager import ConfigurationError
+
+from .directory import DirectoryStorage
+
+
+class DedupStorage(DirectoryStorage):
+    """A directory storage, that keeps identical files only once.
+
+    The content is stored in a blob store inside of the directory, named by the
+    SHA-256 digest (.blobs/ab/cd/abcd…). The files in the IDN/file layout are hard
+    links to the blobs, so the storage can be read like a directory storage.
+    """
+
+    def configure(self, configuration):
+        super(DedupStorage, self).configure(
+            {"manifest": ".wacli/manifest.sqlite", **configuration}
+        )
+        if not self.manifest:
+            raise ConfigurationError("A deduplicating storage needs a manifest.")
+        self.blobs = self.path / configuration.get("blobs", ".blobs")
+
+    def _blob_path(self, sha256: str) -> Path:
+        return self.blobs / sha256[:2] / sha256[2:4] / sha256
+
+    def _place(self, temporary_path: Path, path: Path, digests: Digests = None):
+        """Move new content into the blob store and link the path to the blob."""
+        blob = self._blob_path(digests.sha256_hex)
+        if blob.exists():
+            logger.debug(f"{path} has the same content as {blob}")
+            os.unlink(temporary_path)
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temporary_path, blob)
+        if self._same_file(path, blob):
+            # the same content is stored again, renaming a link onto a link of the
+            # same blob would do nothing and leave the temporary link behind
+            logger.debug(f"{path} links {blob} already")
+            return [blob.parent]
+        try:
+            os.link(blob, temporary_path)
+        except OSError as e:
+            logger.warning(f"Could not link {path} to {blob}, store a copy: {e}")
+            shutil.copyfile(blob, temporary_path)
+        os.replace(temporary_path, path)
+        return [blob.parent, path.parent]
+
+    def _retrieve(self, path, mode, callback):
+        # a file is written as a new file, the linked blob must not be overwritten
+        if "w" in mode and path.is_file():
+            path.unlink()
+        return super(DedupStorage, self)._retrieve(path, mode, callback)
+
+    def stats(self) -> dict:
+        """Get the number of files and bytes stored, and the ratio of the logical to
+        the unique bytes."""
+        summary = self.manifest.summary()
+        summary["saved_bytes"] = summary["bytes"] - summary["unique_bytes"]
+        summary["dedup_ratio"] = (
+            summary["bytes"] / summary["unique_bytes"]
+            if summary["unique_bytes"]
+            else 1.0
+        )
+        return summary
+
+    def collect_garbage(self) -> int:
+        """Remove the blobs, that are not linked by any file anymore."""
+        removed = 0
+        for subdir, _, files in os.walk(self.blobs):
+            for file in files:
+                blob = Path(subdir) / file
+                if blob.stat().st_nlink <= 1:
+                    blob.unlink()
+                    removed += 1
+        return removed
+
+
+export = DedupStorage
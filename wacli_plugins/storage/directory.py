@@ -1,17 +1,27 @@
 """This is the directory storage module."""
 
+import hashlib
+import os
+from collections import deque
 from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
 from io import DEFAULT_BUFFER_SIZE, TextIOBase
 from os import listdir, walk
-from os.path import exists, isdir, isfile
-from pathlib import Path
+from os.path import exists, isfile
+from pathlib import Path, PurePosixPath
+from threading import Lock
 from typing import IO
 
 from loguru import logger
 from warcio.exceptions import ArchiveLoadFailed
 
+from wacli.fixity import ChecksumMismatchError, Digests
+from wacli.manifest import Manifest
 from wacli.plugin_manager import ConfigurationError
 from wacli.plugin_types import StoragePlugin, StorageStream, StoreItem
+from wacli.progress import ProgressBatch
+from wacli.transfer import copy_file_zero, copy_stream, is_regular_file
 from wacli_plugins.catalog.graph import RDF, RDFS, WASE
 
 
@@ -25,7 +35,39 @@ class DirectoryStorage(StoragePlugin):
                 "A path needs to be set to a not empty value for a directory storage."
             )
         self.path = Path(path)
+        # a sharded layout puts the IDNs in directories named by the hash of the IDN,
+        # e.g. ab/cd/<idn>/ with a depth of 2 and a width of 2
+        self.shard_depth = int(configuration.get("shard_depth", 0))
+        self.shard_width = int(configuration.get("shard_width", 2))
         self.catalog = configuration.get("catalog", None)
+        # with index, list and list_files read the manifest instead of the directory
+        self.index = configuration.get("index", False)
+        self.manifest = None
+        if manifest := configuration.get(
+            "manifest", ".wacli/manifest.sqlite" if self.index else None
+        ):
+            self.manifest = Manifest(self.path / manifest)
+        elif self.index:
+            raise ConfigurationError(
+                "The index of a directory storage needs a manifest."
+            )
+        # files are written to a temporary file and renamed when they are complete,
+        # the renames are delayed, until a batch of files is synced to the disk
+        self.buffer_size = int(
+            configuration.get("buffer_size", max(DEFAULT_BUFFER_SIZE, 128 * 1024))
+        )
+        self.preallocate = configuration.get("preallocate", True)
+        # unchanged local files (with a path in their metadata) are hard linked
+        self.hardlink = configuration.get("hardlink", False)
+        # the compression of the WARC files, that operations write to the storage
+        # (gzip or zstd), with an optional zstd dictionary file or size to train
+        self.compression = configuration.get("compression")
+        self.zstd_dictionary = configuration.get("zstd_dictionary")
+        self.zstd_dictionary_size = int(configuration.get("zstd_dictionary_size", 0))
+        self.fsync = configuration.get("fsync", True)
+        self.fsync_batch = int(configuration.get("fsync_batch", 16))
+        self._pending_commits = []
+        self._commit_lock = Lock()
 
     def store(
         self,
@@ -35,45 +77,105 @@ class DirectoryStorage(StoragePlugin):
         callback: Callable = None,
     ):
         """Create a file with the given id as name in the directory."""
-        self._store_data(self.path / id, data, metadata, callback)
+        self._store_data(self._path(id), data, metadata, callback)
+        self._flush_commits()
 
     def _store_data(self, path, data, metadata, callback=None):
         callbacks = []
         logger.debug(f"source metadata: {metadata}")
-        buffer_size = max(DEFAULT_BUFFER_SIZE, 128 * 1024)
         if source_callback := metadata.get("callback", False):
             logger.debug("register source_callback")
             callbacks.append(source_callback)
 
+        size = int(metadata["size"]) if metadata.get("size") is not None else None
+        if self.manifest:
+            key = self._manifest_key(path)
+            if self.manifest.is_complete(key, path, size, metadata.get("checksum")):
+                logger.debug(f"Skip {path}, it is already stored completely")
+                return
+            self.manifest.begin(key, size, metadata.get("checksum"))
+
+        temporary_path = self._temporary_path(path)
+        if linked := self._link(metadata, temporary_path, path, size):
+            # the metadata of a local source does not need to hold the size
+            linked_size = linked.stat().st_size
+            if callback:
+                callbacks.append(callback)
+            progress = ProgressBatch(callbacks, name=path, total=size or linked_size)
+            progress.advance(linked_size)
+            progress.complete()
+            if linked == temporary_path:
+                self._commit(temporary_path, path, size)
+            return
+
+        if digests := self._verify_partial(temporary_path, size, metadata):
+            # the file was written completely, before the process stopped
+            if callback:
+                callbacks.append(callback)
+            progress = ProgressBatch(callbacks, name=path, total=size)
+            progress.advance(size)
+            progress.complete()
+            self._commit(temporary_path, path, size, digests)
+            return
+
+        offset = 0
+        if resume := metadata.get("resume"):
+            offset = self._partial_size(temporary_path, size)
+            if offset:
+                logger.debug(f"Resume {path} at byte {offset}")
+                data = resume(offset)
+
         with data() as source_io:
-            if isinstance(source_io, TextIOBase):
-                mode = "w"
-            else:
-                mode = getattr(source_io, "mode", "wb")
+            # text sources are encoded, so the target is always written binary
+            mode = "ab" if offset else "wb"
+            if mode == "wb":
+                # a new file, a link to another file must not be overwritten
+                temporary_path.unlink(missing_ok=True)
 
-            target, target_metadata = self._retrieve(path, mode, callback)
+            target, target_metadata = self._retrieve(temporary_path, mode, callback)
             if target_callback := target_metadata.get("callback", False):
                 callbacks.append(target_callback)
+            progress = ProgressBatch(callbacks, name=path, total=size)
+            progress.advance(offset)
+
+            # hash while copying, so the fixity is known without reading the file again
+            digests = None
+            if self.manifest or metadata.get("checksum"):
+                digests = Digests(metadata.get("checksum"))
+                if offset:
+                    digests.update_from_file(temporary_path, offset)
+
+            def on_chunk(chunk):
+                if digests:
+                    digests.update(chunk)
+                progress.advance(len(chunk))
+
             try:
                 with target() as target_io:
-                    source_io.wacli_read = source_io.read
-                    while chunk := source_io.wacli_read(buffer_size):
-                        try:
-                            target_io.write(chunk)
-                        except TypeError:
-                            logger.debug("overwrite source_io.wacli_read")
-                            target_io.write(chunk.encode("utf-8"))
-                            source_io.wacli_read = lambda buffer_size: source_io.read(
-                                buffer_size
-                            ).encode("utf-8")
-                        for callback in callbacks:
-                            callback(
-                                advance=buffer_size,
-                                total=metadata["size"],
-                                name=path,
+                    if mode == "wb" and size and self.preallocate:
+                        self._preallocate(target_io, size)
+                    try:
+                        if not (
+                            digests is None
+                            and self._copy_file_zero(
+                                source_io, target_io, progress.advance
+                            )
+                        ):
+                            copy_stream(
+                                source_io, target_io, self.buffer_size, on_chunk
                             )
-            except (UnicodeEncodeError, ArchiveLoadFailed) as e:
+                    finally:
+                        progress.flush()
+                        # cut the preallocated space, also if the transfer is
+                        # interrupted, so it can be resumed from the written bytes
+                        if mode == "wb":
+                            target_io.truncate()
+                progress.complete()
+                if digests:
+                    digests.verify()
+            except (UnicodeEncodeError, ArchiveLoadFailed, ChecksumMismatchError) as e:
                 logger.debug(f"Report Exception for id={path}: {e}")
+                temporary_path.unlink(missing_ok=True)
                 if self.catalog:
                     # TODO get from path to id/IRI again
                     self.catalog.report(
@@ -85,33 +187,262 @@ class DirectoryStorage(StoragePlugin):
                             (RDFS.comment, f"{e}"),
                         ],
                     )
+                return
+
+        self._commit(temporary_path, path, size, digests)
+
+    def _copy_file_zero(self, source_io, target_io, report: Callable) -> bool:
+        """Copy local files without passing the data through the interpreter."""
+        if isinstance(source_io, TextIOBase):
+            return False
+        if not (is_regular_file(source_io) and is_regular_file(target_io)):
+            return False
+        return copy_file_zero(source_io, target_io, report)
+
+    def _link(
+        self, metadata: dict, temporary_path: Path, path: Path, size: int = None
+    ) -> Path | None:
+        """Hard link the local file of the source, if the storage is configured to.
+
+        The metadata of a source, that is not changed, holds the path of the file.
+        Files, whose digests are needed, are copied instead. Returns the temporary
+        path, that links the file, the path, if it links the file already (e.g. the
+        file was stored before), or None, if the file is not linked."""
+        source = metadata.get("path")
+        if not (self.hardlink and source) or self.manifest or metadata.get("checksum"):
+            return None
+        if self._same_file(path, source) and (
+            size is None or path.stat().st_size == size
+        ):
+            logger.debug(f"{path} links {source} already")
+            return path
+        try:
+            temporary_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path.unlink(missing_ok=True)
+            os.link(source, temporary_path)
+        except OSError as e:
+            logger.debug(f"Could not link {source}: {e}")
+            return None
+        if size is not None and temporary_path.stat().st_size != size:
+            temporary_path.unlink()
+            return None
+        logger.debug(f"Linked {temporary_path} to {source}")
+        return temporary_path
+
+    def _same_file(self, path: Path, other) -> bool:
+        """Check, if both paths exist and are links to the same file."""
+        try:
+            return os.path.samefile(path, other)
+        except OSError:
+            return False
+
+    def _temporary_path(self, path: Path) -> Path:
+        return path.with_name(f".{path.name}.part")
+
+    def _preallocate(self, target_io, size: int):
+        """Reserve the space for the file at once, to avoid fragmentation."""
+        try:
+            os.posix_fallocate(target_io.fileno(), 0, size)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not preallocate {size} bytes: {e}")
+
+    def _partial_size(self, path: Path, size: int = None) -> int:
+        """Get the size of a partially written file, that can be resumed."""
+        if size is None or not isfile(path):
+            return 0
+        stat = path.stat()
+        if stat.st_nlink > 1:
+            return 0
+        # a file of the full size may be complete, if the process stopped before it
+        # was renamed, but without a checksum (see _verify_partial) it can not be
+        # told from a corrupt file, so it is written again from the start
+        return stat.st_size if stat.st_size < size else 0
+
+    def _verify_partial(self, path: Path, size: int, metadata: dict) -> Digests | None:
+        """Check a temporary file of the full size against the checksum of the
+        source, return its digests, if it is complete."""
+        checksum = metadata.get("checksum")
+        if not checksum or size is None or not isfile(path):
+            return None
+        stat = path.stat()
+        if stat.st_nlink > 1 or stat.st_size != size:
+            return None
+        digests = Digests(checksum)
+        digests.update_from_file(path, size)
+        try:
+            digests.verify()
+        except ChecksumMismatchError as e:
+            logger.debug(f"{path} is not complete: {e}")
+            return None
+        logger.debug(f"{path} is complete, it is not transferred again")
+        return digests
+
+    def _shard(self, id: str, depth: int = None, width: int = None) -> list[str]:
+        """Get the shard directories of the first component of an id."""
+        depth = self.shard_depth if depth is None else depth
+        width = self.shard_width if width is None else width
+        if not depth:
+            return []
+        digest = hashlib.md5(
+            PurePosixPath(id).parts[0].encode(), usedforsecurity=False
+        ).hexdigest()
+        return [digest[i * width : (i + 1) * width] for i in range(depth)]
+
+    def _path(self, id) -> Path:
+        """Resolve the id (e.g. <idn>/<file>) to the path in the layout."""
+        return self.path.joinpath(*self._shard(str(id)), id)
+
+    def _manifest_key(self, path: Path) -> str:
+        """Get the id of a path in the layout, as used by the manifest."""
+        parts = path.relative_to(self.path).parts
+        return PurePosixPath(*parts[self.shard_depth :]).as_posix()
+
+    def _commit(self, temporary_path: Path, path: Path, size: int = None, digests=None):
+        """Move a completely written temporary file to its path.
+
+        Files that are shorter than announced by the source are kept as temporary
+        file and are resumed the next time."""
+        temporary_size = temporary_path.stat().st_size
+        if size is not None and temporary_size != size:
+            logger.warning(f"{path} has {temporary_size} bytes, expected {size} bytes")
+            return
+        with self._commit_lock:
+            self._pending_commits.append((temporary_path, path, digests))
+            if not self.fsync or len(self._pending_commits) >= self.fsync_batch:
+                self._flush_commits_locked()
+
+    def _flush_commits(self):
+        with self._commit_lock:
+            self._flush_commits_locked()
+
+    def _flush_commits_locked(self):
+        """Sync the pending files to the disk, then rename them to their paths."""
+        if self.fsync:
+            for temporary_path, _, _ in self._pending_commits:
+                file_descriptor = os.open(temporary_path, os.O_RDONLY)
+                try:
+                    os.fsync(file_descriptor)
+                finally:
+                    os.close(file_descriptor)
+        directories = set()
+        for temporary_path, path, digests in self._pending_commits:
+            directories.update(self._place(temporary_path, path, digests))
+            if self.manifest:
+                self._complete(path, digests)
+        if self.fsync:
+            for directory in directories:
+                file_descriptor = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(file_descriptor)
+                finally:
+                    os.close(file_descriptor)
+        self._pending_commits = []
+
+    def _place(self, temporary_path: Path, path: Path, digests: Digests = None):
+        """Move the complete file to its path, return the changed directories."""
+        if self._same_file(temporary_path, path):
+            # renaming a link onto a link of the same file does nothing
+            os.unlink(temporary_path)
+            return []
+        os.replace(temporary_path, path)
+        return [path.parent]
+
+    def _complete(self, path: Path, digests: Digests = None):
+        """Record a completely written file in the manifest."""
+        stat = path.stat()
+        self.manifest.complete(
+            self._manifest_key(path),
+            stat.st_size,
+            stat.st_mtime_ns,
+            sha256=digests.sha256_hex if digests else None,
+            sha1=digests.warc_sha1 if digests else None,
+        )
 
     def store_stream(
         self,
         stream: StorageStream,
         callback: Callable = None,
+        jobs: int = 1,
     ):
-        """Write a StorageStream to the directory."""
-        self._store_stream(self.path, stream, callback)
+        """Write a StorageStream to the directory.
+
+        With jobs > 1 the files are written by a bounded pool of worker threads and
+        nested streams (e.g. the files of an IDN) are expanded concurrently.
+        """
+        try:
+            if jobs > 1:
+                self._store_stream_concurrent(PurePosixPath(), stream, callback, jobs)
+            else:
+                self._store_stream(PurePosixPath(), stream, callback)
+        finally:
+            self._flush_commits()
 
     def _store_stream(self, path, stream, callback: Callable):
         for id, data, metadata in stream:
             if isinstance(data, Callable):
-                self._store_data(path / id, data, metadata, callback)
+                self._store_data(self._path(path / id), data, metadata, callback)
             else:
                 self._store_stream(path / id, data, callback)
 
+    def _store_stream_concurrent(self, path, stream, callback: Callable, jobs: int):
+        with (
+            ThreadPoolExecutor(jobs, thread_name_prefix="wacli-expand") as expanders,
+            ThreadPoolExecutor(jobs, thread_name_prefix="wacli-store") as writers,
+        ):
+            pending = set()
+            expansions = deque()
+
+            def submit(path, data, metadata):
+                nonlocal pending
+                # bound the work in flight, so the source is only read ahead a bit
+                while len(pending) >= 2 * jobs:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(
+                    writers.submit(
+                        self._store_data, self._path(path), data, metadata, callback
+                    )
+                )
+
+            def drain(keep: int):
+                while len(expansions) > keep:
+                    for leaf in expansions.popleft().result():
+                        submit(*leaf)
+
+            for id, data, metadata in stream:
+                if isinstance(data, Callable):
+                    submit(path / id, data, metadata)
+                else:
+                    expansions.append(
+                        expanders.submit(self._flatten_stream, path / id, data)
+                    )
+                    drain(keep=jobs)
+            drain(keep=0)
+            for future in pending:
+                future.result()
+
+    def _flatten_stream(self, path, stream) -> list:
+        """Resolve a nested stream to a list of (id, data, metadata) leafs."""
+        leafs = []
+        for id, data, metadata in stream:
+            if isinstance(data, Callable):
+                leafs.append((path / id, data, metadata))
+            else:
+                leafs.extend(self._flatten_stream(path / id, data))
+        return leafs
+
     def retrieve(
         self, id: str, mode: str = "r", callback: Callable = None
     ) -> StoreItem:
         if mode not in ["r", "w", "rb", "wb"]:
             raise Exception("Only 'r', 'w', 'rb', and 'wb' modes are supported.")
-        return self._retrieve(self.path / id, mode, callback)
+        return self._retrieve(self._path(id), mode, callback)
 
     def _retrieve(self, path, mode, callback):
-        if "w" in mode:
+        if "w" in mode or "a" in mode:
             path.parent.mkdir(parents=True, exist_ok=True)
-        return lambda: open(path, mode), {"callback": callback}
+        return lambda: open(path, mode), {"callback": callback, "path": str(path)}
 
     def retrieve_stream(
         self, selector, mode: str = "r", callback: Callable = None
@@ -124,7 +455,7 @@ class DirectoryStorage(StoragePlugin):
         if not selector:
             raise Exception("DirectoryStorage needs a list of explicite IDs")
 
-        return self._retrieve_stream(self.path, selector, mode, callback)
+        return self._retrieve_stream(None, selector, mode, callback)
 
     def _retrieve_stream(
         self, path, selector, mode: str = "r", callback: Callable = None
@@ -133,29 +464,125 @@ class DirectoryStorage(StoragePlugin):
             raise Exception("Only 'r', 'w', 'rb', and 'wb' modes are supported.")
 
         for id in selector:
-            if not exists(path / id) or isfile(path / id):
+            # the ids at the top are resolved in the layout
+            id_path = self._path(id) if path is None else path / id
+            if not exists(id_path) or isfile(id_path):
                 yield (
                     id,
-                    *self._retrieve(path / id, mode, callback),
+                    *self._retrieve(id_path, mode, callback),
                 )
             else:
+                # partial downloads and the state of the storage are no entries
+                entries = [e for e in listdir(id_path) if not self._is_internal(e)]
                 yield (
                     id,
-                    self._retrieve_stream(
-                        path / id, listdir(path / id), mode, callback
-                    ),
+                    self._retrieve_stream(id_path, entries, mode, callback),
                     {},
                 )
 
     def list(self) -> list:
-        return [d for d in listdir(self.path) if isdir(self.path / d)]
+        if self._use_index():
+            return self.manifest.idns()
+        return [
+            path.name for path in self._top_level(self.shard_depth) if path.is_dir()
+        ]
+
+    def _top_level(self, depth: int):
+        """Get the entries below the shard directories of the given depth."""
+        parents = [self.path]
+        for _ in range(depth + 1):
+            parents = [
+                entry
+                for parent in parents
+                if parent.is_dir()
+                for entry in sorted(parent.iterdir())
+                if not self._is_internal(entry.name)
+            ]
+        return parents
+
+    def _is_shard_directory(self, path: Path) -> bool:
+        """Check if the path is a shard directory of the configured layout, e.g. to
+        continue an interrupted relayout."""
+        parts = path.relative_to(self.path).parts
+        return len(parts) <= self.shard_depth and all(
+            len(part) == self.shard_width and all(c in "0123456789abcdef" for c in part)
+            for part in parts
+        )
 
-    def list_files(self, filter_fn=None) -> list:
+    def relayout(self, shard_depth: int = 0, shard_width: int = 2) -> int:
+        """Move the entries from the given layout to the configured layout.
+
+        The ids and the manifest are not changed. Returns the number of moved
+        entries."""
+        moved = 0
+        for entry in self._top_level(shard_depth):
+            if self._is_shard_directory(entry) or entry.parent != self.path.joinpath(
+                *self._shard(entry.name, shard_depth, shard_width)
+            ):
+                continue
+            target = self._path(entry.name)
+            if target == entry:
+                continue
+            if target.exists():
+                raise FileExistsError(f"Can not move {entry}, {target} exists")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(entry, target)
+            moved += 1
+            # remove the emptied shard directories of the old layout
+            parent = entry.parent
+            while parent != self.path and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+        return moved
+
+    def list_files(self, filter_fn=None, pattern: str = None) -> list:
+        """List the stored files, optionally filtered by a function on the file name
+        and by a glob pattern on the path relative to the storage."""
+        if self._use_index():
+            for key in self.manifest.paths(pattern):
+                path = self._path(key)
+                if filter_fn is None or filter_fn(path.name):
+                    yield path
+            return
         for subdir, dirs, files in walk(self.path):
             subdir_p = Path(subdir)
+            dirs[:] = [d for d in dirs if not self._is_internal(d)]
+            files = [f for f in files if not self._is_internal(f)]
             files = filter(filter_fn, files) if filter_fn else files
             for file in files:
-                yield subdir_p / file
+                if pattern is None or fnmatch(
+                    self._manifest_key(subdir_p / file), pattern
+                ):
+                    yield subdir_p / file
+
+    def reindex(self) -> int:
+        """Rebuild the index from the files in the directory.
+
+        This is needed, if files were added or changed without the storage."""
+        if not self.manifest:
+            raise ConfigurationError("The directory storage has no manifest to index.")
+        return self.manifest.reindex(self._scan())
+
+    def _scan(self):
+        for subdir, dirs, files in walk(self.path):
+            dirs[:] = [d for d in dirs if not self._is_internal(d)]
+            for file in files:
+                if not self._is_internal(file):
+                    path = Path(subdir) / file
+                    stat = path.stat()
+                    yield self._manifest_key(path), stat.st_size, stat.st_mtime_ns
+
+    def _use_index(self) -> bool:
+        if not self.index:
+            return False
+        if not self.manifest.indexed:
+            logger.info(f"Build the index of {self.path}")
+            self.reindex()
+        return True
+
+    def _is_internal(self, name: str) -> bool:
+        """Hidden entries hold the state of the storage (e.g. the manifest)."""
+        return name.startswith(".")
 
 
 export = DirectoryStorage
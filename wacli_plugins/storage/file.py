@@ -16,7 +16,9 @@ class FileStorage(DirectoryStorage):
         path = configuration.get("path")
         if path is None:
             raise ConfigurationError("The path can not be None.")
-        self.path = Path(dirname(path))
+        super(FileStorage, self).configure(
+            {**configuration, "path": dirname(path) or "."}
+        )
         self.id = Path(basename(path))
 
     def store(